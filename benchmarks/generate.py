@@ -0,0 +1,124 @@
+"""
+Seeded generator of realistic SOLS AUTO files of every FileType, in new CSV and old .dat formats.
+
+The same seed always generates the same files, old files are the conversion of the new ones so both formats hold the
+same records.
+"""
+import random
+from datetime import date, timedelta
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List
+
+from cli_sols_auto.parser_sols_auto.schema import compile_new2old
+from cli_sols_auto.parser_sols_auto.tools import batched, FileType, NEW_NAMES
+
+BRAND_CODE = "JAC"
+
+
+class _Records:
+    """
+    Pools of values records are drawn from, a few stores and days with many barcodes like real files
+    """
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.stores = [f"{BRAND_CODE}-{rng.randint(1, 999999)}" for _ in range(200)]
+        start = date(2021, 1, 1)
+        self.dates = [(start + timedelta(days)).isoformat() for days in range(730)]
+        self.barcodes = [f"{rng.randint(0, 10 ** 13 - 1):013d}" for _ in range(5000)]
+
+    def time(self) -> str:
+        rng = self.rng
+        return f"{rng.randint(8, 20):02d}-{rng.randint(0, 59):02d}-{rng.randint(0, 59):02d}"
+
+    def sales(self) -> str:
+        rng = self.rng
+        quantity = -1 if rng.random() < 0.03 else rng.choice((1, 1, 1, 1, 2, 3, 12))
+        cents = rng.randint(1, 99999)
+        line = (f"{rng.choice(self.stores)};{rng.choice(self.dates)};{self.time() if rng.random() < 0.9 else ''};"
+                f"{rng.randint(1, 9999999)};{rng.choice(self.barcodes)};{quantity};{cents // 100}.{cents % 100:02d};"
+                f"{rng.randint(1, 9)}")
+        return line + f";{rng.choice(self.stores)}" if rng.random() < 0.05 else line
+
+    def traffic(self) -> str:
+        rng = self.rng
+        line = f"{rng.choice(self.stores)};{rng.choice(self.dates)};{rng.randint(0, 2000)}"
+        return line + f";{rng.randint(0, 500)}" if rng.random() < 0.5 else line
+
+    def interstore_transfer(self) -> str:
+        rng = self.rng
+        return (f"{rng.choice(self.dates)};{self.time() if rng.random() < 0.5 else ''};{rng.choice(self.stores)};"
+                f"{rng.choice(self.stores)};{rng.choice(self.barcodes)};{rng.randint(1, 50)}")
+
+    def delivery_validation(self) -> str:
+        rng = self.rng
+        line = (f"{rng.choice(self.stores)};{rng.randint(0, 10 ** 14):020d};{rng.choice(self.barcodes)};"
+                f"{rng.randint(1, 24)};{rng.choice(self.dates)}")
+        return line + f";{self.time()}" if rng.random() < 0.5 else line
+
+
+def new_lines(file_type: FileType, count: int, seed: int = 0) -> Iterator[str]:
+    """
+    Generate count lines of file_type in new CSV format
+
+    >>> list(new_lines(FileType.TRF, 2, seed=1)) == list(new_lines(FileType.TRF, 2, seed=1))
+    True
+    """
+    records = _Records(random.Random(f"{seed}-{file_type.value}"))
+    generators: Dict[FileType, Callable[[], str]] = {
+        FileType.TRF: records.traffic,
+        FileType.TRS: records.interstore_transfer,
+        FileType.VAL: records.delivery_validation,
+        FileType.VEN: records.sales,
+    }
+    generator = generators[file_type]
+    return (generator() for _ in range(count))
+
+
+def old_lines(file_type: FileType, count: int, seed: int = 0) -> Iterator[str]:
+    """
+    Generate count records of file_type in old .dat format
+    """
+    return map(compile_new2old(file_type), new_lines(file_type, count, seed))
+
+
+def write_lines(file: Path, lines: Iterator[str]) -> Path:
+    with file.open("w", encoding="utf-8") as output:
+        first = True
+        for batch in batched(lines, 10_000):
+            if not first:
+                output.write("\n")
+            output.write("\n".join(batch))
+            first = False
+    return file
+
+
+def generate(directory: Path, file_type: FileType, count: int, old: bool = False, seed: int = 0,
+             files: int = 1) -> List[Path]:
+    """
+    Generate files of count lines of file_type in directory, named like production files. Files already generated
+    with the same parameters are reused
+
+    :param directory: Directory where to write the files
+    :param file_type: Type of the files
+    :param count: Number of lines of every file
+    :param old: Generate old .dat files instead of new CSV files
+    :param seed: Seed of the generator
+    :param files: Number of files, every file holds the following lines of the same sequence
+    :return: the generated files
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    name = file_type.title() if old else NEW_NAMES[file_type]
+    lines = (old_lines if old else new_lines)(file_type, count * files, seed)
+    paths = []
+    for index in range(files):
+        path = directory / f"{name}_{seed}_{count}_{index}.{'dat' if old else 'csv'}"
+        if path.exists():
+            # skip the lines of the existing file to keep the sequence identical
+            for _ in islice(lines, count):
+                pass
+        else:
+            write_lines(path.with_suffix(".tmp"), islice(lines, count)).rename(path)
+        paths.append(path)
+    return paths
@@ -0,0 +1,178 @@
+"""
+Benchmark the conversions of every FileType in both directions on generated files and save the results as JSON.
+
+Every measure runs in a fresh process so its peak RSS only accounts for the measured conversion.
+
+EXAMPLE OF USAGE :
+python benchmarks/run.py --sizes=10k,1M,10M --output=benchmarks/results/run.json
+python benchmarks/run.py --sizes=10k --types=VEN --directions=new2old --engines=python,numpy
+python benchmarks/run.py --compare benchmarks/results/before.json benchmarks/results/after.json
+"""
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import click
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.generate import BRAND_CODE, generate  # noqa: E402
+from cli_sols_auto.parser_sols_auto.tools import FileType  # noqa: E402
+
+SIZES = {"k": 1_000, "M": 1_000_000}
+WORKLOADS = ("parse", "handle", "small_files")
+
+
+def parse_size(size: str) -> int:
+    """
+    >>> parse_size("10k"), parse_size("1M"), parse_size("250")
+    (10000, 1000000, 250)
+    """
+    if size[-1] in SIZES:
+        return int(size[:-1]) * SIZES[size[-1]]
+    return int(size)
+
+
+def _peak_rss() -> int:
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _measure(workload: str, files: List[str], file_type: str, direction: str, engine: str, output_dir: str) -> Dict:
+    from cli_sols_auto import app
+    from cli_sols_auto.parser_sols_auto import new, old
+    import cli_sols_auto.tools as tools
+
+    tools.logger.setLevel("WARNING")
+    file_type, paths = FileType(file_type), [Path(file) for file in files]
+    brand_code = BRAND_CODE if direction == "old2new" else None
+    start = time.perf_counter()
+    if workload == "parse":
+        if brand_code:
+            old.parse(paths[0], file_type, brand_code)
+        else:
+            new.parse(paths[0], file_type)
+    elif workload == "handle":
+        app.handle(Path(output_dir), paths[0], file_type, brand_code, engine=engine)
+    else:
+        app.convert_files(Path(output_dir), paths, file_type, brand_code, engine=engine)
+    return {"seconds": time.perf_counter() - start, "peak_rss": _peak_rss()}
+
+
+def measure(workload: str, files: List[Path], file_type: FileType, direction: str, engine: str, lines: int) -> Dict:
+    """
+    Convert files in a fresh process and compute the throughput of the conversion
+    """
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as output_dir, context.Pool(1) as pool:
+        result = pool.apply(_measure, (workload, [str(file) for file in files], file_type.value, direction, engine,
+                                       output_dir))
+    size = sum(file.stat().st_size for file in files)
+    result.update({
+        "workload": workload,
+        "file_type": file_type.value,
+        "direction": direction,
+        "engine": engine,
+        "files": len(files),
+        "lines": lines,
+        "bytes": size,
+        "rows_per_second": lines / result["seconds"],
+        "mb_per_second": size / result["seconds"] / 1_000_000,
+        "seconds_per_file": result["seconds"] / len(files),
+    })
+    return result
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _key(result: Dict) -> tuple:
+    return tuple(result[name] for name in ("workload", "file_type", "direction", "engine", "files", "lines"))
+
+
+def compare(before: Path, after: Path):
+    """
+    Print the throughput ratio of the measures of after over the same measures of before
+    """
+    previous = {_key(result): result for result in json.loads(before.read_text(encoding="utf-8"))["results"]}
+    for result in json.loads(after.read_text(encoding="utf-8"))["results"]:
+        reference = previous.get(_key(result))
+        if reference:
+            ratio = result["rows_per_second"] / reference["rows_per_second"]
+            click.echo(f"{' '.join(map(str, _key(result)))} : {ratio:.2f}x "
+                       f"({reference['rows_per_second']:,.0f} -> {result['rows_per_second']:,.0f} rows/s)")
+
+
+@click.command()
+@click.option('--sizes', default="10k,1M,10M", show_default=True, help='Comma separated numbers of lines')
+@click.option('--types', default=",".join(t.value for t in FileType), show_default=True,
+              help='Comma separated file types')
+@click.option('--directions', default="new2old,old2new", show_default=True, help='Comma separated directions')
+@click.option('--engines', default="python", show_default=True,
+              help='Comma separated engines measured by the handle workload')
+@click.option('--workloads', default=",".join(WORKLOADS), show_default=True,
+              help='Comma separated workloads: parse (new.parse/old.parse), handle (app.handle of one big file), '
+                   'small_files (app.convert_files of many files holding the same lines as the big one)')
+@click.option('--small_file_lines', default=100, show_default=True, help='Lines of every file of small_files')
+@click.option('--seed', default=0, show_default=True, help='Seed of the generated files')
+@click.option('--data_dir', type=click.Path(file_okay=False, path_type=Path),
+              default=Path(tempfile.gettempdir()) / "sols_auto_bench", show_default=True,
+              help='Directory where generated files are kept between runs')
+@click.option('--output', type=click.Path(dir_okay=False, path_type=Path), help='JSON file where to save the results')
+@click.option('--compare', 'compared', nargs=2, type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help='Compare the results of two runs instead of running the benchmarks')
+def main(sizes, types, directions, engines, workloads, small_file_lines, seed, data_dir, output, compared):
+    if compared:
+        compare(*compared)
+        return
+    results = []
+    for file_type in map(FileType, types.split(",")):
+        for direction in directions.split(","):
+            old = direction == "old2new"
+            for lines in map(parse_size, sizes.split(",")):
+                big = generate(data_dir, file_type, lines, old=old, seed=seed)
+                for workload in workloads.split(","):
+                    for engine in (engines.split(",") if workload != "parse" else ["python"]):
+                        if workload == "small_files":
+                            count = max(1, lines // small_file_lines)
+                            files = generate(data_dir, file_type, small_file_lines, old=old, seed=seed, files=count)
+                            result = measure(workload, files, file_type, direction, engine, count * small_file_lines)
+                        else:
+                            result = measure(workload, big, file_type, direction, engine, lines)
+                        results.append(result)
+                        click.echo(f"{workload:<11} {file_type.value} {direction} {engine:<6} {lines:>10} lines "
+                                   f"{result['files']:>6} file(s) : {result['rows_per_second']:>12,.0f} rows/s "
+                                   f"{result['mb_per_second']:>8.2f} MB/s {result['peak_rss'] / 2 ** 20:>8.1f} MiB "
+                                   f"{result['seconds_per_file'] * 1000:>10.3f} ms/file")
+    report = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": seed,
+        },
+        "results": results,
+    }
+    output = output or Path(__file__).parent / "results" / f"{datetime.datetime.now():%Y%m%d%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=1), encoding="utf-8")
+    click.echo(f"Results saved in {output}")
+
+
+if __name__ == '__main__':
+    main()
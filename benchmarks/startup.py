@@ -0,0 +1,56 @@
+"""
+Measure the time to convert a one line file with a fresh interpreter, and fail when it exceeds a budget.
+
+Every run starts a new process like a container invocation does, so the measure covers interpreter startup, imports
+and the conversion itself.
+
+EXAMPLE OF USAGE :
+python benchmarks/startup.py --budget=250
+python benchmarks/startup.py --budget=200 --command="python sols_auto.pyz"
+"""
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import click
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def measure(command: list, runs: int) -> list:
+    """
+    Wall time in seconds of runs conversions of a one line traffic file by command
+    """
+    times = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = Path(tmp_dir) / "Traffic_20220329.csv"
+        file.write_text("JAC-778;2022-03-29;8", encoding="utf-8")
+        arguments = ["new2old", f"--output_dir={tmp_dir}", "--parse_type=TRF", "--jobs=1", str(file)]
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(command + arguments, check=True, cwd=ROOT, stdout=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+    return times
+
+
+@click.command()
+@click.option('--budget', type=float, default=250, show_default=True,
+              help='Maximum median time in milliseconds of a conversion')
+@click.option('--runs', type=click.IntRange(min=1), default=20, show_default=True, help='Number of conversions')
+@click.option('--command', default=f"{shlex.quote(sys.executable)} -m cli_sols_auto", show_default=True,
+              help='Command running the converter')
+def main(budget, runs, command):
+    times = measure(shlex.split(command), runs)
+    median = statistics.median(times) * 1000
+    click.echo(f"{command} : median {median:.1f} ms, min {min(times) * 1000:.1f} ms, max {max(times) * 1000:.1f} ms "
+               f"over {runs} runs (budget {budget:.0f} ms)")
+    if median > budget:
+        raise click.ClickException(f"Startup budget exceeded by {median - budget:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Build the converter as a single file zipapp holding precompiled bytecode only, so no module is compiled at startup.
+
+The bytecode is specific to the version of the interpreter running this script, build with the interpreter which
+will run the archive (see dockerfile). Dependencies (click, colorlog) are not bundled.
+
+EXAMPLE OF USAGE :
+python build_zipapp.py --output=sols_auto.pyz
+python sols_auto.pyz new2old --output_dir=/srv/out/ --parse_type=VEN /srv/in/
+"""
+import py_compile
+import tempfile
+import zipapp
+from pathlib import Path
+
+import click
+
+ROOT = Path(__file__).resolve().parent
+PACKAGE = "cli_sols_auto"
+# legacy script, not importable
+EXCLUDED = {"new2old.py"}
+
+
+def build(output: Path, interpreter: str = "/usr/bin/env python3") -> Path:
+    with tempfile.TemporaryDirectory() as staging:
+        for source in (ROOT / PACKAGE).rglob("*.py"):
+            if source.name in EXCLUDED:
+                continue
+            # zipimport loads module.pyc stored next to where module.py would be
+            target = Path(staging) / source.relative_to(ROOT).with_suffix(".pyc")
+            py_compile.compile(str(source), cfile=str(target), dfile=str(source.relative_to(ROOT)), doraise=True,
+                               invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+        zipapp.create_archive(staging, output, interpreter=interpreter, main=f"{PACKAGE}.app:cli")
+    return output
+
+
+@click.command()
+@click.option('--output', type=click.Path(dir_okay=False, path_type=Path), default=ROOT / "sols_auto.pyz",
+              show_default=True, help='Archive to build')
+@click.option('--python', default="/usr/bin/env python3", show_default=True, help='Interpreter of the shebang line')
+def main(output, python):
+    click.echo(f"Built {build(output, python)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+from cli_sols_auto.app import cli
+
+if __name__ == '__main__':
+    cli(prog_name="cli_sols_auto")
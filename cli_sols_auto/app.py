@@ -1,54 +1,155 @@
 import datetime
+import fnmatch
+import functools
+import os
 import re
+import threading
+import time
+from contextlib import closing, contextmanager, nullcontext
+from itertools import chain, islice
 from pathlib import Path
-from typing import List
+from typing import Any, AnyStr, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
 
 import click
-from click.exceptions import BadParameter, NoSuchOption
+from click.exceptions import BadParameter, ClickException, NoSuchOption
 
-from cli_sols_auto.parser_sols_auto import new_parser, old_parser
 import cli_sols_auto.tools as tools
-from cli_sols_auto.parser_sols_auto.tools import FileType
+from cli_sols_auto import profiling
+from cli_sols_auto.parser_sols_auto.tools import (check_lines, CHUNK_SIZE, compress_output, compression,
+                                                  COMPRESSIONS, DIRECTIONS, ENGINES, FileType, iter_lines, NEW_NAMES,
+                                                  read_lines, write_batches)
+
+# Startup time matters for small files: modules only needed by some commands or options are imported where they
+# are used
+if TYPE_CHECKING:  # pragma: no cover
+    from cli_sols_auto.follow import Increment
+    from cli_sols_auto.metrics import FileMetrics, RunMetrics
+
+AUTO = "auto"  # --parse_type detecting the type of every file
+STDIO = "-"  # INPUT_FILES converting the standard input to the standard output
+REJECT = "reject"  # --on_error rejecting the lines which can not be converted
+ON_ERRORS = ("fail", REJECT)
+MAX_ERROR_RATE = 0.01
 
 
 @click.group()
+@click.option('--profile', type=click.Path(dir_okay=False, path_type=Path),
+              help='Profile the command with cProfile, write the statistics to this .pstats file and print the '
+                   'hottest functions')
+@click.option('--trace_memory', is_flag=True,
+              help='Trace memory allocations and print the peak and the top allocation sites of every file')
 @click.pass_context
-def cli(ctx):
-    pass
+def cli(ctx, profile, trace_memory):
+    """
+    Convert SOLS AUTO files between old (.dat) and new (.csv) versions
+
+    Profiling and memory tracing only cover the main process, use --jobs=1 to profile the conversion of several
+    files or of a file split in chunks.
+    """
+    if profile:
+        ctx.with_resource(profiling.profile(profile))
+    if trace_memory:
+        ctx.with_resource(profiling.trace_memory_run())
 
 
 @cli.command()
 @click.option('--output_dir', help='Directory where to output converted files. If ommited outputs in the original '
                                    'directory')
-@click.option('--parse_type', required=True, help='The type of file and parser to use (VEN, TRF, TRA, VAL)')
+@click.option('--parse_type', required=True,
+              help='The type of file and parser to use (VEN, TRF, TRS, VAL), auto detects the type of every file from '
+                   'its name or else from its first line')
 @click.option('-v', '--verbose', count=True, help='Enable DEBUG logging verbosity')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=lambda: os.cpu_count() or 1,
+              help='Number of files converted in parallel. Defaults to the number of CPUs')
+@click.option('--chunk_size', type=click.IntRange(min=1), default=CHUNK_SIZE, show_default=True,
+              help='Size in bytes of the chunks a single file is split into to be converted by several jobs')
+@click.option('--engine', type=click.Choice(ENGINES), default="python", show_default=True,
+              help='Conversion engine, numpy handles the fields of whole batches of lines at once and falls back to '
+                   'python when NumPy is not installed, bytes converts ASCII files without decoding them')
+@click.option('--manifest', is_flag=True,
+              help='Only convert new or modified files, converted files are recorded in a manifest of the output '
+                   'directory')
+@click.option('--metrics', 'metrics_file', type=click.Path(dir_okay=False, path_type=Path),
+              help='File where to write the timings and throughput of every file and of the run, as JSON lines or '
+                   'as a Prometheus textfile collector file when its name ends with .prom')
+@click.option('--compress', type=click.Choice(sorted(COMPRESSIONS)),
+              help='Compress converted files with gzip, bzip2 or xz. Compressed inputs are detected from their suffix')
+@click.option('--include', multiple=True,
+              help='Only convert the files whose name matches this pattern, may be repeated')
+@click.option('--exclude', multiple=True,
+              help='Leave out the files and directories whose name matches this pattern, may be repeated')
+@click.option('--archive', is_flag=True,
+              help='INPUT_FILES are zip or tar archives, the members of every archive are converted in memory into '
+                   'one output archive, one member after the other in a single process: --jobs only converts '
+                   'several archives at once. --compress then sets the compression of the output archives')
+@click.option('--totals', is_flag=True,
+              help='Write the control totals of every converted file (rows, quantity, revenue in cents per store and '
+                   'date range) to a JSON summary next to it, named after it with .totals.json')
+@click.option('--on_error', type=click.Choice(ON_ERRORS), default="fail", show_default=True,
+              help='What to do with a line which can not be converted, fail the whole file or reject the line to a '
+                   '.rejects file next to the output with its line number and the reason')
+@click.option('--max_error_rate', type=click.FloatRange(min=0, max=1), default=MAX_ERROR_RATE, show_default=True,
+              help='With --on_error=reject, a file still fails once more than this rate of its lines are rejected')
+@click.option('--follow', is_flag=True,
+              help='Only convert the complete lines appended to every file since the previous run and append them to '
+                   'its output, files truncated or rewritten since are converted again')
 @click.argument('input_files')
-def new2old(output_dir, parse_type, verbose, input_files):
+def new2old(output_dir, parse_type, verbose, jobs, chunk_size, engine, manifest, metrics_file, compress, include,
+            exclude, archive, totals, on_error, max_error_rate, follow, input_files):
     """
     Convert file from new to old version
 
-    INPUT_FILES : File(s) to convert. This could consist in a file path, a directory path or a pattern
-                 (see examples provided).
+    INPUT_FILES : File(s) to convert. This could consist in a file path, a directory path or a pattern, ** matches
+                 any number of directories (see examples provided). - converts the standard input to the standard
+                 output.
 
     EXAMPLE OF USAGE :
     app.py new2old --output_dir=/srv/out/ --parse_type=VEN /srv/in/Sales_20220301.csv
     app.py new2old --output_dir=/srv/out/ --parse_type=TRF /srv/in/
+    app.py new2old --output_dir=/srv/out/ --parse_type=auto /srv/in/
     app.py new2old --output_dir=/../304/ --parse_type=VEN /srv/in/Sales_*.csv
+    app.py new2old --output_dir=/srv/out/ --parse_type=VEN --exclude=processed --exclude='*_test.csv' '/srv/in/**'
+    app.py new2old --output_dir=/srv/out/ --parse_type=VEN --jobs=4 /srv/in/
+    app.py new2old --output_dir=/srv/out/ --parse_type=VEN --engine=numpy /srv/in/
+    app.py new2old --output_dir=/srv/out/ --parse_type=VEN --manifest /srv/in/
+    app.py new2old --output_dir=/srv/out/ --parse_type=VEN --compress=gz /srv/in/Sales_*.csv.gz
+    app.py new2old --output_dir=/srv/out/ --parse_type=VEN --archive /srv/in/stores_*.zip
+    app.py new2old --output_dir=/srv/out/ --parse_type=VEN --on_error=reject --max_error_rate=0.001 /srv/in/
+    app.py new2old --output_dir=/srv/out/ --parse_type=VEN --follow /srv/in/Sales_20220301.csv
+    zcat /srv/in/Sales_20220301.csv.gz | app.py new2old --parse_type=VEN - | gzip > /srv/out/Ven_20220301.dat.gz
+    app.py new2old --output_dir=/srv/out/ --parse_type=VEN --metrics=/var/lib/node_exporter/sols_auto.prom /srv/in/
 
     """
 
+    if input_files.startswith("'"):
+        input_files = input_files[1:-1]
+    if input_files == STDIO:
+        # the standard output carries the converted lines, the very first log goes to the standard error
+        click.get_current_context().with_resource(_logs_to_stderr())
     if verbose:
         tools.logger.setLevel("DEBUG")
         tools.logger.debug("DEBUG MODE [ON] don't forget to turn it off in production environment")
     else:
         tools.logger.setLevel("INFO")
 
-    if input_files.startswith("'"):
-        input_files = input_files[1:-1]
     tools.logger.debug(f"input_files = {input_files}")
-    file_list = get_file_list(input_files)
-
-    if not len(file_list):
+    if input_files == STDIO:
+        _convert_stdio(parse_type, None, engine, compress, manifest=manifest, metrics=metrics_file, archive=archive,
+                       totals=totals, on_error=on_error == REJECT, follow=follow)
+        return
+    _check_archive_options(archive, totals=totals, follow=follow)
+    _check_follow_options(follow, manifest=manifest, totals=totals, on_error=on_error == REJECT)
+    metrics = None
+    if metrics_file:
+        from cli_sols_auto.metrics import RunMetrics
+        metrics = RunMetrics()
+    file_list = iter_files(input_files, include, exclude)
+    if metrics is not None:
+        file_list = metrics.discover(file_list)
+    first_file = next(file_list, None)
+    file_list = chain([first_file], file_list)
+
+    if first_file is None:
         raise BadParameter(f"No file found in input {input_files}")
 
     if output_dir:
@@ -61,54 +162,119 @@ def new2old(output_dir, parse_type, verbose, input_files):
             output_directory = output_directory.parent
             tools.logger.warning(f"{output_dir} is a file using {output_directory} instead")
     else:
-        output_directory = file_list[0].parent
+        output_directory = first_file.parent
         tools.logger.info(f"output directory is None using {output_directory} instead")
 
     tools.logger.debug(f"Parse_type = {parse_type}")
-    try:
-        parse_type = FileType(parse_type)
-    except ValueError:
-        tools.logger.fatal(f"{parse_type} does not exists")
-        raise NoSuchOption(f"{parse_type} does not exists")
+    parse_type = _file_type(parse_type)
 
-    for file in file_list:
-        handle(output_directory, file, parse_type)
+    try:
+        convert_files(output_directory, file_list, parse_type, jobs=jobs, chunk_size=chunk_size, engine=engine,
+                      manifest=manifest, metrics=metrics, compress=compress, archive=archive, totals=totals,
+                      on_error=on_error, max_error_rate=max_error_rate, follow=follow)
+    finally:
+        if metrics is not None:
+            metrics.write(metrics_file)
 
 
 @cli.command()
 @click.option('--output_dir', help='Directory where to output converted files. If ommited outputs in the original '
                                    'directory')
-@click.option('--parse_type', required=True, help='The type of file and parser to use (VEN, TRF, TRA, VAL)')
+@click.option('--parse_type', required=True,
+              help='The type of file and parser to use (VEN, TRF, TRS, VAL), auto detects the type of every file from '
+                   'its name or else from its first line')
 @click.option('-v', '--verbose', count=True, help='Enable DEBUG logging verbosity')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=lambda: os.cpu_count() or 1,
+              help='Number of files converted in parallel. Defaults to the number of CPUs')
+@click.option('--chunk_size', type=click.IntRange(min=1), default=CHUNK_SIZE, show_default=True,
+              help='Size in bytes of the chunks a single file is split into to be converted by several jobs')
+@click.option('--engine', type=click.Choice(ENGINES), default="python", show_default=True,
+              help='Conversion engine, numpy decodes whole batches of records at once and falls back to python when '
+                   'NumPy is not installed, bytes converts ASCII files without decoding them')
+@click.option('--manifest', is_flag=True,
+              help='Only convert new or modified files, converted files are recorded in a manifest of the output '
+                   'directory')
+@click.option('--metrics', 'metrics_file', type=click.Path(dir_okay=False, path_type=Path),
+              help='File where to write the timings and throughput of every file and of the run, as JSON lines or '
+                   'as a Prometheus textfile collector file when its name ends with .prom')
+@click.option('--compress', type=click.Choice(sorted(COMPRESSIONS)),
+              help='Compress converted files with gzip, bzip2 or xz. Compressed inputs are detected from their suffix')
+@click.option('--include', multiple=True,
+              help='Only convert the files whose name matches this pattern, may be repeated')
+@click.option('--exclude', multiple=True,
+              help='Leave out the files and directories whose name matches this pattern, may be repeated')
+@click.option('--archive', is_flag=True,
+              help='INPUT_FILES are zip or tar archives, the members of every archive are converted in memory into '
+                   'one output archive, one member after the other in a single process: --jobs only converts '
+                   'several archives at once. --compress then sets the compression of the output archives')
+@click.option('--totals', is_flag=True,
+              help='Write the control totals of every converted file (rows, quantity, revenue in cents per store and '
+                   'date range) to a JSON summary next to it, named after it with .totals.json')
+@click.option('--on_error', type=click.Choice(ON_ERRORS), default="fail", show_default=True,
+              help='What to do with a line which can not be converted, fail the whole file or reject the line to a '
+                   '.rejects file next to the output with its line number and the reason')
+@click.option('--max_error_rate', type=click.FloatRange(min=0, max=1), default=MAX_ERROR_RATE, show_default=True,
+              help='With --on_error=reject, a file still fails once more than this rate of its lines are rejected')
+@click.option('--follow', is_flag=True,
+              help='Only convert the complete lines appended to every file since the previous run and append them to '
+                   'its output, files truncated or rewritten since are converted again')
 @click.argument('input_files')
 @click.argument('brand_code')
-def old2new(output_dir, parse_type, verbose, input_files, brand_code):
+def old2new(output_dir, parse_type, verbose, jobs, chunk_size, engine, manifest, metrics_file, compress, include,
+            exclude, archive, totals, on_error, max_error_rate, follow, input_files, brand_code):
     """
     Convert file from old to new version
 
-    INPUT_FILES : File(s) to convert. This could consist in a file path, a directory path or a pattern
-                 (see examples provided).
+    INPUT_FILES : File(s) to convert. This could consist in a file path, a directory path or a pattern, ** matches
+                 any number of directories (see examples provided). - converts the standard input to the standard
+                 output.
     BRAND_CODE : Brand code that will be use to prefix store codes
 
     EXAMPLE OF USAGE :
     app.py old2new --output_dir=/app/out/ --parse_type=VEN /app/in/Ven_20220301.dat OKA
     app.py old2new --output_dir=/app/out/ --parse_type=TRF /app/in/ JAC
+    app.py old2new --output_dir=/app/out/ --parse_type=auto /app/in/ JAC
     app.py old2new --output_dir=/../304/ --parse_type=VEN /srv/in/Ven*.dat JAC
+    app.py old2new --output_dir=/app/out/ --parse_type=auto --include='Ven*' --include='Trf*' '/app/in/**' JAC
+    app.py old2new --output_dir=/app/out/ --parse_type=VEN --jobs=4 /app/in/ JAC
+    app.py old2new --output_dir=/app/out/ --parse_type=VEN --engine=numpy /app/in/ JAC
+    app.py old2new --output_dir=/app/out/ --parse_type=VEN --manifest /app/in/ JAC
+    app.py old2new --output_dir=/app/out/ --parse_type=VEN --compress=xz /app/in/Ven*.dat JAC
+    app.py old2new --output_dir=/app/out/ --parse_type=VEN --archive /app/in/stores_*.tar.gz JAC
+    app.py old2new --parse_type=VEN - JAC < /app/in/Ven_20220301.dat > /app/out/Sales_20220301.csv
+    app.py old2new --output_dir=/app/out/ --parse_type=VEN --metrics=/app/out/metrics.jsonl /app/in/ JAC
 
     """
 
+    if input_files.startswith("'"):
+        input_files = input_files[1:-1]
+    if input_files == STDIO:
+        # the standard output carries the converted lines, the very first log goes to the standard error
+        click.get_current_context().with_resource(_logs_to_stderr())
     if verbose:
         tools.logger.setLevel("DEBUG")
         tools.logger.debug("DEBUG MODE [ON] don't forget to turn it off in production environment")
     else:
         tools.logger.setLevel("INFO")
 
-    if input_files.startswith("'"):
-        input_files = input_files[1:-1]
     tools.logger.debug(f"input_files = {input_files}")
-    file_list = get_file_list(input_files)
-
-    if not len(file_list):
+    if input_files == STDIO:
+        _convert_stdio(parse_type, brand_code, engine, compress, manifest=manifest, metrics=metrics_file,
+                       archive=archive, totals=totals, on_error=on_error == REJECT, follow=follow)
+        return
+    _check_archive_options(archive, totals=totals, follow=follow)
+    _check_follow_options(follow, manifest=manifest, totals=totals, on_error=on_error == REJECT)
+    metrics = None
+    if metrics_file:
+        from cli_sols_auto.metrics import RunMetrics
+        metrics = RunMetrics()
+    file_list = iter_files(input_files, include, exclude)
+    if metrics is not None:
+        file_list = metrics.discover(file_list)
+    first_file = next(file_list, None)
+    file_list = chain([first_file], file_list)
+
+    if first_file is None:
         tools.logger.fatal(f"No file found in input {input_files}")
         raise BadParameter(f"No file found in input {input_files}")
 
@@ -122,46 +288,443 @@ def old2new(output_dir, parse_type, verbose, input_files, brand_code):
             output_directory = output_directory.parent
             tools.logger.warning(f"{output_dir} is a file using {output_directory} instead")
     else:
-        output_directory = file_list[0].parent
+        output_directory = first_file.parent
         tools.logger.info(f"output directory is None using {output_directory} instead")
 
     tools.logger.debug(f"Parse_type = {parse_type}")
     tools.logger.debug(f"Brand_code = {brand_code}")
+    parse_type = _file_type(parse_type)
+
+    try:
+        convert_files(output_directory, file_list, parse_type, brand_code, jobs=jobs, chunk_size=chunk_size,
+                      engine=engine, manifest=manifest, metrics=metrics, compress=compress, archive=archive,
+                      totals=totals, on_error=on_error, max_error_rate=max_error_rate, follow=follow)
+    finally:
+        if metrics is not None:
+            metrics.write(metrics_file)
+
+
+def _file_type(parse_type: str) -> Optional[FileType]:
+    """
+    FileType of the --parse_type option, None for auto
+    """
     try:
-        parse_type = FileType(parse_type)
+        return None if parse_type == AUTO else FileType(parse_type)
     except ValueError:
         tools.logger.fatal(f"{parse_type} does not exists")
         raise NoSuchOption(f"{parse_type} does not exists")
 
-    for file in file_list:
-        handle(output_directory, file, parse_type, brand_code)
+
+def _check_archive_options(archive: bool, **unsupported):
+    """
+    Fail when options which do not apply to archives are used with --archive
+    """
+    for option, value in unsupported.items():
+        if archive and value:
+            raise BadParameter(f"--{option} can not be used with --archive")
 
 
-def get_file_list(input_dir: str) -> List[Path]:
+def _check_follow_options(follow: bool, **unsupported):
+    """
+    Fail when options which do not apply to appended lines are used with --follow
     """
-    Get files as a list of Path from the CLI argument provided
+    for option, value in unsupported.items():
+        if follow and value:
+            raise BadParameter(f"--{option} can not be used with --follow")
+
+
+@contextmanager
+def _logs_to_stderr():
+    """
+    Write the logs to the standard error instead of the standard output
+    """
+    from cli_sols_auto.tools.logger_config import console_handler
+    log_stream = console_handler.setStream(click.get_text_stream("stderr"))
+    try:
+        yield
+    finally:
+        console_handler.setStream(log_stream)
+
+
+def _convert_stdio(parse_type: str, brand_code: Optional[str], engine: str, compress: Optional[str], **unsupported):
+    """
+    Convert the standard input to the standard output, logs must already be written to the standard error
+    """
+    for option, value in unsupported.items():
+        if value:
+            raise BadParameter(f"--{option} can not be used with {STDIO} as INPUT_FILES")
+    parse_type = _file_type(parse_type)
+    output = click.get_binary_stream("stdout")
+    try:
+        count = convert_stream(click.get_binary_stream("stdin"), output, parse_type, brand_code, engine, compress)
+        tools.logger.debug(f"Content generated : {count} lines")
+    except BrokenPipeError:
+        # the reader of the standard output is gone, stop without another error when Python flushes it at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), output.fileno())
+        raise click.exceptions.Exit(1)
+
+
+@cli.command()
+@click.option('--output_dir', required=True, type=click.Path(exists=True, file_okay=False, path_type=Path),
+              help='Directory where to output converted files')
+@click.option('--parse_type', required=True, type=click.Choice([t.value for t in FileType] + [AUTO]),
+              help='The type of file and parser to use, auto detects the type of every file')
+@click.option('--direction', required=True, type=click.Choice(DIRECTIONS),
+              help='Convert files from new to old version or from old to new version')
+@click.option('--brand_code', help='Brand code that will be use to prefix store codes, required by old2new')
+@click.option('-v', '--verbose', count=True, help='Enable DEBUG logging verbosity')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=lambda: os.cpu_count() or 1,
+              help='Maximum number of files converted at a time. Defaults to the number of CPUs')
+@click.option('--engine', type=click.Choice(ENGINES), default="python",
+              show_default=True, help='Conversion engine (see new2old and old2new)')
+@click.option('--interval', type=click.FloatRange(min=0), default=2.0, show_default=True,
+              help='Seconds between two scans of the input directories')
+@click.option('--settle', type=click.FloatRange(min=0), default=5.0, show_default=True,
+              help='Seconds the size of a file must not change for it to be considered complete')
+@click.option('--marker', help='Suffix of the marker files written once files are complete (e.g. .ok), files are '
+                               'converted once their marker exists instead of waiting for their size to settle')
+@click.option('--pattern', default='*', show_default=True, help='Pattern of the names of the files to convert')
+@click.option('--processed_dir', type=click.Path(exists=True, file_okay=False, path_type=Path),
+              help='Directory where to move files once converted. If ommited converted files are left in place and '
+                   'only converted again when they change')
+@click.argument('input_dirs', nargs=-1, required=True,
+                type=click.Path(exists=True, file_okay=False, path_type=Path))
+def watch(output_dir, parse_type, direction, brand_code, verbose, jobs, engine, interval, settle, marker, pattern,
+          processed_dir, input_dirs):
+    """
+    Watch directories and convert files as soon as they are complete, until SIGTERM or SIGINT is received.
+    Running conversions are finished before exiting.
+
+    INPUT_DIRS : Directories to watch
+
+    EXAMPLE OF USAGE :
+    app.py watch --output_dir=/app/out/ --parse_type=VEN --direction=new2old /app/in/
+    app.py watch --output_dir=/app/out/ --parse_type=TRF --direction=old2new --brand_code=JAC --marker=.ok /app/in/
+    app.py watch --output_dir=/app/out/ --parse_type=VEN --direction=new2old --processed_dir=/app/done/ /app/in/
 
-    :param input_dir: provided input string, can be a file, a path or a pattern
-    :return: a list of pathlib's Path like object
     """
-    if '*' in input_dir:
-        *paths_to_dir, pattern = input_dir.split('/')
-        path_to_dir: Path = Path('/').joinpath(*paths_to_dir)
-        tools.logger.debug(f"input_files is a pattern : {pattern} in {path_to_dir}")
-        files: List[Path] = [file for file in path_to_dir.glob(pattern) if file.is_file()]
+    if verbose:
+        tools.logger.setLevel("DEBUG")
+        tools.logger.debug("DEBUG MODE [ON] don't forget to turn it off in production environment")
     else:
-        input_path: Path = Path(input_dir)
-        if not input_path.exists():
-            tools.logger.fatal(f"{input_path} does not exists")
-            raise RuntimeError(f"{input_path} does not exists")
+        tools.logger.setLevel("INFO")
+
+    if direction == 'old2new' and not brand_code:
+        raise BadParameter("--brand_code is required to convert from old to new version")
+    if direction == 'new2old':
+        brand_code = None
+
+    from cli_sols_auto.watcher import stop_on_signals, Watcher
 
-        if input_path.is_file():
-            files: List[Path] = [input_path]
+    parse_type = None if parse_type == AUTO else FileType(parse_type)
+    convert = functools.partial(handle, output_dir, parse_type=parse_type, brand_code=brand_code, engine=engine)
+    watcher = Watcher(input_dirs, convert, jobs=jobs, interval=interval, settle=settle, marker=marker,
+                      pattern=pattern, processed_dir=processed_dir)
+    stop = threading.Event()
+    stop_on_signals(stop)
+    watcher.run(stop)
+
+
+@cli.command()
+@click.option('--socket', 'socket_path', type=click.Path(dir_okay=False, path_type=Path),
+              help='Unix socket where to listen, listens on localhost HTTP when omitted')
+@click.option('--host', default='127.0.0.1', show_default=True, help='Address where to listen for HTTP')
+@click.option('--port', type=click.IntRange(min=0, max=65535), default=8080, show_default=True,
+              help='Port where to listen for HTTP')
+@click.option('-v', '--verbose', count=True, help='Enable DEBUG logging verbosity')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=lambda: os.cpu_count() or 1,
+              help='Number of worker processes converting requests. Defaults to the number of CPUs')
+@click.option('--max_requests', type=click.IntRange(min=1),
+              help='Maximum number of conversions accepted at a time, others are refused with 503. Defaults to '
+                   'twice the number of jobs')
+@click.option('--engine', type=click.Choice(ENGINES), default="python", show_default=True,
+              help='Conversion engine of the requests which do not name one (see new2old and old2new)')
+@click.option('--root', type=click.Path(exists=True, file_okay=False, path_type=Path),
+              help='Directory holding the local files which can be converted by path, paths are refused when omitted')
+def serve(socket_path, host, port, verbose, jobs, max_requests, engine, root):
+    """
+    Serve conversions over localhost HTTP or a Unix socket until SIGTERM or SIGINT is received.
+    Running conversions are finished before exiting.
+
+    POST /convert?direction=new2old&parse_type=VEN converts the body of the request and answers the converted lines,
+    parse_type defaults to auto, brand_code is required by old2new, a path parameter converts a local file under --root
+    instead of the body and a name parameter names the body for type and compression detection.
+    GET /health answers the state of the service as JSON, GET /metrics its counters for Prometheus.
+
+    EXAMPLE OF USAGE :
+    app.py serve --port=8080 --jobs=4
+    app.py serve --socket=/run/sols_auto.sock --root=/in
+    curl --data-binary @Sales_20220301.csv 'http://127.0.0.1:8080/convert?direction=new2old&parse_type=VEN'
+    curl --unix-socket /run/sols_auto.sock -X POST 'http://x/convert?direction=old2new&brand_code=JAC&path=/in/Ven.dat'
+
+    """
+    if verbose:
+        tools.logger.setLevel("DEBUG")
+        tools.logger.debug("DEBUG MODE [ON] don't forget to turn it off in production environment")
+    else:
+        tools.logger.setLevel("INFO")
+
+    from cli_sols_auto.server import ConversionServer
+    from cli_sols_auto.watcher import stop_on_signals
+
+    server = ConversionServer(socket_path or (host, port), jobs=jobs, max_requests=max_requests, engine=engine,
+                              root=root)
+    stop = threading.Event()
+    stop_on_signals(stop)
+    server.serve(stop)
+
+
+def convert_files(outdir: Path, file_list: Iterable[Path], parse_type: Optional[FileType], brand_code: str = None,
+                  jobs: int = 1, chunk_size: int = CHUNK_SIZE, engine: str = "python", manifest: bool = False,
+                  metrics: "RunMetrics" = None, compress: str = None, archive: bool = False, totals: bool = False,
+                  on_error: str = "fail", max_error_rate: float = MAX_ERROR_RATE, follow: bool = False):
+    """
+    Convert every file of file_list, in a pool of jobs processes when there is more than one file to convert.
+    A single file is split in chunks of chunk_size bytes converted by jobs processes instead. file_list may be a lazy
+    iterator, files are converted as they come. Files of outdir which were not there before the run are outputs of
+    the run, they are never converted.
+
+    A failing file does not stop the others from being converted, failures are logged and reported at the end.
+
+    :param outdir: Directory where to output converted files
+    :param file_list: Files to convert
+    :param parse_type: Type of the files (see enum cli_sols_auto.parse_sols_auto.tools.FileType), None detects the
+                       type of every file
+    :param brand_code: Brand code to prefix store codes with, converts from old to new version when provided
+    :param jobs: Maximum number of worker processes
+    :param chunk_size: Size in bytes of the chunks a single file is split into
+    :param engine: name of the conversion engine
+    :param manifest: Skip the files the manifest of outdir records as converted and record the converted ones
+    :param metrics: Run metrics the metrics of every converted file are added to
+    :param compress: Compression of the converted files, one of COMPRESSIONS
+    :param archive: Files are zip or tar archives whose members are converted into an output archive
+    :param totals: Write the control totals of every converted file next to its output, see handle
+    :param on_error: fail, or reject the lines which can not be converted, see handle
+    :param max_error_rate: Highest rate of rejected lines of a file before it fails
+    :param follow: Only convert the lines appended to files since the previous run, appended to the previous output.
+                   The follow state of outdir records up to where every file is converted, see cli_sols_auto.follow
+    """
+    options = {"parse_type": parse_type.value if parse_type else AUTO, "brand_code": brand_code}
+    if compress:
+        options["compress"] = compress
+    if archive:
+        options["archive"] = True
+    if totals:
+        options["totals"] = True
+    if on_error == REJECT:
+        options.update(on_error=on_error, max_error_rate=max_error_rate)
+    converted = follow_state = None
+    increments = {}
+    skipped = 0
+    # outputs are written while files are still discovered, those of the run must not be converted in turn
+    output_directory = os.path.abspath(outdir)
+    try:
+        with os.scandir(outdir) as entries:
+            existing = {entry.name for entry in entries}
+    except FileNotFoundError:
+        existing = set()
+
+    def inputs(files: Iterable[Path]) -> Iterator[Path]:
+        for file in files:
+            if file.name not in existing and os.path.abspath(file.parent) == output_directory:
+                continue
+            yield file
+
+    file_list = inputs(file_list)
+    if follow:
+        from cli_sols_auto.follow import FOLLOW_NAME, FollowState
+        follow_state = FollowState(outdir)
+
+        def appended(files: Iterable[Path]) -> Iterator[Path]:
+            nonlocal skipped, failures, total
+            for file in files:
+                if file.name == FOLLOW_NAME:
+                    continue
+                try:
+                    increment = follow_state.increment(file, **options)
+                except (OSError, ValueError) as e:
+                    failures, total = failures + 1, total + 1
+                    tools.logger.error(f"Conversion of {file} failed : {e!r}")
+                    continue
+                if increment is None:
+                    skipped += 1
+                    continue
+                increments[file] = increment
+                yield file
+
+        file_list = appended(file_list)
+    if manifest:
+        from cli_sols_auto.manifest import Manifest, MANIFEST_NAME, SAVE_INTERVAL
+        converted = Manifest(outdir)
+
+        def pending(files: Iterable[Path]) -> Iterator[Path]:
+            nonlocal skipped
+            for file in files:
+                if file.name == MANIFEST_NAME:
+                    continue
+                if converted.is_converted(file, **options):
+                    skipped += 1
+                    continue
+                yield file
+
+        file_list = pending(file_list)
+
+    failures = total = 0
+
+    def finished(file: Path, output: Path, file_metrics: Optional["FileMetrics"],
+                 file_fingerprint: Optional[Dict[str, Any]]):
+        if converted is not None:
+            # saved as the run goes so that a killed run does not convert the same files again
+            converted.record(file, output, file_fingerprint, **options)
+            converted.save(SAVE_INTERVAL)
+        if follow_state is not None:
+            # output is closed, saved at once so that a killed run does not append the same lines again
+            follow_state.record(file, output, increments.pop(file).end, **options)
+            follow_state.save()
+        if file_metrics is not None:
+            metrics.files.append(file_metrics)
+
+    # Files may still be discovered, only the first jobs files are known before converting
+    file_list = iter(file_list)
+    first_files = list(islice(file_list, jobs))
+    try:
+        if len(first_files) <= 1:
+            for file in chain(first_files, file_list):
+                total += 1
+                try:
+                    result = _handle(outdir, file, parse_type, brand_code, metrics is not None, archive,
+                                     increments.get(file), converted is not None, jobs=jobs, chunk_size=chunk_size,
+                                     engine=engine, compress=compress, totals=totals, on_error=on_error,
+                                     max_error_rate=max_error_rate)
+                except Exception as e:
+                    failures += 1
+                    tools.logger.error(f"Conversion of {file} failed : {e!r}")
+                    continue
+                finished(file, *result)
         else:
-            tools.logger.debug(f"input_files is a directory : {input_path}")
-            files: List[Path] = [file for file in input_path.iterdir() if file.is_file()]
+            from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+            tools.logger.debug(f"Converting files with {len(first_files)} jobs")
+            profiling.warn_workers("use --jobs=1 to profile every file")
+            with ProcessPoolExecutor(max_workers=len(first_files), initializer=tools.init_worker,
+                                     initargs=(tools.logger.level,)) as executor:
+                futures = {}
+
+                def collect(done):
+                    nonlocal failures
+                    for future in done:
+                        file = futures.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            failures += 1
+                            tools.logger.error(f"Conversion of {file} failed : {e!r}")
+                            continue
+                        finished(file, *result)
+
+                for file in chain(first_files, file_list):
+                    # bound the queue of pending files, discovery goes on as files are converted
+                    if len(futures) >= 2 * len(first_files):
+                        collect(wait(futures, return_when=FIRST_COMPLETED).done)
+                    total += 1
+                    futures[executor.submit(_handle, outdir, file, parse_type, brand_code, metrics is not None,
+                                            archive, increments.get(file), converted is not None, engine=engine,
+                                            compress=compress, totals=totals, on_error=on_error,
+                                            max_error_rate=max_error_rate)] = file
+                collect(wait(futures).done)
+    finally:
+        if skipped:
+            tools.logger.info(f"Skipped {skipped} file(s) " + ("without new complete lines" if follow
+                                                               else "already converted"))
+        if converted is not None:
+            converted.save()
+        if follow_state is not None:
+            follow_state.save()
+        if metrics is not None:
+            metrics.failures += failures
+
+    if failures:
+        raise ClickException(f"{failures} out of {total} file(s) failed to convert")
+
+
+def get_file_list(input_dir: str, include: Iterable[str] = (), exclude: Iterable[str] = ()) -> List[Path]:
+    """
+    Get files as a list of Path from the CLI argument provided, see iter_files
 
-    return files
+    :param input_dir: provided input string, can be a file, a path or a pattern
+    :return: a list of pathlib's Path like object
+    """
+    return list(iter_files(input_dir, include, exclude))
+
+
+def _name_matcher(patterns: Iterable[str]) -> Optional[Callable[[str], Any]]:
+    patterns = list(patterns)
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns)).match
+
+
+def iter_files(input_dir: str, include: Iterable[str] = (), exclude: Iterable[str] = ()) -> Iterator[Path]:
+    """
+    Lazily find the files of the CLI argument provided with os.scandir, files are yielded as soon as they are found.
+
+    Wildcards (*, ?, [...]) may appear in any component of a pattern and a ** component matches any number of
+    directories, e.g. /srv/in/**/Sales_*.csv. Compressed files match the pattern once their compression suffix is
+    removed.
+
+    :param input_dir: provided input string, can be a file, a directory or a pattern
+    :param include: patterns the names of the files must match one of, every file when empty
+    :param exclude: patterns of the names of the files and directories to leave out
+    :return: an iterator over pathlib's Path like objects
+    """
+    included, excluded = _name_matcher(include), _name_matcher(exclude)
+
+    def wanted(name: str) -> bool:
+        return (included is None or included(name)) and not (excluded and excluded(name))
+
+    def walk(directory: str, parts: List[str]) -> Iterator[Path]:
+        part, rest = parts[0], parts[1:]
+        if part == "**":
+            yield from walk(directory, rest or ["*"])
+            with os.scandir(directory or ".") as entries:
+                subdirectories = [entry.name for entry in entries
+                                  if entry.is_dir() and not (excluded and excluded(entry.name))]
+            for name in subdirectories:
+                yield from walk(os.path.join(directory, name), parts)
+        elif rest and not any(char in part for char in "*?["):
+            if os.path.isdir(os.path.join(directory, part)):
+                yield from walk(os.path.join(directory, part), rest)
+        elif rest:
+            match = _name_matcher([part])
+            with os.scandir(directory or ".") as entries:
+                subdirectories = [entry.name for entry in entries if entry.is_dir() and match(entry.name)]
+            for name in subdirectories:
+                yield from walk(os.path.join(directory, name), rest)
+        else:
+            # compressed files match the pattern once their compression suffix is removed
+            match = _name_matcher([part] + [f"{part}.{suffix}" for suffix in COMPRESSIONS if not part.endswith(suffix)])
+            with os.scandir(directory or ".") as entries:
+                for entry in entries:
+                    # DirEntry caches the type of the entry, only symbolic links cost a stat
+                    if entry.is_file() and match(entry.name) and wanted(entry.name):
+                        yield Path(directory, entry.name)
+
+    if any(char in input_dir for char in "*?["):
+        tools.logger.debug(f"input_files is a pattern : {input_dir}")
+        parts = input_dir.split("/")
+        yield from walk("/", parts[1:]) if input_dir.startswith("/") else walk("", parts)
+        return
+
+    input_path: Path = Path(input_dir)
+    if not input_path.exists():
+        tools.logger.fatal(f"{input_path} does not exists")
+        raise RuntimeError(f"{input_path} does not exists")
+
+    if input_path.is_file():
+        if wanted(input_path.name):
+            yield input_path
+    else:
+        tools.logger.debug(f"input_files is a directory : {input_path}")
+        yield from walk(input_dir, ["*"])
 
 
 def output_file_name_old(file_name: str, parse_type: FileType) -> str:
@@ -189,11 +752,18 @@ def output_file_name_old(file_name: str, parse_type: FileType) -> str:
         >>> output_file_name_old("Traffic_20012022_1234.csv", FileType("TRF"))
         'Trf_20012022_1234_....dat'
 
-        """
-    names = dict(zip([t for t in FileType], ('Traffic', 'Transfers', 'Validation', 'Sales')))
+        Nor by compression :
+        >>> output_file_name_old("Traffic_20012022_1234.csv.gz", FileType("TRF"))
+        'Trf_20012022_1234_....dat'
+
+        Files not named after their type, whose type was detected from their content, keep their name :
+        >>> output_file_name_old("export_1234.csv", FileType("TRF"))
+        'Trf_export_1234_....dat'
 
-    pattern = f".*{names.get(parse_type, '')}_(.*).csv"
-    suffix = re.match(pattern, file_name).groups()[0]
+        """
+    pattern = f".*{NEW_NAMES.get(parse_type, '')}_(.*).csv"
+    match = re.match(pattern, file_name)
+    suffix = match.groups()[0] if match else file_name.split(".", 1)[0]
     now = datetime.datetime.now()
     return f"{parse_type.title()}_{suffix}_{now.strftime('%Y%m%d%H%M%S%f')}.dat"
 
@@ -227,31 +797,196 @@ def output_file_name_new(file_name: str, parse_type: FileType) -> str:
     >>> output_file_name_new("Trf_20012022_1234_test_1234_init_MCO.dat", FileType("TRF"))
     'Traffic_20012022_1234_test_1234_init_MCO_....csv'
 
-    """
-
-    names = dict(zip([t for t in FileType], ('Traffic', 'Transfers', 'Validation', 'Sales')))
+    Files not named after their type, whose type was detected from their content, keep their name :
+    >>> output_file_name_new("export_1234.dat", FileType("TRF"))
+    'Traffic_export_1234_....csv'
 
+    """
     pattern = f".*{parse_type.title()}_(.*).dat"
-    suffix = re.match(pattern, file_name).groups()[0]
+    match = re.match(pattern, file_name)
+    suffix = match.groups()[0] if match else file_name.split(".", 1)[0]
 
     now = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
-    return f"{names.get(parse_type, '').title()}_{suffix}_{now}.csv"
+    return f"{NEW_NAMES.get(parse_type, '')}_{suffix}_{now}.csv"
 
 
-def handle(outdir: Path, file: Path, parse_type: FileType, brand_code: str = None):
-    tools.logger.info(f"handling file {file}")
-    tools.logger.info("Running file conversion ...")
+def parse_lines(lines: Iterable[AnyStr], parse_type: FileType, brand_code: str = None,
+                engine: str = "python") -> Iterator[List[AnyStr]]:
+    """
+    Convert lines by batches with engine, from old to new version when brand_code is provided else from new to old
+    """
+    if brand_code:
+        from cli_sols_auto.parser_sols_auto import old
+        return old.get_batch_parser(engine)(lines, parse_type, brand_code)
+    from cli_sols_auto.parser_sols_auto import new
+    return new.get_batch_parser(engine)(lines, parse_type)
 
-    new_content = old_parser(file, parse_type, brand_code) if brand_code else new_parser(file, parse_type)
-    tools.logger.debug(f"Content generated : {len(new_content)} bytes")
 
-    new_name = output_file_name_new(file.name, parse_type) if brand_code else output_file_name_old(file.name, parse_type)
+def convert_stream(source: BinaryIO, output: BinaryIO, parse_type: Optional[FileType], brand_code: str = None,
+                   engine: str = "python", compress: str = None) -> int:
+    """
+    Convert the lines of a binary stream as they come and write them to output, batch by batch
+
+    :param parse_type: Type of the lines, detected from the first line when None
+    :param compress: Compression of output, one of COMPRESSIONS
+    :return: the number of converted lines
+    """
+    lines = iter_lines(source, "<stdin>", binary=engine == "bytes")
+    if parse_type is None:
+        from cli_sols_auto.parser_sols_auto.schema import detect_lines_type
+        parse_type, lines = detect_lines_type(STDIO, lines, old=bool(brand_code))
+        tools.logger.debug(f"Input detected as {parse_type.value}")
+    # output is left open, only a compressing wrapper is closed
+    with compress_output(output, compress) if compress else nullcontext(output) as stream:
+        count = write_batches(parse_lines(lines, parse_type, brand_code, engine), stream)
+    output.flush()
+    return count
+
+
+def detect_type(file: Path, brand_code: str = None) -> FileType:
+    """
+    Detect the FileType of file from its name or else its first line, file is an old file when brand_code is provided
+    """
+    from cli_sols_auto.parser_sols_auto.schema import detect_file_type
+    with closing(read_lines(file)) as first_lines:
+        parse_type = detect_file_type(file.name, first_lines, old=bool(brand_code))
+    tools.logger.debug(f"{file} detected as {parse_type.value}")
+    return parse_type
+
+
+def open_output(outdir: Path, file: Path, parse_type: FileType, brand_code: str = None,
+                compress: str = None) -> Tuple[Path, BinaryIO]:
+    """
+    Create the output of the conversion of file in outdir, named after file
+
+    :return: the output file and a binary stream to write it
+    """
+    # Workers may name outputs in the same microsecond, never overwrite another output
+    while True:
+        new_name = output_file_name_new(file.name, parse_type) if brand_code \
+            else output_file_name_old(file.name, parse_type)
+        if compress:
+            new_name = f"{new_name}.{compress}"
+        new_file = outdir / new_name
+        try:
+            output = new_file.open("xb")
+            break
+        except FileExistsError:
+            tools.logger.debug(f"{new_file} already exists")
     tools.logger.debug(f"Generation new file : {new_name}")
+    return new_file, output
 
-    new_file = outdir / new_name
-    new_file.touch(exist_ok=True)
-    new_file.write_text(new_content)
+
+def handle(outdir: Path, file: Path, parse_type: Optional[FileType], brand_code: str = None, jobs: int = 1,
+           chunk_size: int = CHUNK_SIZE, engine: str = "python", metrics: "FileMetrics" = None,
+           compress: str = None, totals: bool = False, on_error: str = "fail",
+           max_error_rate: float = MAX_ERROR_RATE) -> Path:
+    """
+    Convert file into a file of outdir named after it
+
+    :param totals: Collect the control totals of the file while converting it and write them next to the output,
+                   see cli_sols_auto.totals. The file is then never split in chunks
+    :param on_error: fail on the first line which can not be converted, or reject such lines to a sidecar of the
+                     output and go on, see cli_sols_auto.rejects. Files are then never split in chunks
+    :param max_error_rate: Highest rate of rejected lines before the file fails
+    :return: the converted file
+    """
+    tools.logger.info(f"handling file {file}")
+    tools.logger.info("Running file conversion ...")
+    start = time.perf_counter()
+
+    if not file.exists():
+        raise RuntimeError("File does not exists.")
+    if parse_type is None:
+        parse_type = detect_type(file, brand_code)
+    # compressed files can not be split, totals and rejects are collected in the single pass of the main process
+    chunked = jobs > 1 and file.stat().st_size > chunk_size and not compression(file) and not totals \
+        and on_error != REJECT
+    control_totals = rejects = None
+    if totals:
+        from cli_sols_auto.totals import ControlTotals
+        control_totals = ControlTotals(parse_type)
+    if on_error == REJECT:
+        from cli_sols_auto.rejects import Rejects, REJECTS_SUFFIX
+        rejects = Rejects(max_error_rate)
+    if chunked:
+        tools.logger.debug(f"Converting {file} in chunks of {chunk_size} bytes with {jobs} jobs")
+    else:
+        # lines which can not be decoded are rejected like the lines which can not be converted
+        lines = read_lines(file, binary=engine == "bytes", check=rejects is None)
+        if metrics is not None:
+            lines = metrics.read(lines)
+        # totals are read from old records, the input of old2new and the output of new2old
+        if rejects is not None:
+            def parse_batch(batch: List[bytes]) -> List[AnyStr]:
+                batch = check_lines(batch, binary=engine == "bytes")
+                converted = [line for lines in parse_lines(batch, parse_type, brand_code, engine) for line in lines]
+                # only the source lines which were converted are added up
+                if control_totals is not None and brand_code:
+                    control_totals.add(batch)
+                return converted
+
+            batches = rejects.convert(lines, parse_batch)
+        else:
+            if control_totals is not None and brand_code:
+                lines = control_totals.lines(lines)
+            batches = parse_lines(lines, parse_type, brand_code, engine)
+        if metrics is not None:
+            batches = metrics.parse(batches)
+        if control_totals is not None and not brand_code:
+            batches = control_totals.batches(batches)
+
+    new_file, output = open_output(outdir, file, parse_type, brand_code, compress)
+    if rejects is not None:
+        rejects.path = new_file.with_name(f"{new_file.name}{REJECTS_SUFFIX}")
+
+    try:
+        with output, rejects or nullcontext(), compress_output(output, compress) as stream, \
+                profiling.trace_memory(file) as trace:
+            if chunked:
+                from cli_sols_auto.parser_sols_auto.chunked import convert_chunked
+                profiling.warn_workers(f"use --jobs=1 to profile {file} in one piece")
+                count = convert_chunked(file, stream, parse_type, brand_code, jobs, chunk_size, engine)
+            else:
+                count = write_batches(trace.batches(batches), stream)
+    except BaseException:
+        new_file.unlink()
+        raise
+    if control_totals is not None:
+        tools.logger.debug(f"Control totals : {control_totals.write(file, new_file)}")
+    if metrics is not None:
+        if chunked:
+            # chunks are read, converted and written by the workers at once
+            metrics.seconds["parse"] = time.perf_counter() - start
+        metrics.finish(time.perf_counter() - start, count, new_file)
+    tools.logger.debug(f"Content generated : {count} lines")
     tools.logger.info(f"File outputs : {new_file}")
+    return new_file
+
+
+def _handle(outdir: Path, file: Path, parse_type: FileType, brand_code: str = None, metrics: bool = False,
+            archive: bool = False, increment: "Increment" = None, fingerprint: bool = False,
+            **kwargs) -> Tuple[Path, Optional["FileMetrics"], Optional[Dict[str, Any]]]:
+    """
+    Run handle, convert_archive when archive is set or convert_increment when an increment is given, measuring the
+    conversion when metrics is set. Metrics are returned as workers can not fill a FileMetrics of the main process.
+    The fingerprint of file for the manifest is taken before converting it when fingerprint is set, by the worker
+    """
+    file_fingerprint = file_metrics = None
+    if fingerprint:
+        from cli_sols_auto.manifest import fingerprint as manifest_fingerprint
+        file_fingerprint = manifest_fingerprint(file)
+    if metrics:
+        from cli_sols_auto.metrics import FileMetrics
+        file_metrics = FileMetrics(file)
+    convert = handle
+    if archive:
+        from cli_sols_auto.archive import convert_archive as convert
+    elif increment is not None:
+        from cli_sols_auto.follow import convert_increment as convert
+        kwargs["increment"] = increment
+    output = convert(outdir, file, parse_type, brand_code, metrics=file_metrics, **kwargs)
+    return output, file_metrics, file_fingerprint
 
 
 if __name__ == '__main__':
@@ -0,0 +1,188 @@
+"""
+Conversion of every member of a zip or tar archive into one output archive, without unpacking it to disk.
+
+Members are converted one after the other in memory, spilled to a temporary file past CHUNK_SIZE bytes, and named
+in the output archive the way handle names converted files. Members which are not regular files are left out. The
+lines rejected from a member are added to the output archive next to its output, named after it with .rejects.
+"""
+import datetime
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager, nullcontext
+from pathlib import Path, PurePosixPath
+from typing import AnyStr, BinaryIO, Callable, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+import cli_sols_auto.tools as tools
+from cli_sols_auto import profiling
+from cli_sols_auto.app import output_file_name_new, output_file_name_old, parse_lines, REJECT
+from cli_sols_auto.parser_sols_auto.schema import detect_lines_type
+from cli_sols_auto.parser_sols_auto.tools import check_lines, CHUNK_SIZE, FileType, iter_lines, write_batches
+from cli_sols_auto.rejects import Rejects, REJECTS_SUFFIX
+
+if TYPE_CHECKING:  # pragma: no cover
+    from cli_sols_auto.metrics import FileMetrics
+
+TAR_COMPRESSIONS = {".tar": "", ".tar.gz": "gz", ".tgz": "gz", ".tar.bz2": "bz2", ".tbz2": "bz2", ".tar.xz": "xz",
+                    ".txz": "xz"}
+ZIP_COMPRESSIONS = {"gz": zipfile.ZIP_DEFLATED, "bz2": zipfile.ZIP_BZIP2, "xz": zipfile.ZIP_LZMA}
+
+
+def archive_suffix(file: Path) -> str:
+    """
+    Suffix of a zip or tar archive
+
+    >>> archive_suffix(Path("Sales_20220301.tar.gz")), archive_suffix(Path("Sales_20220301.ZIP"))
+    ('.tar.gz', '.zip')
+
+    :raise ValueError: when file is not named as a zip or tar archive
+    """
+    name = file.name.lower()
+    for suffix in (".zip", *TAR_COMPRESSIONS):
+        if name.endswith(suffix):
+            return suffix
+    raise ValueError(f"{file} is not a zip or tar archive")
+
+
+def members(archive: Path) -> Iterator[Tuple[str, BinaryIO]]:
+    """
+    Names and binary streams of the regular files of archive, in the order of the archive
+    """
+    if archive_suffix(archive) == ".zip":
+        with zipfile.ZipFile(archive) as source:
+            for info in source.infolist():
+                if not info.is_dir():
+                    yield info.filename, source.open(info)
+    else:
+        # members are read in the order of the archive, a compressed tar archive is decompressed once
+        with tarfile.open(archive, "r:*") as source:
+            for info in source:
+                if info.isfile():
+                    yield info.name, source.extractfile(info)
+
+
+@contextmanager
+def archive_writer(output: BinaryIO, suffix: str, compress: str = None) -> Iterator[Callable[[str, BinaryIO], None]]:
+    """
+    Write an archive of the kind of suffix to output, yield a function adding a member from a binary stream
+
+    :param compress: compression of the archive, defaults to the compression of suffix or deflate for a zip archive
+    """
+    if suffix == ".zip":
+        with zipfile.ZipFile(output, "w", compression=ZIP_COMPRESSIONS.get(compress, zipfile.ZIP_DEFLATED)) as target:
+            def add(name: str, stream: BinaryIO):
+                size = stream.seek(0, 2)
+                stream.seek(0)
+                with target.open(name, "w", force_zip64=size >= zipfile.ZIP64_LIMIT) as member:
+                    shutil.copyfileobj(stream, member)
+            yield add
+    else:
+        with tarfile.open(fileobj=output, mode=f"w:{compress or TAR_COMPRESSIONS[suffix]}") as target:
+            def add(name: str, stream: BinaryIO):
+                info = tarfile.TarInfo(name)
+                info.size, info.mtime = stream.seek(0, 2), time.time()
+                stream.seek(0)
+                target.addfile(info, stream)
+            yield add
+
+
+def convert_archive(outdir: Path, archive: Path, parse_type: Optional[FileType], brand_code: str = None, jobs: int = 1,
+                    chunk_size: int = CHUNK_SIZE, engine: str = "python", metrics: "FileMetrics" = None,
+                    compress: str = None, totals: bool = False, on_error: str = "fail",
+                    max_error_rate: float = None) -> Path:
+    """
+    Convert every member of archive into an archive of outdir named after it, see handle. jobs and chunk_size are
+    unused, members are converted one after the other in this process. The type of every member is detected when
+    parse_type is None. Control totals are not collected for archives, totals must be False. With on_error reject,
+    the lines rejected from a member are added next to its output and max_error_rate applies to every member.
+
+    Failing members are all logged before the conversion fails, no output archive is left behind.
+
+    :param compress: Compression of the output archive, defaults to the compression of a tar archive and to deflate
+                     for a zip archive
+    :return: the output archive
+    """
+    if totals:
+        raise ValueError("Control totals are not collected for archives")
+    tools.logger.info(f"handling archive {archive}")
+    start = time.perf_counter()
+
+    if not archive.exists():
+        raise RuntimeError("File does not exists.")
+    suffix = archive_suffix(archive)
+    output_suffix = f".tar.{compress}" if compress and suffix != ".zip" else suffix
+    output_name = output_file_name_new if brand_code else output_file_name_old
+
+    while True:
+        new_file = outdir / f"{archive.name[:-len(suffix)]}_{datetime.datetime.now():%Y%m%d%H%M%S%f}{output_suffix}"
+        try:
+            output = new_file.open("xb")
+            break
+        except FileExistsError:
+            tools.logger.debug(f"{new_file} already exists")
+    tools.logger.debug(f"Generation new archive : {new_file.name}")
+
+    count = converted = failures = 0
+    try:
+        with output, archive_writer(output, output_suffix, compress) as add, \
+                profiling.trace_memory(archive) as trace, tempfile.TemporaryDirectory() as tmp_dir:
+            names = set()
+            for name, stream in members(archive):
+                rejects = None
+                if on_error == REJECT:
+                    rejects = Rejects(max_error_rate)
+                    rejects.path = Path(tmp_dir) / REJECTS_SUFFIX
+                try:
+                    with stream, rejects or nullcontext(), \
+                            tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE) as content:
+                        # lines which can not be decoded are rejected like the lines which can not be converted
+                        lines = iter_lines(stream, f"{archive}:{name}", binary=engine == "bytes",
+                                           check=rejects is None)
+                        file_type = parse_type
+                        if file_type is None:
+                            file_type, lines = detect_lines_type(PurePosixPath(name).name, lines, old=bool(brand_code))
+                        # outputs of the same microsecond would share their name
+                        new_name = None
+                        while new_name is None or new_name in names:
+                            new_name = str(PurePosixPath(name).with_name(
+                                output_name(PurePosixPath(name).name, file_type)))
+                        if metrics is not None:
+                            lines = metrics.read(lines)
+                        if rejects is not None:
+                            rejects.name = f"{new_name}{REJECTS_SUFFIX} of {new_file}"
+
+                            def parse_batch(batch: List[bytes]) -> List[AnyStr]:
+                                batch = check_lines(batch, binary=engine == "bytes")
+                                return [line for lines in parse_lines(batch, file_type, brand_code, engine)
+                                        for line in lines]
+
+                            batches = rejects.convert(lines, parse_batch)
+                        else:
+                            batches = parse_lines(lines, file_type, brand_code, engine)
+                        if metrics is not None:
+                            batches = metrics.parse(batches)
+                        lines_count = write_batches(trace.batches(batches), content)
+                        add(new_name, content)
+                    if rejects is not None and rejects.count:
+                        with rejects.path.open("rb") as rejected:
+                            add(f"{new_name}{REJECTS_SUFFIX}", rejected)
+                except Exception as e:
+                    failures += 1
+                    tools.logger.error(f"Conversion of {name} of {archive} failed : {e!r}")
+                    continue
+                names.add(new_name)
+                count += lines_count
+                converted += 1
+                tools.logger.debug(f"{name} converted to {new_name} : {lines_count} lines")
+        if failures:
+            raise RuntimeError(f"{failures} out of {failures + converted} member(s) of {archive} failed to convert")
+    except BaseException:
+        new_file.unlink()
+        raise
+    if metrics is not None:
+        metrics.finish(time.perf_counter() - start, count, new_file)
+    tools.logger.debug(f"Content generated : {converted} members, {count} lines")
+    tools.logger.info(f"Archive outputs : {new_file}")
+    return new_file
@@ -0,0 +1,193 @@
+"""
+Incremental conversion of append-only files, a run only converts the complete lines appended since the previous one.
+
+The follow state is a JSON sidecar of the output directory recording, for every input, the offset right after its
+last converted line, the output those lines were appended to, the conversion options and a checksum of the first
+and last blocks before the offset. An input shorter than its offset or whose checksum changed was truncated or
+rewritten, it is converted again from the start into a new output. The checksum only reads two blocks, so the cost
+of a run follows the appended data, not the size of the inputs. The last line of an input is only converted once it
+is terminated by a newline, it may still be being written.
+"""
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional, TYPE_CHECKING
+
+import cli_sols_auto.tools as tools
+from cli_sols_auto import profiling
+from cli_sols_auto.app import detect_type, open_output, parse_lines
+from cli_sols_auto.parser_sols_auto.tools import compress_output, compression, FileType, read_lines, write_batches
+
+if TYPE_CHECKING:  # pragma: no cover
+    from cli_sols_auto.metrics import FileMetrics
+
+FOLLOW_NAME = ".sols_auto_follow.json"
+BLOCK_SIZE = 64 * 1024
+
+
+class Increment(NamedTuple):
+    start: int
+    """Offset of the first line to convert"""
+    end: int
+    """Offset right after the last complete line to convert"""
+    output: Optional[str] = None
+    """Name of the output of the previous lines to append to, None to convert into a new output"""
+
+
+def complete_end(file: Path, start: int, size: int) -> int:
+    """
+    Offset right after the last newline of the bytes [start, size) of file, start when they do not have any
+    """
+    with file.open("rb") as stream:
+        end = size
+        while end > start:
+            block_start = max(start, end - BLOCK_SIZE)
+            stream.seek(block_start)
+            position = stream.read(end - block_start).rfind(b"\n")
+            if position >= 0:
+                return block_start + position + 1
+            end = block_start
+    return start
+
+
+def prefix_checksum(file: Path, offset: int) -> str:
+    """
+    SHA-256 of the first and the last BLOCK_SIZE bytes of the first offset bytes of file
+    """
+    digest = hashlib.sha256(b"%d:" % offset)
+    with file.open("rb") as stream:
+        digest.update(stream.read(min(offset, BLOCK_SIZE)))
+        stream.seek(max(0, offset - BLOCK_SIZE))
+        digest.update(stream.read(offset - stream.tell()))
+    return digest.hexdigest()
+
+
+class FollowState:
+    """
+    Offsets up to which the inputs of outdir are converted, indexed by their resolved path
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     file, output = Path(tmp_dir) / "Traffic.csv", Path(tmp_dir) / "Trf.dat"
+    ...     _ = file.write_text("JAC-778;2022-03-29;8\\nJAC-778;2022-03"), output.write_text("000778202203290008")
+    ...     state = FollowState(Path(tmp_dir))
+    ...     first = state.increment(file, parse_type="TRF")
+    ...     state.record(file, output, first.end, parse_type="TRF")
+    ...     state.save()
+    ...     nothing = FollowState(Path(tmp_dir)).increment(file, parse_type="TRF")
+    ...     _ = file.write_text("JAC-778;2022-03-29;8\\nJAC-778;2022-03-30;12\\n")
+    ...     print(first, nothing, FollowState(Path(tmp_dir)).increment(file, parse_type="TRF"))
+    Increment(start=0, end=21, output=None) None Increment(start=21, end=43, output='Trf.dat')
+    """
+
+    def __init__(self, outdir: Path):
+        self.path = outdir / FOLLOW_NAME
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text(encoding="utf-8"))["files"]
+            except (ValueError, KeyError) as e:
+                tools.logger.warning(f"Ignoring unreadable follow state {self.path} : {e!r}")
+        self._changed = False
+
+    def increment(self, file: Path, **options) -> Optional[Increment]:
+        """
+        Lines of file to convert with options, None when no complete line was appended since the previous run
+
+        :raise ValueError: when file is compressed, compressed files can not be read from an offset
+        """
+        if compression(file):
+            raise ValueError(f"Compressed file {file} can not be followed")
+        size = file.stat().st_size
+        entry = self.entries.get(str(file.resolve()))
+        start, output = 0, None
+        if entry is not None and entry["options"] == options and (self.path.parent / entry["output"]).exists():
+            if size >= entry["offset"] and prefix_checksum(file, entry["offset"]) == entry["checksum"]:
+                start, output = entry["offset"], entry["output"]
+            else:
+                tools.logger.warning(f"{file} was truncated or rewritten, converting it again")
+        end = complete_end(file, start, size)
+        return Increment(start, end, output) if end > start else None
+
+    def record(self, file: Path, output: Path, offset: int, **options):
+        """
+        Record that the lines of file up to offset are converted into output with options
+        """
+        self.entries[str(file.resolve())] = {
+            "offset": offset,
+            "checksum": prefix_checksum(file, offset),
+            "options": options,
+            "output": output.name,
+        }
+        self._changed = True
+
+    def save(self):
+        """
+        Write the follow state if it changed, replacing the previous one atomically
+        """
+        if not self._changed:
+            return
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        tmp_path.write_text(json.dumps({"version": 1, "files": self.entries}, indent=1), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+        self._changed = False
+
+
+def convert_increment(outdir: Path, file: Path, parse_type: Optional[FileType], brand_code: str = None,
+                      increment: Increment = None, jobs: int = 1, chunk_size: int = None, engine: str = "python",
+                      metrics: "FileMetrics" = None, compress: str = None, totals: bool = False,
+                      on_error: str = "fail", max_error_rate: float = None) -> Path:
+    """
+    Convert the lines of increment of file, appended to the output of the previous lines or into a new output of
+    outdir named after file, see handle. jobs, chunk_size and max_error_rate are unused, increments are not split.
+    Control totals are not collected and lines are not rejected, totals must be False and on_error fail.
+
+    An output appended to is truncated back to its previous size when the conversion fails.
+
+    :param compress: Compression of the output, appended lines are compressed as a new stream of the output
+    :return: the output
+    """
+    if totals or on_error != "fail":
+        raise ValueError("Control totals and rejected lines are not supported when following files")
+    tools.logger.info(f"handling lines {increment.start} to {increment.end} of {file}")
+    start = time.perf_counter()
+
+    if not file.exists():
+        raise RuntimeError("File does not exists.")
+    if parse_type is None:
+        parse_type = detect_type(file, brand_code)
+    lines = read_lines(file, (increment.start, increment.end), binary=engine == "bytes")
+    if metrics is not None:
+        lines = metrics.read(lines)
+    batches = parse_lines(lines, parse_type, brand_code, engine)
+    if metrics is not None:
+        batches = metrics.parse(batches)
+
+    appended = increment.output is not None
+    if appended:
+        new_file = outdir / increment.output
+        output = new_file.open("ab")
+        size = output.tell()
+    else:
+        new_file, output = open_output(outdir, file, parse_type, brand_code, compress)
+        size = 0
+    try:
+        with output, compress_output(output, compress) as stream, profiling.trace_memory(file) as trace:
+            if appended:
+                # lines of outputs are separated, the last one is not terminated
+                stream.write(b"\n")
+            count = write_batches(trace.batches(batches), stream)
+    except BaseException:
+        if appended:
+            os.truncate(new_file, size)
+        else:
+            new_file.unlink()
+        raise
+    if metrics is not None:
+        metrics.finish(time.perf_counter() - start, count, new_file)
+        metrics.bytes_read, metrics.bytes_written = increment.end - increment.start, metrics.bytes_written - size
+    tools.logger.debug(f"Content generated : {count} lines")
+    tools.logger.info(f"File outputs : {new_file}")
+    return new_file
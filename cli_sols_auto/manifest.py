@@ -0,0 +1,108 @@
+"""
+Manifest of the files converted into an output directory, so reruns only convert new or modified inputs.
+
+The manifest is a JSON sidecar of the output directory recording, for every converted input, its size, modification
+time and content hash, the conversion options and the output it produced. Unchanged inputs are recognised from
+their size and modification time alone, the content is only hashed when those changed. Inputs are fingerprinted
+before they are converted, an input modified meanwhile no longer matches its record and is converted again.
+"""
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+import cli_sols_auto.tools as tools
+
+MANIFEST_NAME = ".sols_auto_manifest.json"
+SAVE_INTERVAL = 1.0  # seconds, during a run the manifest is saved at most this often
+
+
+def file_hash(file: Path, block_size: int = 1024 * 1024) -> str:
+    """
+    SHA-256 of the content of file
+    """
+    digest = hashlib.sha256()
+    with file.open("rb") as stream:
+        while block := stream.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint(file: Path) -> Dict[str, Any]:
+    """
+    Size, modification time and SHA-256 of file, the modification time is taken first
+    """
+    stat = file.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_hash(file)}
+
+
+class Manifest:
+    """
+    Inputs converted into outdir, indexed by their resolved path
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     file, output = Path(tmp_dir) / "Traffic.csv", Path(tmp_dir) / "Trf.dat"
+    ...     _ = file.write_text("JAC-778;2022-03-29;8"), output.write_text("000778202203290008")
+    ...     manifest = Manifest(Path(tmp_dir))
+    ...     before = manifest.is_converted(file, parse_type="TRF")
+    ...     manifest.record(file, output, fingerprint(file), parse_type="TRF")
+    ...     manifest.save()
+    ...     print(before, Manifest(Path(tmp_dir)).is_converted(file, parse_type="TRF"),
+    ...           Manifest(Path(tmp_dir)).is_converted(file, parse_type="VEN"))
+    False True False
+    """
+
+    def __init__(self, outdir: Path):
+        self.path = outdir / MANIFEST_NAME
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text(encoding="utf-8"))["files"]
+            except (ValueError, KeyError) as e:
+                tools.logger.warning(f"Ignoring unreadable manifest {self.path} : {e!r}")
+        self._changed = False
+        self._saved = float("-inf")
+
+    def is_converted(self, file: Path, **options) -> bool:
+        """
+        Whether file was converted with the same options, has not changed since and its output still exists
+        """
+        entry = self.entries.get(str(file.resolve()))
+        if entry is None or entry["options"] != options or not (self.path.parent / entry["output"]).exists():
+            return False
+        stat = file.stat()
+        if (entry["size"], entry["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+            return True
+        if entry["size"] != stat.st_size or entry["sha256"] != file_hash(file):
+            return False
+        # touched but unchanged
+        entry["mtime_ns"], self._changed = stat.st_mtime_ns, True
+        return True
+
+    def record(self, file: Path, output: Path, file_fingerprint: Dict[str, Any], **options):
+        """
+        Record the conversion of file into output with options
+
+        :param file_fingerprint: fingerprint of file taken before converting it
+        """
+        self.entries[str(file.resolve())] = {
+            **file_fingerprint,
+            "options": options,
+            "output": output.name,
+        }
+        self._changed = True
+
+    def save(self, min_interval: float = 0):
+        """
+        Write the manifest if it changed, replacing the previous one atomically. Nothing is written when the
+        manifest was saved less than min_interval seconds ago, the manifest of a large run is rewritten whole
+        """
+        if not self._changed or time.monotonic() - self._saved < min_interval:
+            return
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        tmp_path.write_text(json.dumps({"version": 1, "files": self.entries}, indent=1), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+        self._changed, self._saved = False, time.monotonic()
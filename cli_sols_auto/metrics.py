@@ -0,0 +1,165 @@
+"""
+Per-stage timings and throughput of conversions, written as JSON lines or as a Prometheus textfile collector file.
+
+Stages of a file are timed around the pipeline of handle: lines are read by batches so reading only costs a timer
+per batch, parsing is the time spent producing converted batches minus the time spent reading, writing is the rest.
+"""
+import json
+import os
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List
+
+from cli_sols_auto.parser_sols_auto.tools import BATCH_SIZE
+
+STAGES = ("read", "parse", "write")
+
+
+class FileMetrics:
+    """
+    Timings and counts of the conversion of one file
+    """
+
+    def __init__(self, file: Path):
+        self.file = file
+        self.output: Path = None
+        self.seconds: Dict[str, float] = dict.fromkeys(STAGES, 0.0)
+        self.total_seconds = 0.0
+        self.lines = self.bytes_read = self.bytes_written = 0
+
+    def read(self, lines: Iterable) -> Iterator:
+        """
+        Time reading lines, lines are pulled by batches
+        """
+        iterator = iter(lines)
+        while True:
+            start = time.perf_counter()
+            batch = list(islice(iterator, BATCH_SIZE))
+            self.seconds["read"] += time.perf_counter() - start
+            if not batch:
+                return
+            yield from batch
+
+    def parse(self, batches: Iterable[List]) -> Iterator[List]:
+        """
+        Time producing converted batches, reading time is taken out afterwards
+        """
+        iterator = iter(batches)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.seconds["parse"] += time.perf_counter() - start
+            yield batch
+
+    def finish(self, total_seconds: float, lines: int, output: Path):
+        self.total_seconds, self.lines, self.output = total_seconds, lines, output
+        self.seconds["parse"] = max(0.0, self.seconds["parse"] - self.seconds["read"])
+        self.seconds["write"] = max(0.0, total_seconds - self.seconds["parse"] - self.seconds["read"])
+        self.bytes_read = self.file.stat().st_size
+        self.bytes_written = output.stat().st_size
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "type": "file",
+            "file": str(self.file),
+            "output": str(self.output),
+            "seconds": self.total_seconds,
+            **{f"{stage}_seconds": seconds for stage, seconds in self.seconds.items()},
+            "lines": self.lines,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "rows_per_second": self.lines / self.total_seconds if self.total_seconds else 0.0,
+        }
+
+
+class RunMetrics:
+    """
+    Metrics of the files of a run and their summary
+
+    >>> run = RunMetrics()
+    >>> run.summary()["files"], run.summary()["lines"]
+    (0, 0)
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.discovery_seconds = 0.0
+        self.files: List[FileMetrics] = []
+        self.failures = 0
+
+    def discover(self, files: Iterable[Path]) -> Iterator[Path]:
+        """
+        Time finding files, files are found lazily as they are converted
+        """
+        iterator = iter(files)
+        while True:
+            start = time.perf_counter()
+            try:
+                file = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.discovery_seconds += time.perf_counter() - start
+            yield file
+
+    def summary(self) -> Dict[str, Any]:
+        seconds = time.time() - self.start
+        lines = sum(metrics.lines for metrics in self.files)
+        return {
+            "type": "run",
+            "start": self.start,
+            "seconds": seconds,
+            "discovery_seconds": self.discovery_seconds,
+            **{f"{stage}_seconds": sum(metrics.seconds[stage] for metrics in self.files) for stage in STAGES},
+            "files": len(self.files),
+            "failures": self.failures,
+            "lines": lines,
+            "bytes_read": sum(metrics.bytes_read for metrics in self.files),
+            "bytes_written": sum(metrics.bytes_written for metrics in self.files),
+            "rows_per_second": lines / seconds if seconds else 0.0,
+        }
+
+    def write(self, path: Path):
+        """
+        Write the metrics to path, as a Prometheus textfile collector file when its suffix is .prom or else appended
+        as JSON lines
+        """
+        if path.suffix == ".prom":
+            # node exporter may read the file at any time, replace it atomically
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            tmp_path.write_text(self.prometheus(), encoding="utf-8")
+            os.replace(tmp_path, path)
+            return
+        with path.open("a", encoding="utf-8") as output:
+            for metrics in self.files:
+                output.write(json.dumps(metrics.as_dict()) + "\n")
+            output.write(json.dumps(self.summary()) + "\n")
+
+    def prometheus(self) -> str:
+        """
+        Run summary in Prometheus text exposition format
+        """
+        summary = self.summary()
+        lines = []
+
+        def gauge(name: str, description: str, values: Dict[str, float]):
+            lines.extend([f"# HELP sols_auto_{name} {description}", f"# TYPE sols_auto_{name} gauge"])
+            lines.extend(f"sols_auto_{name}{labels} {value}" for labels, value in values.items())
+
+        gauge("last_run_timestamp_seconds", "Start time of the last run", {"": summary["start"]})
+        gauge("last_run_seconds", "Duration of the last run", {"": summary["seconds"]})
+        gauge("last_run_stage_seconds", "Time spent in every stage by the last run",
+              {f'{{stage="{stage}"}}': summary[f"{stage}_seconds"] for stage in ("discovery",) + STAGES})
+        gauge("last_run_files", "Files converted by the last run", {"": summary["files"]})
+        gauge("last_run_failures", "Files which failed to convert in the last run", {"": summary["failures"]})
+        gauge("last_run_lines", "Lines converted by the last run", {"": summary["lines"]})
+        gauge("last_run_bytes", "Bytes read and written by the last run",
+              {'{direction="read"}': summary["bytes_read"], '{direction="written"}': summary["bytes_written"]})
+        gauge("last_run_rows_per_second", "Lines converted per second by the last run",
+              {"": summary["rows_per_second"]})
+        return "\n".join(lines) + "\n"
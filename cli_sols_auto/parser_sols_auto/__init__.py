@@ -1,2 +1,24 @@
-from .new import parse as new_parser
-from .old import parse as old_parser
+# Parsers are imported on first use, a conversion only imports the module of its direction
+_EXPORTS = {
+    "new_parser": ("new", "parse"),
+    "new_iter_parser": ("new", "iter_parse"),
+    "old_parser": ("old", "parse"),
+    "old_iter_parser": ("old", "iter_parse"),
+    "DatRecords": ("records", "DatRecords"),
+    "convert": ("api", "convert"),
+    "RecordBatch": ("batch", "RecordBatch"),
+}
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+    module, attribute = _EXPORTS[name]
+    value = getattr(import_module(f".{module}", __name__), attribute)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS))
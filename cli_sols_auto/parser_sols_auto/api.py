@@ -0,0 +1,127 @@
+"""
+In-memory conversion of records already held by the caller, without any file on disk.
+
+convert accepts lines, chunks of bytes or a file object and converts them lazily, batch by batch, either as an
+iterator over the converted lines or written to a sink.
+"""
+import io
+from itertools import chain
+from typing import AnyStr, BinaryIO, Iterable, Iterator, List, Optional, TextIO, Union
+
+from .schema import detect_lines_type
+from .tools import DIRECTIONS, ENGINES, FileType, iter_lines, write_batches
+
+Source = Union[Iterable[str], Iterable[bytes], BinaryIO, TextIO]
+
+
+class _ChunksReader(io.RawIOBase):
+    """
+    Raw binary stream over an iterable of bytes chunks
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        super().__init__()
+        self._chunks = iter(chunks)
+        self._chunk = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._chunk:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._chunk = memoryview(chunk)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def _lines(source: Source, binary: bool) -> Iterator[AnyStr]:
+    """
+    Lines of source without their line terminator, bytes chunks and binary file objects are split in lines
+    """
+    if hasattr(source, "read") and not isinstance(source, io.TextIOBase):
+        # file objects belong to the caller, they are left open
+        yield from iter_lines(source, getattr(source, "name", "<stream>"), binary, close=False)
+        return
+    iterator = iter(source)
+    first = next(iterator, None)
+    if first is None:
+        return
+    if isinstance(first, (bytes, bytearray, memoryview)):
+        yield from iter_lines(io.BufferedReader(_ChunksReader(chain([first], iterator))), "<chunks>", binary)
+        return
+    if binary:
+        raise ValueError("The bytes engine converts bytes, not text lines")
+    for line in chain([first], iterator):
+        yield line.rstrip("\r\n")
+
+
+def _parse(lines: Iterable[AnyStr], direction: str, file_type: FileType, brand_code: Optional[str],
+           engine: str) -> Iterator[List[AnyStr]]:
+    if direction == "old2new":
+        from . import old
+        return old.get_batch_parser(engine)(lines, file_type, brand_code)
+    from . import new
+    return new.get_batch_parser(engine)(lines, file_type)
+
+
+def convert(source: Source, direction: str, file_type: Union[FileType, str, None], brand_code: str = None,
+            sink: Union[BinaryIO, TextIO] = None, engine: str = "python") -> Union[Iterator[AnyStr], int]:
+    """
+    Convert records held in memory, lazily and batch by batch
+
+    Convert an iterable of text lines, with or without their line terminator, to an iterator over converted lines :
+    >>> list(convert(["JAC-778;2022-03-29;8\\n", "JAC-778;2022-03-30;12"], "new2old", "TRF"))
+    ['000778202203290008', '000778202203300012']
+
+    Chunks of bytes are split in lines whatever their boundaries, the type is detected when file_type is None :
+    >>> list(convert([b"0007782022", b"03290008\\n000778202203300012"], "old2new", None, "JAC"))
+    ['JAC-778;2022-03-29;8', 'JAC-778;2022-03-30;12']
+
+    Binary file objects are read as they are converted and left open, converted lines are written to a sink :
+    >>> sink = io.BytesIO()
+    >>> convert(io.BytesIO(b"000778202203290008"), "old2new", FileType.TRF, "JAC", sink=sink, engine="bytes")
+    1
+    >>> sink.getvalue()
+    b'JAC-778;2022-03-29;8'
+
+    :param source: iterable of text lines, iterable of bytes chunks, binary or text file object
+    :param direction: new2old or old2new
+    :param file_type: type of the records, detected from the first line when None
+    :param brand_code: Brand code to prefix store codes with, required by old2new
+    :param sink: binary or text file object where to write the converted lines, separated by new lines
+    :param engine: name of the conversion engine, one of ENGINES. The bytes engine converts ASCII bytes into bytes
+    :return: an iterator over the converted lines, or the number of lines written when sink is provided
+    :raise ValueError: when a parameter is invalid, or lazily when a line can not be converted
+    """
+    if direction not in DIRECTIONS:
+        raise ValueError(f"direction must be one of {', '.join(DIRECTIONS)}")
+    if direction == "old2new" and not brand_code:
+        raise ValueError("brand_code is required to convert from old to new version")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}")
+    if file_type is not None:
+        file_type = FileType(file_type)
+
+    def batches() -> Iterator[List[AnyStr]]:
+        # nothing is read before the first converted line is asked for
+        lines, parse_type = _lines(source, binary=engine == "bytes"), file_type
+        if parse_type is None:
+            parse_type, lines = detect_lines_type("<memory>", lines, old=direction == "old2new")
+        yield from _parse(lines, direction, parse_type, brand_code, engine)
+
+    if sink is None:
+        return (line for batch in batches() for line in batch)
+    if isinstance(sink, io.TextIOBase):
+        count = 0
+        for batch in batches():
+            if count:
+                sink.write("\n")
+            sink.write("\n".join(line.decode("ascii") if isinstance(line, bytes) else line for line in batch))
+            count += len(batch)
+        return count
+    return write_batches(batches(), sink)
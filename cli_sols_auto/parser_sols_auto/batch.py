@@ -0,0 +1,195 @@
+"""
+Columnar representation of blocks of parsed records, for consumers which need the fields of converted records.
+
+A RecordBatch holds the records of one FileType as one column per field of old .dat records instead of one string
+per record: integer fields (store numbers, YYYYMMDD dates, quantities and cents) in array.array columns and text
+fields (barcodes, parcel numbers, receipt and traffic numbers, pos ids) in a single buffer of fixed-width values.
+Columns are exposed without copy, as memoryviews or as NumPy arrays when NumPy is installed.
+
+New CSV lines go through the new2old converters before being split in columns and are written back by the old2new
+converters, so a RecordBatch holds and produces exactly what a conversion does. Fields which conversions copy as
+they are, NUMBER fields included, are held as text. Integer fields must be digits, a minus sign included for signed
+quantities, as old2new requires. A zero signed quantity is written back as -0000, as new2old writes it. Columns of
+new files which old records do not have (times, optional columns) are not kept.
+"""
+from array import array
+from typing import AnyStr, Dict, Iterable, List, Tuple, Union
+
+from .schema import Field, Kind, SCHEMAS
+from .tools import FileType
+
+INTEGERS = (Kind.STORE, Kind.DATE, Kind.UNSIGNED, Kind.SIGNED, Kind.CENTS)
+
+Column = Union[array, bytes]
+
+
+def _typecode(field: Field) -> str:
+    # fields of at most 9 characters fit in 32 bits, sign included
+    return "i" if field.width <= 9 else "q"
+
+
+class RecordBatch:
+    """
+    Block of records of a FileType stored as typed columns
+
+    >>> batch = RecordBatch.from_new(["JAC-778;2022-03-29;8", "JAC-778;2022-03-30;12"], FileType.TRF)
+    >>> len(batch), batch.names, batch.column("traffic_date").tolist(), batch.row(1)
+    (2, ('store_code', 'traffic_date', 'traffic_number'), [20220329, 20220330], (778, 20220330, b'0012'))
+    >>> batch.to_old()
+    ['000778202203290008', '000778202203300012']
+    >>> batch.to_new("OKA")
+    ['OKA-778;2022-03-29;8', 'OKA-778;2022-03-30;12']
+
+    Text fields are fixed-width bytes, their column is a memoryview of one row per record:
+    >>> batch = RecordBatch.from_old(["0007780000099999305707431336036523474090000120210419"], FileType.VAL)
+    >>> batch.row(0)
+    (778, b'00000999993057074313', b'3603652347409', b'00001', 20210419)
+    >>> batch.column("barcode").shape, batch.column("barcode").tobytes()
+    ((1, 13), b'3603652347409')
+    """
+
+    def __init__(self, file_type: FileType, columns: Dict[str, Column]):
+        """
+        :param file_type: Type of the records (see enum cli_sols_auto.parse_sols_auto.tools.FileType)
+        :param columns: column of every field of the old records of file_type, array.array columns for integer
+                        fields and bytes of the concatenated fixed-width values for text fields
+        :raise ValueError: when a column is missing or columns do not have the same length
+        """
+        self.file_type, self.fields = file_type, SCHEMAS[file_type].fields
+        if set(columns) != {field.name for field in self.fields}:
+            raise ValueError(f"Columns of {file_type.name} records are {', '.join(self.names)}")
+        self._columns = columns
+        lengths = {len(columns[field.name]) // (1 if field.kind in INTEGERS else field.width) for field in self.fields}
+        if len(lengths) > 1:
+            raise ValueError("Columns of a RecordBatch must have the same length")
+        self._length = lengths.pop()
+
+    @classmethod
+    def from_old(cls, records: Iterable[AnyStr], file_type: FileType) -> "RecordBatch":
+        """
+        Split old .dat records, text or ASCII bytes without line terminator, in columns
+
+        :raise ValueError: when a record does not have the width of file_type or an integer field is not digits
+        """
+        schema = SCHEMAS[file_type]
+        data = []
+        for record in records:
+            try:
+                raw = record.encode("ascii") if isinstance(record, str) else bytes(record)
+            except UnicodeEncodeError:
+                raise ValueError(f"Incorrect input data {record}")
+            if len(raw) != schema.width:
+                raise ValueError(f"Incorrect input data {record}")
+            data.append(raw)
+        columns = {}
+        for field, (start, end) in zip(schema.fields, schema.offsets().values()):
+            if field.kind in INTEGERS:
+                values = [record[start:end] for record in data]
+                signed = field.kind == Kind.SIGNED
+                for record, value in zip(data, values):
+                    # int() would also take signs, spaces and underscores, which could not be written back
+                    if not (value[1:] if signed and value[:1] == b"-" else value).isdigit():
+                        raise ValueError(f"Incorrect input data {record.decode('ascii')}")
+                columns[field.name] = array(_typecode(field), map(int, values))
+            else:
+                columns[field.name] = b"".join([record[start:end] for record in data])
+        return cls(file_type, columns)
+
+    @classmethod
+    def from_new(cls, lines: Iterable[AnyStr], file_type: FileType) -> "RecordBatch":
+        """
+        Validate and convert new CSV lines, text or ASCII bytes without line terminator, and split them in columns
+
+        :raise ValueError: when a line can not be converted
+        """
+        from . import new
+        lines = list(lines)
+        parsers = new.BYTES_PARSERS if lines and isinstance(lines[0], bytes) else new.PARSERS
+        parser = parsers[file_type]
+        return cls.from_old([parser(line) for line in lines], file_type)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __repr__(self) -> str:
+        return f"<RecordBatch {self.file_type.name} of {self._length} records>"
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return tuple(field.name for field in self.fields)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Size of the columns in bytes
+        """
+        return sum(memoryview(column).nbytes for column in self._columns.values())
+
+    def column(self, name: str) -> memoryview:
+        """
+        Column of field name without copy, a memoryview of integers or, for text fields, of bytes shaped as one row
+        of the width of the field per record. Text columns of an empty batch are empty memoryviews of bytes
+
+        :raise KeyError: when file_type records have no field name
+        """
+        field = next((field for field in self.fields if field.name == name), None)
+        if field is None:
+            raise KeyError(f"{self.file_type.name} records have no field {name}")
+        view = memoryview(self._columns[name])
+        if field.kind in INTEGERS:
+            return view
+        # memoryviews can not be cast to a shape holding a zero
+        return view.cast("B", (self._length, field.width)) if self._length else view
+
+    def row(self, index: int) -> Tuple[Union[int, bytes], ...]:
+        """
+        Values of the record at index, in the order of the fields
+        """
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("record index out of range")
+        return tuple(self._columns[field.name][index] if field.kind in INTEGERS
+                     else self._columns[field.name][index * field.width:(index + 1) * field.width]
+                     for field in self.fields)
+
+    def to_numpy(self) -> Dict:
+        """
+        Columns as NumPy arrays sharing the memory of the batch, text fields as fixed-width bytes arrays
+
+        >>> batch = RecordBatch.from_old(["000778202203290008", "000779202203290012"], FileType.TRF)
+        >>> batch.to_numpy()["store_code"].tolist(), batch.to_numpy()["traffic_number"].tolist()
+        ([778, 779], [b'0008', b'0012'])
+
+        :raise ImportError: when NumPy is not installed
+        """
+        import numpy
+        return {field.name: numpy.frombuffer(self._columns[field.name], dtype=self._columns[field.name].typecode
+                                             if field.kind in INTEGERS else f"S{field.width}")
+                for field in self.fields}
+
+    def _format(self, field: Field) -> List[str]:
+        column, width = self._columns[field.name], field.width
+        if field.kind not in INTEGERS:
+            text = column.decode("ascii")
+            return [text[start:start + width] for start in range(0, len(text), width)]
+        if field.kind == Kind.SIGNED:
+            return ["-" + str(-value).rjust(width - 1, "0") if value <= 0 else str(value).rjust(width, "0")
+                    for value in column]
+        return [str(value).rjust(width, "0") for value in column]
+
+    def to_old(self) -> List[str]:
+        """
+        Old .dat records of the batch
+        """
+        return ["".join(values) for values in zip(*(self._format(field) for field in self.fields))]
+
+    def to_new(self, brand_code: str) -> List[str]:
+        """
+        New CSV lines of the batch, columns which old records do not have are left empty
+
+        :param brand_code: Brand code that will be use to prefix store codes
+        """
+        from . import old
+        parser = old.PARSERS[self.file_type]
+        return [parser(record, brand_code) for record in self.to_old()]
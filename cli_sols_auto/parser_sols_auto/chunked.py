@@ -0,0 +1,68 @@
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Tuple
+
+from . import new, old
+from .tools import CHUNK_SIZE, FileType, read_lines, split_file, write_batches
+
+
+def convert_range(file: Path, byte_range: Tuple[int, int], file_type: FileType, brand_code: str, part: Path,
+                  engine: str = "python") -> int:
+    """
+    Convert the lines of a byte range of file and write them to part
+
+    :param file: file to convert
+    :param byte_range: (start, end) offsets of the lines to convert, aligned on newlines
+    :param file_type: Type of the file (see enum cli_sols_auto.parse_sols_auto.tools.FileType)
+    :param brand_code: Brand code to prefix store codes with, converts from old to new version when provided
+    :param part: file where to write the converted lines
+    :param engine: name of the conversion engine
+    :return: the number of lines converted
+    """
+    lines = read_lines(file, byte_range, binary=engine == "bytes")
+    batches = old.get_batch_parser(engine)(lines, file_type, brand_code) if brand_code \
+        else new.get_batch_parser(engine)(lines, file_type)
+    with part.open("wb") as output:
+        return write_batches(batches, output)
+
+
+def convert_chunked(file: Path, output: BinaryIO, file_type: FileType, brand_code: str = None, jobs: int = 1,
+                    chunk_size: int = CHUNK_SIZE, engine: str = "python") -> int:
+    """
+    Convert a single file split in newline aligned chunks converted in parallel by jobs processes
+
+    Workers only receive offsets and read their chunk from the file, converted chunks are written next to the
+    output and stitched back in order so the result is identical to a serial conversion.
+
+    :param file: file to convert
+    :param output: binary stream to write the converted lines into
+    :param file_type: Type of the file (see enum cli_sols_auto.parse_sols_auto.tools.FileType)
+    :param brand_code: Brand code to prefix store codes with, converts from old to new version when provided
+    :param jobs: Maximum number of worker processes
+    :param chunk_size: Size in bytes of the chunks
+    :param engine: name of the conversion engine
+    :return: the number of lines converted
+    """
+    if not file.exists():
+        raise RuntimeError("File does not exists.")
+    ranges = split_file(file, chunk_size)
+    output_dir = Path(output.name).parent if hasattr(output, "name") else None
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmp_dir, \
+            ProcessPoolExecutor(max_workers=max(1, min(jobs, len(ranges)))) as executor:
+        parts = [Path(tmp_dir) / f"{index}.part" for index in range(len(ranges))]
+        futures = [executor.submit(convert_range, file, byte_range, file_type, brand_code, part, engine)
+                   for byte_range, part in zip(ranges, parts)]
+        count = 0
+        for future, part in zip(futures, parts):
+            lines = future.result()
+            if not lines:
+                continue
+            if count:
+                output.write(b"\n")
+            with part.open("rb") as converted:
+                shutil.copyfileobj(converted, output)
+            part.unlink()
+            count += lines
+    return count
@@ -1,5 +1,15 @@
+from itertools import chain
 from pathlib import Path
-from cli_sols_auto.parser_sols_auto.tools import dummyparser, FileType
+from typing import AnyStr, Callable, Iterable, Iterator, List
+
+import cli_sols_auto.tools as tools
+from cli_sols_auto.parser_sols_auto.batch import RecordBatch
+from cli_sols_auto.parser_sols_auto.schema import compile_new2old, LazyConverters
+from cli_sols_auto.parser_sols_auto.tools import BATCH_SIZE, batched, dummyparser, ENGINES, FileType, read_lines
+
+# converters are only compiled for the file types in use
+PARSERS = LazyConverters(compile_new2old)
+BYTES_PARSERS = LazyConverters(compile_new2old, binary=True)
 
 
 def parse_sales(line: str) -> str:
@@ -19,15 +29,12 @@ def parse_sales(line: str) -> str:
     Can also handle price as integer:
     >>> parse_sales("JAC-778;2022-03-23;;4132369;3603652236628;1;395;1")
     '0007782022032336036522366280004132369000010000395001'
+
+    Price is converted to cents exactly, without float rounding errors:
+    >>> parse_sales("JAC-778;2022-03-23;;4132369;3603652236628;1;0,29;1")
+    '0007782022032336036522366280004132369000010000000291'
     """
-    data = line.split(";")
-    if len(data) < 8 or len(data) > 9:
-        raise ValueError(f"Incorrect input data {line}")
-    store_code, sales_date, _, receipt_number, barcode, quantity, price, pos_id = data[:8]
-    quantity = f'{quantity:0>5}' if int(quantity) > 0 else f'-{abs(int(quantity)):0>4}'
-    sales_date = sales_date.replace('-', '')
-    price = int(float(price.replace(',', '.')) * 100)
-    return f"{store_code[4:]:0>6}{sales_date}{barcode:0>13}{receipt_number:0>10}{quantity}{price:0>9}{pos_id[0]}"
+    return PARSERS[FileType.VEN](line)
 
 
 def parse_traffic(line: str) -> str:
@@ -44,12 +51,7 @@ def parse_traffic(line: str) -> str:
         >>> parse_traffic("JAC-778;2022-03-29;8;5;44;48")
         '000778202203290008'
     """
-    data = line.split(";")
-    if len(data) < 3 or len(data)>6:
-        raise ValueError(f"Incorrect input data {line}")
-    store_code, traffic_date, traffic_number = data[:3]
-    traffic_date = traffic_date.replace('-', '')
-    return f"{store_code[4:]:0>6}{traffic_date}{traffic_number:0>4}"
+    return PARSERS[FileType.TRF](line)
 
 
 def parse_interstore_transfer(line: str) -> str:
@@ -62,14 +64,7 @@ def parse_interstore_transfer(line: str) -> str:
         >>> parse_interstore_transfer("2021-11-01;11-04-12;OKA-1210;OKA-1889;3604277211410;5")
         '2021110100121000188936042772114100005'
     """
-    data = line.split(";")
-    if len(data) != 6:
-        raise ValueError(f"Incorrect input data {line}")
-    transfer_date, _, sender_code, receiver_code, barcode, quantity = data
-    transfer_date = transfer_date.replace('-', '')
-    if not quantity.isdigit() or int(quantity) < 0:
-        raise ValueError("Incorrect input data {line}")
-    return f"{transfer_date}{sender_code[4:]:0>6}{receiver_code[4:]:0>6}{barcode:0>13}{quantity:0>4}"
+    return PARSERS[FileType.TRS](line)
 
 
 def parse_delivery_validation(line: str) -> str:
@@ -86,28 +81,75 @@ def parse_delivery_validation(line: str) -> str:
         >>> parse_delivery_validation("JAC-778;00000999993057074313;3603652347409;1;2021-04-19;;")
         '0007780000099999305707431336036523474090000120210419'
     """
-    data = line.split(";")
-    if len(data) < 5 or len(data) > 7:
-        raise ValueError(f"Incorrect input data {line}")
-    store_code, parcel_number, barcode, quantity, reception_date = data[:5]
+    return PARSERS[FileType.VAL](line)
 
-    return f"{store_code[4:]:0>6}{parcel_number:0>20}{barcode:0>13}{quantity:0>5}{reception_date.replace('-', '')}"
 
+def parse_batches(lines: Iterable[AnyStr], file_type: FileType,
+                  batch_size: int = BATCH_SIZE) -> Iterator[List[AnyStr]]:
+    """
+    Convert lines from new CSV format to old .dat format, batch by batch. Bytes lines are converted to bytes
 
-line_parsers = [parse_traffic, parse_interstore_transfer, parse_delivery_validation, parse_sales]
+    >>> list(parse_batches(["JAC-778;2022-03-29;8", "JAC-778;2022-03-30;12"], FileType("TRF"), batch_size=1))
+    [['000778202203290008'], ['000778202203300012']]
+    >>> list(parse_batches([b"JAC-778;2022-03-29;8"], FileType("TRF")))
+    [[b'000778202203290008']]
+    """
+    type_parser = PARSERS.get(file_type, dummyparser)
+    bytes_parser = BYTES_PARSERS.get(file_type, dummyparser)
+    for batch in batched(lines, batch_size):
+        parser = bytes_parser if isinstance(batch[0], bytes) else type_parser
+        yield [parser(line) for line in batch]
 
-PARSERS = dict(zip([t for t in FileType], line_parsers))
 
+def parse_record_batches(lines: Iterable[AnyStr], file_type: FileType,
+                         batch_size: int = BATCH_SIZE) -> Iterator[RecordBatch]:
+    """
+    Convert lines from new CSV format to columnar RecordBatches of old records, batch by batch
 
-def parse(file: Path, file_type: FileType) -> str:
+    >>> [batch.column("traffic_date").tolist() for batch in parse_record_batches(
+    ...     ["JAC-778;2022-03-29;8", "JAC-778;2022-03-30;12", "JAC-778;2022-03-31;5"], FileType("TRF"), batch_size=2)]
+    [[20220329, 20220330], [20220331]]
+    """
+    for batch in batched(lines, batch_size):
+        yield RecordBatch.from_new(batch, file_type)
+
+
+def get_batch_parser(engine: str = "python") -> Callable[..., Iterator[List[str]]]:
+    """
+    Get the parse_batches function of an engine, the numpy engine falls back to python when NumPy is not installed.
+    The bytes engine is the python one fed with undecoded ASCII lines (see iter_parse)
+
+    :param engine: name of the engine, one of ENGINES
+    :return: a function with the signature of parse_batches
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}")
+    if engine == "numpy":
+        from . import new_numpy
+        if new_numpy.numpy is not None:
+            return new_numpy.parse_batches
+        tools.logger.warning("NumPy is not installed, falling back to python engine")
+    return parse_batches
+
+
+def iter_parse(file: Path, file_type: FileType, engine: str = "python") -> Iterator[List[str]]:
+    """
+    Lazily convert a new style file, only one batch of lines is held in memory at a time. The bytes engine reads
+    and converts lines as bytes, without decoding them, and fails on files which are not ASCII
+
+    :param file: file to convert
+    :param file_type: Type of the file (see enum cli_sols_auto.parse_sols_auto.tools.FileType)
+    :param engine: name of the conversion engine, one of ENGINES
+    :return: an iterator over batches of converted lines
+    """
     if not file.exists():
         raise RuntimeError("File does not exists.")
-    data = file.read_text(encoding="utf-8")
-    type_parser = PARSERS.get(file_type, dummyparser)
-    print(PARSERS)
-    return "\n".join(type_parser(line) for line in data.splitlines(False))
+    return get_batch_parser(engine)(read_lines(file, binary=engine == "bytes"), file_type)
 
 
+def parse(file: Path, file_type: FileType) -> str:
+    return "\n".join(chain.from_iterable(iter_parse(file, file_type)))
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
@@ -0,0 +1,257 @@
+"""
+Vectorized conversion of new CSV files with NumPy.
+
+A batch of lines is viewed as one byte array, the offsets of the fields of every row are found at once and each
+field is copied, padded, into a fixed-width byte array of old .dat records.
+Batches the vectorized path cannot handle exactly like the scalar parsers (non ASCII characters, unexpected number
+of fields, fields too wide, unusual quantities or prices) and types whose dates are not in the default format are
+converted by cli_sols_auto.parser_sols_auto.new instead.
+"""
+import functools
+from typing import Iterable, Iterator, List, Tuple
+
+from . import new
+from .schema import has_default_dates
+from .tools import BATCH_SIZE, batched, FileType
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+_ZERO, _DASH, _SEMICOLON, _NEWLINE = b"0-;\n"
+_DOT, _COMMA = b".,"
+
+# Weights of the columns of a 10 characters window summing its set columns and their indexes
+_COUNT_COLUMN = None if numpy is None else numpy.stack((numpy.ones(10), numpy.arange(10)), axis=1).astype(numpy.uint8)
+
+# Every field is read as the window of its last characters, data is prefixed so that windows never start before it
+_PADDING = 32
+
+# Columns of the digits of a YYYY-MM-DD date
+_DATE_DIGITS = [0, 1, 2, 3, 5, 6, 8, 9]
+
+
+class _Fallback(Exception):
+    pass
+
+
+class _Block:
+    """
+    Batch of CSV lines as a byte array with the offsets of the first fields of every row
+    """
+
+    def __init__(self, batch: List[str], min_fields: int, max_fields: int):
+        try:
+            self.raw = bytes(_PADDING) + ("\n".join(batch) + "\n").encode("ascii")
+        except UnicodeEncodeError:
+            raise _Fallback()
+        self.data = numpy.frombuffer(self.raw, dtype=numpy.uint8)
+        separators = numpy.flatnonzero((self.data == _SEMICOLON) | (self.data == _NEWLINE))
+        line_ends = self.data[separators] == _NEWLINE
+        first = numpy.flatnonzero(numpy.concatenate(([True], line_ends[:-1])))
+        counts = numpy.diff(numpy.append(first, len(separators)))
+        if counts.min() < min_fields or counts.max() > max_fields:
+            raise _Fallback()
+        self._separators, self._first = separators, first
+        self._windows, self._ends = {}, {}
+
+    def __len__(self) -> int:
+        return len(self._first)
+
+    def ends(self, index: int):
+        """
+        Offsets of the separators ending field index of every row
+        """
+        if index not in self._ends:
+            self._ends[index] = self._separators[self._first + index]
+        return self._ends[index]
+
+    def field(self, index: int, skip: int = 0) -> Tuple:
+        if index:
+            starts = self.ends(index - 1) + 1
+        else:
+            starts = numpy.concatenate(([_PADDING], self._separators[self._first[1:] - 1] + 1))
+        starts, ends = starts + skip, self.ends(index)
+        if (ends < starts).any():
+            raise _Fallback()
+        return starts, ends
+
+    def window(self, starts, ends, width: int) -> Tuple:
+        """
+        Characters of the fields right aligned in width columns and padded with zeros, with the length of the fields
+        """
+        lengths = ends - starts
+        if lengths.max() > width:
+            raise _Fallback()
+        if width not in self._windows:
+            # every window of width characters of data as one fixed size item, gathered at once for all the rows
+            self._windows[width] = numpy.ndarray((len(self.raw) - width + 1,), f"V{width}", self.raw, strides=(1,))
+        characters = self._windows[width][ends - width].view(numpy.uint8).reshape(len(ends), width)
+        if lengths.min() < width:
+            # characters before the fields are zeroed once shifted, then shifted back to zero characters
+            characters -= _ZERO
+            characters *= _kept(width)[lengths].view(numpy.uint8).reshape(characters.shape)
+            characters += _ZERO
+        return characters, lengths
+
+    def digits(self, starts, ends, width: int) -> Tuple:
+        characters, lengths = self.window(starts, ends, width)
+        # characters below zero wrap around to more than 9 once shifted
+        if (characters - _ZERO).max() > 9:
+            raise _Fallback()
+        return characters, lengths
+
+    def right(self, records, offset: int, width: int, starts, ends):
+        _put(records, offset, self.window(starts, ends, width)[0])
+
+    def date(self, records, offset: int, starts, ends):
+        characters, lengths = self.window(starts, ends, 10)
+        if lengths.min() < 10:
+            raise _Fallback()
+        dashes = characters == _DASH
+        if not (dashes[:, 4].all() and dashes[:, 7].all() and numpy.count_nonzero(dashes) == 2 * len(self)):
+            raise _Fallback()
+        _put(records, offset, numpy.ascontiguousarray(characters[:, _DATE_DIGITS]))
+
+
+@functools.lru_cache(maxsize=None)
+def _kept(width: int):
+    """
+    Masks of the last characters of a window of width characters, the l last ones are 1 in kept[l] and the ones
+    before 0
+    """
+    kept = numpy.arange(width) >= width - numpy.arange(width + 1)[:, None]
+    return kept.astype(numpy.uint8).view(f"V{width}").ravel()
+
+
+@functools.lru_cache(maxsize=None)
+def _columns(offset: int, width: int, record_width: int):
+    return numpy.dtype({"names": ["columns"], "formats": [f"V{width}"], "offsets": [offset],
+                        "itemsize": record_width})
+
+
+def _put(records, offset: int, characters):
+    """
+    Copy the rows of characters to records from column offset, every row as a single item: copying a slice of
+    columns of records is twice slower
+    """
+    width = characters.shape[1]
+    records.view(_columns(offset, width, records.shape[1]))["columns"] = characters.view(f"V{width}")
+
+
+def _records(block: _Block, width: int):
+    return numpy.full((len(block), width + 1), _ZERO, dtype=numpy.uint8)
+
+
+def _lines(records) -> List[str]:
+    records[:, -1] = _NEWLINE
+    # the last newline leaves an empty line, slicing the decoded text instead would copy it
+    lines = records.tobytes().decode("ascii").split("\n")
+    lines.pop()
+    return lines
+
+
+def parse_sales(batch: List[str]) -> List[str]:
+    block = _Block(batch, 8, 9)
+    records = _records(block, 52)
+    block.right(records, 0, 6, *block.field(0, skip=4))
+    block.date(records, 6, *block.field(1))
+    block.right(records, 14, 13, *block.field(4))
+    block.right(records, 27, 10, *block.field(3))
+
+    starts, ends = block.field(5)
+    negative = block.data[starts] == _DASH
+    characters, lengths = block.digits(starts + negative, ends, 5)
+    if (lengths == 0).any() or ((lengths > 4) & negative).any() \
+            or (~negative & (characters.view("S5").ravel() == b"00000")).any():
+        raise _Fallback()
+    _put(records, 37, characters)
+    records[negative, 37] = _DASH
+
+    starts, ends = block.field(6)
+    characters, lengths = block.window(starts, ends, 10)
+    separators = ((characters == _DOT) | (characters == _COMMA)).view(numpy.uint8)
+    # count and column of the decimal separator of every price at once, reductions along rows are slow
+    counts, columns = (separators @ _COUNT_COLUMN).T
+    has_decimals = counts > 0
+    decimals = numpy.where(has_decimals, 9 - columns, 0)
+    if counts.max() > 1 or decimals.max() > 2:
+        raise _Fallback()
+    integers_end = ends - decimals - has_decimals
+    characters, lengths = block.digits(starts, integers_end, 7)
+    if (lengths == 0).any():
+        raise _Fallback()
+    _put(records, 42, characters)
+    _put(records, 49, block.digits(integers_end + has_decimals, ends, 2)[0])
+    # a single decimal is the tens of cents
+    records[decimals == 1, 49:51] = records[decimals == 1, 50:48:-1]
+
+    starts, ends = block.field(7)
+    if (ends == starts).any():
+        raise _Fallback()
+    records[:, 51] = block.data[starts]
+    return _lines(records)
+
+
+def parse_traffic(batch: List[str]) -> List[str]:
+    block = _Block(batch, 3, 6)
+    records = _records(block, 18)
+    block.right(records, 0, 6, *block.field(0, skip=4))
+    block.date(records, 6, *block.field(1))
+    block.right(records, 14, 4, *block.field(2))
+    return _lines(records)
+
+
+def parse_interstore_transfer(batch: List[str]) -> List[str]:
+    block = _Block(batch, 6, 6)
+    records = _records(block, 37)
+    block.date(records, 0, *block.field(0))
+    block.right(records, 8, 6, *block.field(2, skip=4))
+    block.right(records, 14, 6, *block.field(3, skip=4))
+    block.right(records, 20, 13, *block.field(4))
+    starts, ends = block.field(5)
+    characters, lengths = block.digits(starts, ends, 4)
+    if (lengths == 0).any():
+        raise _Fallback()
+    _put(records, 33, characters)
+    return _lines(records)
+
+
+def parse_delivery_validation(batch: List[str]) -> List[str]:
+    block = _Block(batch, 5, 7)
+    records = _records(block, 52)
+    block.right(records, 0, 6, *block.field(0, skip=4))
+    block.right(records, 6, 20, *block.field(1))
+    block.right(records, 26, 13, *block.field(2))
+    block.right(records, 39, 5, *block.field(3))
+    block.date(records, 44, *block.field(4))
+    return _lines(records)
+
+
+line_parsers = [parse_traffic, parse_interstore_transfer, parse_delivery_validation, parse_sales]
+
+PARSERS = dict(zip([t for t in FileType], line_parsers))
+
+
+def parse_batches(lines: Iterable[str], file_type: FileType, batch_size: int = BATCH_SIZE) -> Iterator[List[str]]:
+    """
+    Convert lines from new CSV format to old .dat format, batch by batch, handling the fields of a whole batch at once
+
+    >>> list(parse_batches(["JAC-778;2022-03-23;;4132369;3603652236628;-1;395.5;1;JAC-12",
+    ...                     "JAC-778;2022-03-23;15-10-05;4132369;3603652236628;12;395;1"], FileType("VEN")))
+    [['0007782022032336036522366280004132369-00010000395501', '0007782022032336036522366280004132369000120000395001']]
+
+    Batches that can not be handled at once are converted line by line:
+    >>> list(parse_batches(["JAC-778;2022-03-29;8", "JAC-778;20220330;12"], FileType("TRF")))
+    [['000778202203290008', '000778202203300012']]
+    """
+    if not has_default_dates(file_type):
+        yield from new.parse_batches(lines, file_type, batch_size)
+        return
+    type_parser = PARSERS[file_type]
+    for batch in batched(lines, batch_size):
+        try:
+            yield type_parser(batch)
+        except _Fallback:
+            yield from new.parse_batches(batch, file_type, batch_size)
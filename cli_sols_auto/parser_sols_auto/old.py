@@ -1,49 +1,102 @@
-from datetime import datetime
+from itertools import chain
 from pathlib import Path
+from typing import AnyStr, Callable, Iterable, Iterator, List
 
 import cli_sols_auto.tools as tools
-from .tools import dummyparser, FileType
+from .batch import RecordBatch
+from .schema import compile_old2new, LazyConverters
+from .tools import BATCH_SIZE, batched, dummyparser, ENGINES, FileType, read_lines
 
 
-def parse_sales(line: str, brand: str) -> str:
-    sales_date = datetime.strptime(line[6:14], '%Y%m%d').strftime('%Y-%m-%d')
-    quantity = int(line[38:42])*-1 if line[37] == '-' else int(line[37:42])
+# converters are only compiled for the file types in use
+PARSERS = LazyConverters(compile_old2new)
+BYTES_PARSERS = LazyConverters(compile_old2new, binary=True)
 
-    return f"{brand}-{int(line[:6])};{sales_date};;{int(line[27:37])};{line[14:27]};{quantity};" \
-           f"{float(int(line[42:51])/100):.2f};{line[-1]}"
 
+def parse_sales(line: str, brand: str) -> str:
+    return PARSERS[FileType.VEN](line, brand)
 
-def parse_traffic(line: str, brand: str) -> str:
-    traffic_date = datetime.strptime(line[6:14], '%Y%m%d').strftime('%Y-%m-%d')
 
-    return f"{brand}-{int(line[:6])};{traffic_date};{int(line[14:18])}"
+def parse_traffic(line: str, brand: str) -> str:
+    return PARSERS[FileType.TRF](line, brand)
 
 
 def parse_interstore_transfer(line: str, brand: str) -> str:
-    transfer_date = datetime.strptime(line[:8], '%Y%m%d').strftime('%Y-%m-%d')
-
-    return f"{transfer_date};;{brand}-{int(line[8:14])};{brand}-{int(line[14:20])};{line[20:33]};{int(line[-4:])}"
+    return PARSERS[FileType.TRS](line, brand)
 
 
 def parse_delivery_validation(line: str, brand: str) -> str:
-    reception_date = datetime.strptime(line[-8:], '%Y%m%d').strftime('%Y-%m-%d')
-
-    return f"{brand}-{int(line[:6])};{line[6:26]};{line[26:39]};{int(line[39:44])};{reception_date}"
+    return PARSERS[FileType.VAL](line, brand)
 
 
-line_parsers = [parse_traffic, parse_interstore_transfer, parse_delivery_validation, parse_sales]
+def parse_batches(lines: Iterable[AnyStr], file_type: FileType, brand_code: str,
+                  batch_size: int = BATCH_SIZE) -> Iterator[List[AnyStr]]:
+    """
+    Convert lines from old .dat format to new CSV format, batch by batch. Bytes lines are converted to bytes
 
-PARSERS = dict(zip([t for t in FileType], line_parsers))
-
-
-def parse(file: Path, file_type: FileType, brand_code: str) -> str:
+    >>> list(parse_batches(["000778202203290008", "000778202203300012"], FileType("TRF"), "JAC", batch_size=1))
+    [['JAC-778;2022-03-29;8'], ['JAC-778;2022-03-30;12']]
+    >>> list(parse_batches([b"000778202203290008"], FileType("TRF"), "JAC"))
+    [[b'JAC-778;2022-03-29;8']]
+    """
+    type_parser = PARSERS.get(file_type, dummyparser)
+    bytes_parser = BYTES_PARSERS.get(file_type, dummyparser)
+    brand_bytes = brand_code.encode("utf-8")
+    for batch in batched(lines, batch_size):
+        if isinstance(batch[0], bytes):
+            yield [bytes_parser(line, brand_bytes) for line in batch]
+        else:
+            yield [type_parser(line, brand_code) for line in batch]
+
+
+def parse_record_batches(lines: Iterable[AnyStr], file_type: FileType,
+                         batch_size: int = BATCH_SIZE) -> Iterator[RecordBatch]:
+    """
+    Split lines of old .dat format in columnar RecordBatches, batch by batch
+
+    >>> [batch.to_new("JAC") for batch in parse_record_batches(["000778202203290008"], FileType("TRF"))]
+    [['JAC-778;2022-03-29;8']]
+    """
+    for batch in batched(lines, batch_size):
+        yield RecordBatch.from_old(batch, file_type)
+
+
+def get_batch_parser(engine: str = "python") -> Callable[..., Iterator[List[str]]]:
+    """
+    Get the parse_batches function of an engine, the numpy engine falls back to python when NumPy is not installed.
+    The bytes engine is the python one fed with undecoded ASCII lines (see iter_parse)
+
+    :param engine: name of the engine, one of ENGINES
+    :return: a function with the signature of parse_batches
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}")
+    if engine == "numpy":
+        from . import old_numpy
+        if old_numpy.numpy is not None:
+            return old_numpy.parse_batches
+        tools.logger.warning("NumPy is not installed, falling back to python engine")
+    return parse_batches
+
+
+def iter_parse(file: Path, file_type: FileType, brand_code: str, engine: str = "python") -> Iterator[List[str]]:
+    """
+    Lazily convert an old style file, only one batch of lines is held in memory at a time. The bytes engine reads
+    and converts lines as bytes, without decoding them, and fails on files which are not ASCII
+
+    :param file: file to convert
+    :param file_type: Type of the file (see enum cli_sols_auto.parse_sols_auto.tools.FileType)
+    :param brand_code: Brand code that will be use to prefix store codes
+    :param engine: name of the conversion engine, one of ENGINES
+    :return: an iterator over batches of converted lines
+    """
     if not file.exists():
         raise RuntimeError("File does not exists.")
-    data = file.read_text(encoding='utf-8')
-    type_parser = PARSERS.get(file_type, dummyparser)
+    return get_batch_parser(engine)(read_lines(file, binary=engine == "bytes"), file_type, brand_code)
 
-    return "\n".join(type_parser(line, brand_code) for line in data.splitlines(False))
 
+def parse(file: Path, file_type: FileType, brand_code: str) -> str:
+    return "\n".join(chain.from_iterable(iter_parse(file, file_type, brand_code)))
 
 if __name__ == '__main__':
     import doctest
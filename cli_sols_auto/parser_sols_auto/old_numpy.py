@@ -0,0 +1,137 @@
+"""
+Vectorized conversion of old .dat files with NumPy.
+
+Records of a batch are viewed as a fixed-width byte array and every field is extracted for all the rows at once.
+Batches the vectorized path cannot handle exactly like the scalar parsers (wrong record width, non digit
+characters, invalid dates) and types whose new files do not have dates in the default format are converted by
+cli_sols_auto.parser_sols_auto.old instead.
+"""
+from typing import Iterable, Iterator, List
+
+from . import old
+from .schema import has_default_dates, SCHEMAS
+from .tools import BATCH_SIZE, batched, FileType
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+WIDTHS = {file_type: schema.width for file_type, schema in SCHEMAS.items()}
+
+_ZERO, _NINE, _DASH = ord("0"), ord("9"), ord("-")
+
+
+class _Fallback(Exception):
+    pass
+
+
+def _records(batch: List[str], width: int):
+    if any(len(line) != width for line in batch):
+        raise _Fallback()
+    try:
+        data = "".join(batch).encode("ascii")
+    except UnicodeEncodeError:
+        raise _Fallback()
+    return numpy.frombuffer(data, dtype=numpy.uint8).reshape(len(batch), width)
+
+
+def _digits(records, start: int, stop: int):
+    digits = records[:, start:stop]
+    if ((digits < _ZERO) | (digits > _NINE)).any():
+        raise _Fallback()
+    return digits
+
+
+def _values(records, start: int, stop: int):
+    digits = _digits(records, start, stop).astype(numpy.int64) - _ZERO
+    return digits @ 10 ** numpy.arange(stop - start - 1, -1, -1, dtype=numpy.int64)
+
+
+def _integers(records, start: int, stop: int) -> List[str]:
+    return _values(records, start, stop).astype(str).tolist()
+
+
+def _text(records, start: int, stop: int) -> List[str]:
+    field = numpy.ascontiguousarray(records[:, start:stop])
+    return field.view(f"S{stop - start}").ravel().astype(f"U{stop - start}").tolist()
+
+
+def _dates(records, start: int) -> List[str]:
+    digits = _digits(records, start, start + 8)
+    dates = numpy.full((len(records), 10), _DASH, dtype=numpy.uint8)
+    dates[:, 0:4] = digits[:, 0:4]
+    dates[:, 5:7] = digits[:, 4:6]
+    dates[:, 8:10] = digits[:, 6:8]
+    dates = dates.view("S10").ravel()
+    try:
+        dates.astype("datetime64[D]")
+    except ValueError:
+        raise _Fallback()
+    if (dates < b"0001").any():
+        raise _Fallback()
+    return dates.astype("U10").tolist()
+
+
+def _template(brand: str, template: str) -> str:
+    return template.replace("{brand}", brand.replace("{", "{{").replace("}", "}}"))
+
+
+def parse_sales(records, brand: str) -> List[str]:
+    sign = records[:, 37]
+    negative = sign == _DASH
+    if not (negative | ((sign >= _ZERO) & (sign <= _NINE))).all():
+        raise _Fallback()
+    units = _values(records, 38, 42)
+    quantity = numpy.where(negative, -units, (sign.astype(numpy.int64) - _ZERO) * 10000 + units)
+    # cents are copied as text, they must be digits as the euros are
+    _digits(records, 49, 51)
+    template = _template(brand, "{brand}-{};{};;{};{};{};{}.{};{}")
+    return list(map(template.format, _integers(records, 0, 6), _dates(records, 6), _integers(records, 27, 37),
+                    _text(records, 14, 27), quantity.astype(str).tolist(), _integers(records, 42, 49),
+                    _text(records, 49, 51), _text(records, 51, 52)))
+
+
+def parse_traffic(records, brand: str) -> List[str]:
+    template = _template(brand, "{brand}-{};{};{}")
+    return list(map(template.format, _integers(records, 0, 6), _dates(records, 6), _integers(records, 14, 18)))
+
+
+def parse_interstore_transfer(records, brand: str) -> List[str]:
+    template = _template(brand, "{};;{brand}-{};{brand}-{};{};{}")
+    return list(map(template.format, _dates(records, 0), _integers(records, 8, 14), _integers(records, 14, 20),
+                    _text(records, 20, 33), _integers(records, 33, 37)))
+
+
+def parse_delivery_validation(records, brand: str) -> List[str]:
+    template = _template(brand, "{brand}-{};{};{};{};{}")
+    return list(map(template.format, _integers(records, 0, 6), _text(records, 6, 26), _text(records, 26, 39),
+                    _integers(records, 39, 44), _dates(records, 44)))
+
+
+line_parsers = [parse_traffic, parse_interstore_transfer, parse_delivery_validation, parse_sales]
+
+PARSERS = dict(zip([t for t in FileType], line_parsers))
+
+
+def parse_batches(lines: Iterable[str], file_type: FileType, brand_code: str,
+                  batch_size: int = BATCH_SIZE) -> Iterator[List[str]]:
+    """
+    Convert lines from old .dat format to new CSV format, batch by batch, extracting fields for a whole batch at once
+
+    >>> list(parse_batches(["000778202203290008", "000778202203300012"], FileType("TRF"), "JAC"))
+    [['JAC-778;2022-03-29;8', 'JAC-778;2022-03-30;12']]
+
+    Batches that can not be decoded as fixed width records of digits are converted line by line:
+    >>> list(parse_batches(["000778202203290008", "00077820220330  12"], FileType("TRF"), "JAC"))
+    [['JAC-778;2022-03-29;8', 'JAC-778;2022-03-30;12']]
+    """
+    if not has_default_dates(file_type):
+        yield from old.parse_batches(lines, file_type, brand_code, batch_size)
+        return
+    type_parser = PARSERS[file_type]
+    for batch in batched(lines, batch_size):
+        try:
+            yield type_parser(_records(batch, WIDTHS[file_type]), brand_code)
+        except _Fallback:
+            yield from old.parse_batches(batch, file_type, brand_code, batch_size)
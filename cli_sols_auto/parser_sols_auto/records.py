@@ -0,0 +1,97 @@
+"""
+Random access to the records of old .dat files.
+
+Records of old files have a fixed width, record N starts at N times the width plus the line terminator. DatRecords
+maps a file in memory and only reads and converts the records which are accessed, so a few records of a multi-GB
+file can be sampled without converting the whole file.
+"""
+import mmap
+from pathlib import Path
+from typing import Iterator, List, Sequence, Union
+
+from . import old
+from .schema import SCHEMAS
+from .tools import BATCH_SIZE, compression, FileType
+
+
+class DatRecords(Sequence):
+    """
+    Old .dat file as a lazily converted sequence of new CSV lines, supporting len(), indexing, slicing and iteration
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     file = Path(tmp_dir) / "Traffic.dat"
+    ...     _ = file.write_bytes(b"000778202203290008\\n000778202203300012\\n000778202203310100")
+    ...     with DatRecords(file, FileType("TRF"), "JAC") as records:
+    ...         print(len(records), records[-1], records[:2], records.raw(0))
+    3 JAC-778;2022-03-31;100 ['JAC-778;2022-03-29;8', 'JAC-778;2022-03-30;12'] b'000778202203290008'
+    """
+
+    def __init__(self, file: Path, file_type: FileType, brand_code: str):
+        """
+        :param file: old .dat file, its records must all have the width of file_type
+        :param file_type: Type of the file (see enum cli_sols_auto.parse_sols_auto.tools.FileType)
+        :param brand_code: Brand code that will be use to prefix store codes
+        """
+        if not file.exists():
+            raise RuntimeError("File does not exists.")
+        if compression(file):
+            raise ValueError(f"Records of compressed file {file} can not be accessed randomly")
+        self.file, self.file_type, self.brand_code = file, file_type, brand_code
+        self.width = SCHEMAS[file_type].width
+        self._parser = old.PARSERS[file_type]
+        with file.open("rb") as stream:
+            size = stream.seek(0, 2)
+            self._map = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._terminator = b"\r\n" if self._map[self.width:self.width + 2] == b"\r\n" else b"\n"
+        self._stride = self.width + len(self._terminator)
+        # the last record may or may not be terminated
+        self._length, remainder = divmod(size + len(self._terminator), self._stride)
+        if remainder == len(self._terminator) or not size:
+            self._length, remainder = size // self._stride, 0
+        if remainder:
+            self.close()
+            raise ValueError(f"{file} is not a file of {self.width} characters {file_type.name} records")
+
+    def __len__(self) -> int:
+        return self._length
+
+    def raw(self, index: int) -> bytes:
+        """
+        Record at index as it is stored in the file
+        """
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("record index out of range")
+        start = index * self._stride
+        record = self._map[start:start + self.width]
+        if b"\n" in record or self._map[start + self.width:start + self._stride] not in (self._terminator, b""):
+            raise ValueError(f"Incorrect record {index} in {self.file}, records are not {self.width} characters wide")
+        return record
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        return self._parser(self.raw(index).decode("ascii"), self.brand_code)
+
+    def __iter__(self) -> Iterator[str]:
+        for start in range(0, self._length, BATCH_SIZE):
+            data = self._map[start * self._stride:(start + BATCH_SIZE) * self._stride].decode("ascii")
+            lines = data.split(self._terminator.decode("ascii"))
+            if not lines[-1]:
+                lines.pop()
+            if any(len(line) != self.width for line in lines):
+                raise ValueError(f"Incorrect records in {self.file}, records are not {self.width} characters wide")
+            for batch in old.parse_batches(lines, self.file_type, self.brand_code, BATCH_SIZE):
+                yield from batch
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+    def __enter__(self) -> "DatRecords":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
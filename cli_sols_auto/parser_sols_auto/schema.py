@@ -0,0 +1,421 @@
+"""
+Declarative description of the records of every FileType, compiled into specialised line converters.
+
+A Schema lists the columns of new CSV files and the fixed-width fields of old .dat records. compile_new2old and
+compile_old2new generate, once per process, the source of a function converting a line in one direction and
+compile it, so both directions keep a single straight-line hot loop without any per field dispatch.
+"""
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from enum import Enum
+from functools import lru_cache
+from itertools import chain, islice
+from typing import AnyStr, Callable, Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+from .tools import FileType, NEW_NAMES
+
+DATE_FORMAT = "%Y-%m-%d"
+"""Default format of the dates of new CSV files"""
+
+
+class Kind(str, Enum):
+    TEXT = "TEXT"  # copied as is, padded with pad
+    NUMBER = "NUMBER"  # leading zeros are removed in new files
+    UNSIGNED = "UNSIGNED"  # NUMBER which must only contain digits in new files
+    STORE = "STORE"  # NUMBER prefixed with the brand code and a dash in new files
+    SIGNED = "SIGNED"  # NUMBER whose sign takes the first character of old field when negative
+    CENTS = "CENTS"  # decimal price in new files, cents in old files
+    DATE = "DATE"  # date_format in new files, YYYYMMDD in old files
+    CHAR = "CHAR"  # first character of the column of new files
+
+
+class Field(NamedTuple):
+    name: str
+    width: int
+    kind: Kind = Kind.TEXT
+    pad: str = "0"
+    date_format: str = DATE_FORMAT
+
+
+class Schema(NamedTuple):
+    columns: Tuple[str, ...]
+    """Columns of new CSV files, in order. Columns without a field are left empty when converting to new files"""
+    fields: Tuple[Field, ...]
+    """Fields of old .dat records, in order"""
+    optional: Tuple[str, ...] = ()
+    """Optional trailing columns of new CSV files, ignored when converting"""
+
+    @property
+    def width(self) -> int:
+        return sum(field.width for field in self.fields)
+
+    def offsets(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Start and end of every field in old .dat records
+
+        >>> SCHEMAS[FileType.TRF].offsets()
+        {'store_code': (0, 6), 'traffic_date': (6, 14), 'traffic_number': (14, 18)}
+        """
+        offsets, start = {}, 0
+        for field in self.fields:
+            offsets[field.name] = (start, start + field.width)
+            start += field.width
+        return offsets
+
+
+SCHEMAS = {
+    FileType.TRF: Schema(
+        columns=("store_code", "traffic_date", "traffic_number"),
+        optional=("receipts_number", "min_receipt_number", "max_receipt_number"),
+        fields=(
+            Field("store_code", 6, Kind.STORE),
+            Field("traffic_date", 8, Kind.DATE),
+            Field("traffic_number", 4, Kind.NUMBER),
+        ),
+    ),
+    FileType.TRS: Schema(
+        columns=("transfer_date", "transfer_time", "sender_code", "receiver_code", "barcode", "quantity"),
+        fields=(
+            Field("transfer_date", 8, Kind.DATE),
+            Field("sender_code", 6, Kind.STORE),
+            Field("receiver_code", 6, Kind.STORE),
+            Field("barcode", 13),
+            Field("quantity", 4, Kind.UNSIGNED),
+        ),
+    ),
+    FileType.VAL: Schema(
+        columns=("store_code", "parcel_number", "barcode", "quantity", "reception_date"),
+        optional=("reception_time", "reserved"),
+        fields=(
+            Field("store_code", 6, Kind.STORE),
+            Field("parcel_number", 20),
+            Field("barcode", 13),
+            Field("quantity", 5, Kind.NUMBER),
+            Field("reception_date", 8, Kind.DATE),
+        ),
+    ),
+    FileType.VEN: Schema(
+        columns=("store_code", "sales_date", "sales_time", "receipt_number", "barcode", "quantity", "price",
+                 "pos_id"),
+        optional=("ship_from_store",),
+        fields=(
+            Field("store_code", 6, Kind.STORE),
+            Field("sales_date", 8, Kind.DATE),
+            Field("barcode", 13),
+            Field("receipt_number", 10, Kind.NUMBER),
+            Field("quantity", 5, Kind.SIGNED),
+            Field("price", 9, Kind.CENTS),
+            Field("pos_id", 1, Kind.CHAR),
+        ),
+    ),
+}
+
+
+def detect_file_type(name: str, lines: Iterable[AnyStr] = (), old: bool = False) -> FileType:
+    """
+    Infer the FileType of a file from its name, else from the first of its lines: the record width of old files or
+    the field count of new files. Types those allow for the line (TRF, TRS and VAL new lines can have 6 fields, VAL
+    and VEN records are 52 characters wide) are narrowed to the ones converting it, see _converts
+
+    >>> detect_file_type("20220101120245_Sales_20012022_1234.csv")
+    <FileType.VEN: 'VEN'>
+    >>> detect_file_type("Trs_20012022.dat.gz", old=True)
+    <FileType.TRS: 'TRS'>
+    >>> detect_file_type("export.dat", [b"000778202203290008"], old=True)
+    <FileType.TRF: 'TRF'>
+    >>> detect_file_type("export.csv", ["JAC-778;2022-03-23;14-14-25;4132371;3603652296639;1;395.00;3"])
+    <FileType.VEN: 'VEN'>
+    >>> detect_file_type("export.csv", ["2021-11-01;;OKA-1210;OKA-1889;3604277211410;5"])
+    <FileType.TRS: 'TRS'>
+    >>> detect_file_type("export.dat", ["0007782022032336036522966390004132371000010000395003"], old=True)
+    <FileType.VEN: 'VEN'>
+    >>> detect_file_type("export.dat", ["00077820220323"], old=True)
+    Traceback (most recent call last):
+    ...
+    ValueError: Type of export.dat can not be detected, its records could be none of the types
+
+    :param name: name of the file
+    :param lines: lines of the file, only the first one is read and only when name is not enough
+    :param old: the file is an old .dat file, else a new CSV file
+    :raise ValueError: when neither the name nor the first line match a single type
+    """
+    for file_type in FileType:
+        word = file_type.title() if old else NEW_NAMES[file_type]
+        if re.search(f"(^|[^A-Za-z]){word}_", name):
+            return file_type
+    line = next(iter(lines), None)
+    if line is None:
+        raise ValueError(f"Type of {name} can not be detected from its name and it is empty")
+    line = line.rstrip("\r" if isinstance(line, str) else b"\r")
+    if old:
+        candidates = [file_type for file_type, schema in SCHEMAS.items() if schema.width == len(line)]
+    else:
+        count = line.count(";" if isinstance(line, str) else b";") + 1
+        candidates = [file_type for file_type, schema in SCHEMAS.items()
+                      if len(schema.columns) <= count <= len(schema.columns) + len(schema.optional)]
+    if len(candidates) > 1:
+        candidates = [file_type for file_type in candidates if _converts(file_type, line, old)]
+    if len(candidates) != 1:
+        raise ValueError(f"Type of {name} can not be detected, its records could be "
+                         f"{', '.join(file_type.value for file_type in candidates) or 'none of the types'}")
+    return candidates[0]
+
+
+def _converts(file_type: FileType, line: AnyStr, old: bool) -> bool:
+    """
+    Whether line is a record of file_type: an old record converts to a new line, a new line converts to an old
+    record which converts back, and its dates are not before 1900. new2old converters check little more than the
+    field count, the round trip checks the width, numbers and dates of the fields
+    """
+    binary = isinstance(line, bytes)
+    try:
+        record = line if old else compile_new2old(file_type, binary)(line)
+        compile_old2new(file_type, binary)(record, b"X" if binary else "X")
+    except (ValueError, IndexError):
+        return False
+    schema = SCHEMAS[file_type]
+    # digits of other fields may read as a date of the first centuries
+    return all(int(record[start:start + 4]) >= 1900
+               for field, (start, _) in zip(schema.fields, schema.offsets().values()) if field.kind == Kind.DATE)
+
+
+def detect_lines_type(name: str, lines: Iterable[AnyStr], old: bool = False) -> Tuple[FileType, Iterator[AnyStr]]:
+    """
+    Detect the FileType of lines named name, see detect_file_type
+
+    >>> file_type, lines = detect_lines_type("-", iter(["JAC-778;2022-03-29;8"]))
+    >>> file_type, list(lines)
+    (<FileType.TRF: 'TRF'>, ['JAC-778;2022-03-29;8'])
+
+    :return: the FileType and an iterator over all the lines, including the first one read to detect the type
+    """
+    lines = iter(lines)
+    first_line = list(islice(lines, 1))
+    return detect_file_type(name, first_line, old), chain(first_line, lines)
+
+
+def to_cents(price: AnyStr, line: AnyStr) -> int:
+    """
+    Convert a decimal price to cents exactly, ',' is accepted as decimal separator
+
+    >>> to_cents("395,99", "")
+    39599
+    >>> to_cents(b"395.9", b"")
+    39590
+    """
+    if isinstance(price, bytes):
+        price, line = price.decode("ascii"), line.decode("ascii")
+    try:
+        return int(Decimal(price.replace(',', '.')) * 100)
+    except InvalidOperation:
+        raise ValueError(f"Incorrect input data {line}")
+
+
+@lru_cache(maxsize=4096)
+def to_date(value: AnyStr, date_format: str) -> AnyStr:
+    """
+    Convert a YYYYMMDD date to date_format, dates are cached as every line of a file usually has the same
+
+    >>> to_date("20220329", "%Y-%m-%d")
+    '2022-03-29'
+    >>> to_date(b"20220329", "%Y-%m-%d")
+    b'2022-03-29'
+    """
+    if isinstance(value, bytes):
+        return to_date(value.decode("ascii"), date_format).encode("ascii")
+    return datetime.strptime(value, '%Y%m%d').strftime(date_format)
+
+
+@lru_cache(maxsize=4096)
+def from_date(value: AnyStr, date_format: str) -> AnyStr:
+    """
+    Convert a date_format date to YYYYMMDD, dates are cached as every line of a file usually has the same
+
+    >>> from_date("29/03/2022", "%d/%m/%Y")
+    '20220329'
+    >>> from_date(b"29/03/2022", "%d/%m/%Y")
+    b'20220329'
+    """
+    if isinstance(value, bytes):
+        return from_date(value.decode("ascii"), date_format).encode("ascii")
+    return datetime.strptime(value, date_format).strftime('%Y%m%d')
+
+
+def has_default_dates(file_type: FileType) -> bool:
+    """
+    Whether the dates of file_type are in DATE_FORMAT in new files, the only format of the vectorized engines
+    """
+    return all(field.date_format == DATE_FORMAT for field in SCHEMAS[file_type].fields if field.kind == Kind.DATE)
+
+
+def _literal(value: str, binary: bool) -> str:
+    return repr(value.encode("ascii")) if binary else repr(value)
+
+
+def _error(binary: bool) -> str:
+    return "        raise ValueError(f'Incorrect input data {line%s}')" % (".decode()" if binary else "")
+
+
+def _new2old_source(name: str, schema: Schema, binary: bool) -> str:
+    min_columns, max_columns = len(schema.columns), len(schema.columns) + len(schema.optional)
+    fields = {field.name for field in schema.fields}
+    names = ", ".join(column if column in fields else "_" for column in schema.columns)
+    error = _error(binary)
+    lines: List[str] = [
+        f"def {name}(line):",
+        f"    data = line.split({_literal(';', binary)})",
+        f"    if len(data) < {min_columns} or len(data) > {max_columns}:" if schema.optional
+        else f"    if len(data) != {min_columns}:",
+        error,
+        f"    {names}, = data[:{min_columns}]",
+    ]
+    output = []
+    for field in schema.fields:
+        value, pad = field.name, _literal(field.pad, binary)
+        if field.kind == Kind.UNSIGNED:
+            lines += [f"    if not {value}.isdigit():", error]
+        elif field.kind == Kind.SIGNED:
+            magnitude = f"({_literal('%d', binary)} % abs(int({value}))).rjust({field.width - 1}, {pad})"
+            lines.append(f"    {value} = {value}.rjust({field.width}, {pad}) if int({value}) > 0 "
+                         f"else {_literal('-', binary)} + {magnitude}")
+            output.append(value)
+            continue
+        elif field.kind == Kind.CENTS:
+            lines.append(f"    {value} = {_literal('%d', binary)} % to_cents({value}, line)")
+        elif field.kind == Kind.STORE:
+            value = f"{value}[4:]"
+        elif field.kind == Kind.DATE:
+            if field.date_format == DATE_FORMAT:
+                # only the dashes of the default format differ from YYYYMMDD, as the first parsers did
+                output.append(f"{value}.replace({_literal('-', binary)}, {_literal('', binary)})")
+            else:
+                output.append(f"from_date({value}, {field.date_format!r})")
+            continue
+        elif field.kind == Kind.CHAR:
+            lines += [f"    if not {value}:", error]
+            output.append(f"{value}[:1]" if binary else f"{value}[0]")
+            continue
+        output.append(f"{value}.rjust({field.width}, {pad})")
+    if binary:
+        lines.append(f"    return b''.join(({', '.join(output)},))")
+    else:
+        lines.append(f"    return f\"{''.join('{' + expression + '}' for expression in output)}\"")
+    return "\n".join(lines)
+
+
+def _old2new_source(name: str, schema: Schema, binary: bool) -> str:
+    # fields are sliced at fixed offsets, records of another width would be silently shifted
+    lines: List[str] = [f"def {name}(line, brand):", f"    if len(line) != {schema.width}:", _error(binary)]
+    values = {}
+    for field, (start, end) in zip(schema.fields, schema.offsets().values()):
+        value = f"line[{start}:{end}]"
+        if field.kind in (Kind.NUMBER, Kind.UNSIGNED):
+            values[field.name] = [("", "d", f"int({value})")]
+        elif field.kind == Kind.STORE:
+            values[field.name] = [("", "s", "brand"), ("-", "d", f"int({value})")]
+        elif field.kind == Kind.SIGNED:
+            lines.append(f"    {field.name} = -int(line[{start + 1}:{end}]) if line[{start}:{start + 1}] == "
+                         f"{_literal('-', binary)} else int({value})")
+            values[field.name] = [("", "d", field.name)]
+        elif field.kind == Kind.CENTS:
+            values[field.name] = [("", ".2f", f"int({value}) / 100")]
+        elif field.kind == Kind.DATE:
+            values[field.name] = [("", "s", f"to_date({value}, {field.date_format!r})")]
+        else:
+            values[field.name] = [("", "s", value)]
+    pieces = []
+    for index, column in enumerate(schema.columns):
+        separator = ";" if index else ""
+        if column not in values:
+            pieces.append((separator, None, None))
+            continue
+        (prefix, conversion, expression), *others = values[column]
+        pieces += [(separator + prefix, conversion, expression)] + others
+    if binary:
+        template = "".join(literal + ("" if conversion is None else "%" + conversion)
+                           for literal, conversion, _ in pieces)
+        expressions = ", ".join(expression for _, _, expression in pieces if expression is not None)
+        lines.append(f"    return {_literal(template, True)} % ({expressions},)")
+    else:
+        template = "".join(literal + ("" if expression is None else "{" + expression +
+                                      ("" if conversion in ("s", "d") else ":" + conversion) + "}")
+                           for literal, conversion, expression in pieces)
+        lines.append(f"    return f\"{template}\"")
+    return "\n".join(lines)
+
+
+def _compile(source: str, name: str) -> Callable:
+    namespace = {"from_date": from_date, "to_cents": to_cents, "to_date": to_date}
+    exec(compile(source, f"<schema {name}>", "exec"), namespace)
+    function = namespace[name]
+    function.__source__ = source
+    return function
+
+
+class LazyConverters(dict):
+    """
+    Converters of every FileType, compiled on first access
+
+    >>> converters = LazyConverters(compile_new2old)
+    >>> converters[FileType.TRF]("JAC-778;2022-03-29;8"), list(converters)
+    ('000778202203290008', [<FileType.TRF: 'TRF'>])
+    """
+
+    def __init__(self, compile_function: Callable[..., Callable], binary: bool = False):
+        super().__init__()
+        self._compile, self._binary = compile_function, binary
+
+    def __missing__(self, file_type: FileType) -> Callable:
+        if file_type not in SCHEMAS:
+            raise KeyError(file_type)
+        converter = self[file_type] = self._compile(FileType(file_type), self._binary)
+        return converter
+
+    def get(self, file_type: FileType, default: Callable = None) -> Callable:
+        try:
+            return self[file_type]
+        except KeyError:
+            return default
+
+
+@lru_cache(maxsize=None)
+def compile_new2old(file_type: FileType, binary: bool = False) -> Callable[[AnyStr], AnyStr]:
+    """
+    Compile the function converting a line of file_type from new CSV format to old .dat format, the function
+    converts bytes lines when binary is set
+
+    >>> compile_new2old(FileType.TRF)("JAC-778;2022-03-29;8;5")
+    '000778202203290008'
+    >>> compile_new2old(FileType.TRF, binary=True)(b"JAC-778;2022-03-29;8;5")
+    b'000778202203290008'
+    >>> print(compile_new2old(FileType.TRF).__source__)
+    def new2old_trf(line):
+        data = line.split(';')
+        if len(data) < 3 or len(data) > 6:
+            raise ValueError(f'Incorrect input data {line}')
+        store_code, traffic_date, traffic_number, = data[:3]
+        return f"{store_code[4:].rjust(6, '0')}{traffic_date.replace('-', '')}{traffic_number.rjust(4, '0')}"
+    """
+    name = f"new2old_{file_type.value.lower()}{'_bytes' if binary else ''}"
+    return _compile(_new2old_source(name, SCHEMAS[file_type], binary), name)
+
+
+@lru_cache(maxsize=None)
+def compile_old2new(file_type: FileType, binary: bool = False) -> Callable[[AnyStr, AnyStr], AnyStr]:
+    """
+    Compile the function converting a line of file_type from old .dat format to new CSV format, the function
+    converts bytes lines, with a bytes brand, when binary is set
+
+    >>> compile_old2new(FileType.TRF)("000778202203290008", "JAC")
+    'JAC-778;2022-03-29;8'
+    >>> compile_old2new(FileType.TRF, binary=True)(b"000778202203290008", b"JAC")
+    b'JAC-778;2022-03-29;8'
+    >>> print(compile_old2new(FileType.TRF).__source__)
+    def old2new_trf(line, brand):
+        if len(line) != 18:
+            raise ValueError(f'Incorrect input data {line}')
+        return f"{brand}-{int(line[0:6])};{to_date(line[6:14], '%Y-%m-%d')};{int(line[14:18])}"
+    """
+    name = f"old2new_{file_type.value.lower()}{'_bytes' if binary else ''}"
+    return _compile(_old2new_source(name, SCHEMAS[file_type], binary), name)
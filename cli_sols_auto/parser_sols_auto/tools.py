@@ -1,4 +1,14 @@
+import importlib
+import io
 from enum import Enum
+from itertools import islice
+from pathlib import Path
+from typing import AnyStr, BinaryIO, Iterable, Iterator, List, Optional, Tuple, Union
+
+BATCH_SIZE = 10_000
+CHUNK_SIZE = 64 * 1024 * 1024
+ENGINES = ("python", "numpy", "bytes")
+DIRECTIONS = ("new2old", "old2new")
 
 
 def dummyparser():
@@ -10,3 +20,255 @@ class FileType(str, Enum):
     TRS = "TRS"
     VAL = "VAL"
     VEN = "VEN"
+
+
+# Names of every FileType in new file names, old file names use FileType.title()
+NEW_NAMES = {FileType.TRF: "Traffic", FileType.TRS: "Transfers", FileType.VAL: "Validation", FileType.VEN: "Sales"}
+
+
+def batched(iterable: Iterable, size: int = BATCH_SIZE) -> Iterator[List]:
+    """
+    Group an iterable in lists of at most size elements
+
+    >>> list(batched(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class FileRange(io.RawIOBase):
+    """
+    Raw binary stream over the bytes [start, end) of a file
+    """
+
+    def __init__(self, file: Path, start: int, end: int):
+        super().__init__()
+        self._file = file.open("rb")
+        self._file.seek(start)
+        self._remaining = end - start
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = self._file.readinto(memoryview(buffer)[:self._remaining])
+        self._remaining -= size
+        return size
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+COMPRESSIONS = {"gz": "gzip", "bz2": "bz2", "xz": "lzma"}
+"""Suffixes of the compressed files, with the module (de)compressing them"""
+
+
+def compression(file: Path) -> Optional[str]:
+    """
+    Compression of file according to its suffix
+
+    >>> compression(Path("Sales_20220301.csv.gz")), compression(Path("Sales_20220301.csv"))
+    ('gz', None)
+    """
+    suffix = Path(file).suffix[1:].lower()
+    return suffix if suffix in COMPRESSIONS else None
+
+
+def open_input(file: Path) -> BinaryIO:
+    """
+    Open file for reading as a binary stream, compressed files are decompressed on the fly
+    """
+    kind = compression(file)
+    if kind is None:
+        return file.open("rb")
+    # compression modules are only imported when needed
+    module = importlib.import_module(COMPRESSIONS[kind])
+    return module.open(file, "rb")
+
+
+def compress_output(output: BinaryIO, kind: Optional[str]) -> BinaryIO:
+    """
+    Wrap a binary output to compress what is written into it with kind, closing the wrapper does not close output
+
+    >>> out = io.BytesIO()
+    >>> with compress_output(out, "gz") as compressed:
+    ...     _ = compressed.write(b"000778202203290008")
+    >>> import gzip; gzip.decompress(out.getvalue())
+    b'000778202203290008'
+    """
+    if kind is None:
+        return output
+    module = importlib.import_module(COMPRESSIONS[kind])
+    if kind == "gz":
+        return module.GzipFile(fileobj=output, mode="wb", compresslevel=6)
+    return module.open(output, "wb")
+
+
+def read_lines(file: Path, byte_range: Tuple[int, int] = None, binary: bool = False,
+               check: bool = True) -> Iterator[AnyStr]:
+    """
+    Lazily read a file line by line without the line terminator, gzip, bz2 and xz files are decompressed on the fly
+
+    :param file: file to read
+    :param byte_range: only read the bytes [start, end) of the file when provided, file must not be compressed
+    :param binary: read lines as ASCII bytes, without decoding them
+    :param check: fail on the first line which is not ASCII, or not UTF-8 when not binary. Lines which are not checked
+                  are read as bytes, check_lines checks them later
+    :return: an iterator over the lines of the file
+    """
+    start, end = byte_range or (0, None)
+    if end is None:
+        stream = open_input(file)
+    elif compression(file):
+        raise ValueError(f"Can not read a range of compressed file {file}")
+    else:
+        stream = io.BufferedReader(FileRange(file, start, end))
+    yield from iter_lines(stream, file, binary, start, check=check)
+
+
+def iter_lines(stream: BinaryIO, name: Union[Path, str], binary: bool = False, offset: int = 0,
+               close: bool = True, check: bool = True) -> Iterator[AnyStr]:
+    """
+    Lazily read a binary stream line by line without the line terminator, the stream is closed once read unless close
+    is False
+
+    >>> list(iter_lines(io.BytesIO(b"a\\r\\nb\\n"), "memory"))
+    ['a', 'b']
+
+    :param stream: binary stream to read
+    :param name: name of the stream in error messages
+    :param binary: read lines as ASCII bytes, without decoding them
+    :param offset: position of the stream in the file, for error messages
+    :param check: fail on the first line which is not ASCII, or not UTF-8 when not binary, see read_lines
+    :return: an iterator over the lines of the stream
+    """
+    if binary:
+        try:
+            yield from _read_ascii_lines(name, stream, offset, check=check)
+        finally:
+            if close:
+                stream.close()
+        return
+    try:
+        yield from _read_text_lines(stream, decode=check)
+    finally:
+        if close:
+            stream.close()
+
+
+def _read_text_lines(stream: BinaryIO, block_size: int = 1024 * 1024, decode: bool = True) -> Iterator[AnyStr]:
+    """
+    Read UTF-8 lines by blocks of at most about block_size bytes, decoded at once unless decode is False. Line
+    terminators are universal newlines as in text files, blocks are what the stream has available so lines are
+    yielded as they come
+    """
+    while block := stream.read1(block_size):
+        if not block.endswith(b"\n"):
+            block += stream.readline()
+        if not decode:
+            # bytes only split on universal newlines
+            yield from block.splitlines()
+            continue
+        text = block.decode("utf-8")
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        lines = text.split("\n")
+        if not lines[-1]:
+            lines.pop()
+        yield from lines
+
+
+def _read_ascii_lines(file: Union[Path, str], stream: BinaryIO, offset: int = 0,
+                      block_size: int = 1024 * 1024, check: bool = True) -> Iterator[bytes]:
+    """
+    Read lines by blocks of about block_size bytes, every block is checked to only contain ASCII characters unless
+    check is False
+    """
+    while block := stream.read(block_size):
+        if not block.endswith(b"\n"):
+            block += stream.readline()
+        if check and not block.isascii():
+            position = next(index for index, byte in enumerate(block) if byte > 127)
+            raise ValueError(f"{file} is not an ASCII file, found byte {block[position]:#x} at offset "
+                             f"{offset + position}")
+        offset += len(block)
+        lines = block.split(b"\n")
+        if not lines[-1]:
+            lines.pop()
+        if b"\r" in block:
+            lines = [line[:-1] if line.endswith(b"\r") else line for line in lines]
+        yield from lines
+
+
+def check_lines(lines: List[bytes], binary: bool = False) -> List[AnyStr]:
+    """
+    Check a batch of lines read with check=False as they would have been read: ASCII bytes when binary, else decoded
+    from UTF-8
+
+    >>> check_lines([b"JAC-778", "Zoé".encode()])
+    ['JAC-778', 'Zoé']
+    >>> check_lines([b"JAC-778", "Zoé".encode()], binary=True)
+    Traceback (most recent call last):
+    ...
+    ValueError: Line is not ASCII, found byte 0xc3 at column 3
+
+    :raise ValueError: when a line is not ASCII or not UTF-8
+    """
+    if not binary:
+        # lines hold no newline, they are decoded at once
+        return b"\n".join(lines).decode("utf-8").split("\n") if lines else []
+    if not b"".join(lines).isascii():
+        line = next(line for line in lines if not line.isascii())
+        position = next(index for index, byte in enumerate(line) if byte > 127)
+        raise ValueError(f"Line is not ASCII, found byte {line[position]:#x} at column {position + 1}")
+    return lines
+
+
+def write_batches(batches: Iterable[List[AnyStr]], output: BinaryIO) -> int:
+    """
+    Write batches of lines to output, lines are separated by a newline and the last one is not terminated.
+    Text lines are encoded in UTF-8
+
+    >>> out = io.BytesIO()
+    >>> write_batches([["a", "b"], [b"c"]], out)
+    3
+    >>> out.getvalue()
+    b'a\\nb\\nc'
+
+    :param batches: iterable of lists of lines
+    :param output: binary stream to write into
+    :return: the number of lines written
+    """
+    count = 0
+    for batch in batches:
+        if not batch:
+            continue
+        if count:
+            output.write(b"\n")
+        output.write(b"\n".join(batch) if isinstance(batch[0], bytes) else "\n".join(batch).encode("utf-8"))
+        count += len(batch)
+    return count
+
+
+def split_file(file: Path, chunk_size: int) -> List[Tuple[int, int]]:
+    """
+    Split a file in byte ranges of about chunk_size bytes, every range but the last one ends right after a newline
+
+    :param file: file to split
+    :param chunk_size: minimal size in bytes of a range
+    :return: list of (start, end) offsets covering the whole file
+    """
+    size = file.stat().st_size
+    ranges = []
+    with file.open("rb") as stream:
+        start = 0
+        while start < size:
+            stream.seek(min(start + chunk_size, size) - 1)
+            stream.readline()
+            end = stream.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
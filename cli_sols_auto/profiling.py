@@ -0,0 +1,129 @@
+"""
+Opt-in profiling of real runs: cProfile over a whole command and tracemalloc peak allocation per converted file.
+
+Only the main process is profiled, files and chunks converted by worker processes (--jobs greater than 1 with
+several files or a file split in chunks) are neither profiled nor traced, a warning says so. Profiling modules are
+only imported when profiling is on.
+"""
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, List
+
+import click
+
+import cli_sols_auto.tools as tools
+
+TOP = 20
+profiler_running = memory_tracing = False
+
+
+@contextmanager
+def profile(stats_file: Path, top: int = TOP):
+    """
+    Profile the enclosed code, write the statistics to stats_file and print the top hottest functions
+    """
+    global profiler_running
+    import cProfile
+    import io
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    profiler_running = True
+    try:
+        yield profiler
+    finally:
+        profiler_running = False
+        profiler.disable()
+        profiler.dump_stats(str(stats_file))
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+        click.echo(report.getvalue(), err=True)
+        click.echo(f"Profile written to {stats_file}", err=True)
+
+
+@contextmanager
+def trace_memory_run():
+    """
+    Trace memory allocations of files converted in the enclosed code, see trace_memory
+    """
+    global memory_tracing
+    import tracemalloc
+
+    tracemalloc.start()
+    memory_tracing = True
+    try:
+        yield
+    finally:
+        memory_tracing = False
+        tracemalloc.stop()
+
+
+def warn_workers(advice: str):
+    """
+    Warn that the conversions about to run in worker processes are neither profiled nor traced, when profiling or
+    tracing is on
+    """
+    missed = [name for name, on in (("profiled", profiler_running), ("memory traced", memory_tracing)) if on]
+    if missed:
+        tools.logger.warning(f"Conversions in worker processes are not {' nor '.join(missed)}, {advice}")
+
+
+class MemoryTrace:
+    """
+    Peak traced memory of the conversion of a file, with the allocation sites when the most memory was in use
+    """
+
+    def __init__(self, file: Path, top: int = TOP):
+        import tracemalloc
+
+        self._tracemalloc = tracemalloc
+        self.file, self.top = file, top
+        self.peak = 0
+        self._baseline = tracemalloc.take_snapshot()
+        self._largest, self._snapshot = 0, None
+        tracemalloc.reset_peak()
+
+    def batches(self, batches: Iterable[List]) -> Iterator[List]:
+        """
+        Snapshot allocations whenever more memory than ever is in use once a batch is converted
+        """
+        tracemalloc = self._tracemalloc
+        for batch in batches:
+            current, _ = tracemalloc.get_traced_memory()
+            if current > self._largest:
+                self._largest, self._snapshot = current, tracemalloc.take_snapshot()
+            yield batch
+
+    def report(self) -> str:
+        tracemalloc = self._tracemalloc
+        self.peak = tracemalloc.get_traced_memory()[1]
+        lines = [f"Peak traced memory converting {self.file} : {self.peak / 2 ** 20:.1f} MiB"]
+        if self._snapshot is not None:
+            lines.append(f"Top allocation sites with {self._largest / 2 ** 20:.1f} MiB in use :")
+            ignored = [tracemalloc.Filter(False, tracemalloc.__file__)]
+            snapshot, baseline = self._snapshot.filter_traces(ignored), self._baseline.filter_traces(ignored)
+            for statistic in snapshot.compare_to(baseline, "lineno")[:self.top]:
+                lines.append(f"  {statistic}")
+        return "\n".join(lines)
+
+
+class _NoTrace:
+    @staticmethod
+    def batches(batches: Iterable[List]) -> Iterable[List]:
+        return batches
+
+
+@contextmanager
+def trace_memory(file: Path):
+    """
+    Trace the conversion of file when memory tracing is on, yield an object wrapping batches of converted lines
+    """
+    if not memory_tracing:
+        yield _NoTrace
+        return
+    trace = MemoryTrace(file)
+    try:
+        yield trace
+    finally:
+        click.echo(trace.report(), err=True)
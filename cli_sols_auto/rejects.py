@@ -0,0 +1,105 @@
+"""
+Error tolerant conversion, lines which can not be converted are rejected to a sidecar file instead of failing the file.
+
+Batches are converted whole, only a batch which fails is converted again line by line to find its bad lines. Every
+rejected line is written to the .rejects file next to the output as its line number, the reason and the line itself,
+separated by tabs, so `cut -f3-` gives back the lines to fix and convert again. The file still fails once the rate
+of rejected lines exceeds the maximum error rate.
+"""
+from pathlib import Path
+from typing import AnyStr, BinaryIO, Callable, Iterable, Iterator, List, Optional
+
+import cli_sols_auto.tools as tools
+from cli_sols_auto.parser_sols_auto.tools import batched
+
+REJECTS_SUFFIX = ".rejects"
+
+
+class Rejects:
+    """
+    Lines rejected while converting a file, written to path once it is set
+
+    >>> import tempfile
+    >>> def parse(batch):
+    ...     return [str(int(line) * 2) for line in batch]
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     rejects = Rejects(0.5)
+    ...     rejects.path = Path(tmp_dir) / f"numbers.txt{REJECTS_SUFFIX}"
+    ...     with rejects:
+    ...         converted = list(rejects.convert(["1", "two", "3"], parse))
+    ...     print(converted, rejects.count, repr(rejects.path.read_text()))
+    [['2', '6']] 1 "2\\tValueError: invalid literal for int() with base 10: 'two'\\ttwo\\n"
+    """
+
+    def __init__(self, max_error_rate: float):
+        """
+        :param max_error_rate: highest rate of rejected lines, between 0 and 1, before the conversion fails
+        """
+        self.max_error_rate = max_error_rate
+        self.path: Optional[Path] = None
+        # rejects written to a temporary path are logged under their final name
+        self.name: Optional[str] = None
+        self.count = self.lines = 0
+        self._stream: Optional[BinaryIO] = None
+
+    def reject(self, number: int, line: AnyStr, error: Exception):
+        """
+        Write line number of the file to the rejects with the reason it could not be converted
+        """
+        if self._stream is None:
+            # the rejects file is only created for the first rejected line
+            self._stream = self.path.open("wb")
+        reason = " ".join(f"{type(error).__name__}: {error}".split())
+        raw = line if isinstance(line, bytes) else line.encode("utf-8")
+        self._stream.write(b"%d\t%s\t%s\n" % (number, reason.encode("utf-8", "backslashreplace"), raw))
+        self.count += 1
+
+    def convert(self, lines: Iterable[AnyStr], parse: Callable[[List[AnyStr]], List[AnyStr]]) -> Iterator[List[AnyStr]]:
+        """
+        Convert lines by batches with parse, rejecting the lines parse fails on with a ValueError
+
+        :raise ValueError: when more than max_error_rate of the lines read so far are rejected
+        """
+        for batch in batched(lines):
+            try:
+                converted = parse(batch)
+            except ValueError:
+                converted = []
+                for number, line in enumerate(batch, self.lines + 1):
+                    try:
+                        converted += parse([line])
+                    except ValueError as e:
+                        self.reject(number, line, e)
+            self.lines += len(batch)
+            if self.count > self.max_error_rate * self.lines:
+                raise ValueError(f"{self.count} out of {self.lines} lines rejected, more than the maximum error rate "
+                                 f"of {self.max_error_rate:.2%}")
+            if converted:
+                yield converted
+
+    def _close_stream(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def discard(self):
+        """
+        Remove the rejects of a conversion which failed
+        """
+        self._close_stream()
+        if self.count:
+            self.path.unlink()
+
+    def close(self):
+        self._close_stream()
+        if self.count:
+            tools.logger.warning(f"{self.count} out of {self.lines} lines rejected to {self.name or self.path}")
+
+    def __enter__(self) -> "Rejects":
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -0,0 +1,373 @@
+"""
+Long-lived local conversion service, over localhost HTTP or a Unix socket, so callers do not pay for an interpreter
+per conversion.
+
+POST /convert?direction=new2old&parse_type=VEN converts the request body, or the file given by a path parameter, and
+answers the converted lines. Only files under the root directory of the service can be given by path, paths are
+refused when it has none, path requests have no body. Request bodies are spooled to a temporary file, files given
+by path are read in place, both are converted by a pool of worker processes and the converted file is then streamed
+back, once complete so that a failure is still answered with an error. GET /health answers the state of the
+service as JSON and GET /metrics its counters in Prometheus text exposition format.
+
+Only max_requests conversions are accepted at a time, others are refused with 503 Service Unavailable.
+"""
+import json
+import os
+import shutil
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
+
+import cli_sols_auto.tools as tools
+from cli_sols_auto.app import AUTO, parse_lines
+from cli_sols_auto.parser_sols_auto.schema import detect_file_type
+from cli_sols_auto.parser_sols_auto.tools import DIRECTIONS, ENGINES, FileType, read_lines, write_batches
+
+LINGER_SECONDS = 2.0  # longest wait for the rest of a refused request body
+COPY_SIZE = 1024 * 1024
+
+
+def convert_file(source: str, target: str, direction: str, parse_type: Optional[str], brand_code: str = None,
+                 engine: str = "python", name: str = None) -> Tuple[int, str]:
+    """
+    Convert source to target in a worker process
+
+    :param parse_type: value of the FileType of source, detected from name or the first line of source when None
+    :param name: name of the file source holds, source name by default
+    :return: the number of converted lines and the value of the FileType of source
+    """
+    source = Path(source)
+    file_type = FileType(parse_type) if parse_type else None
+    if file_type is None:
+        with closing(read_lines(source)) as lines:
+            file_type = detect_file_type(name or source.name, lines, old=direction == "old2new")
+    with open(target, "wb") as output:
+        lines = read_lines(source, binary=engine == "bytes")
+        count = write_batches(parse_lines(lines, file_type, brand_code if direction == "old2new" else None, engine),
+                              output)
+    return count, file_type.value
+
+
+class ConversionRequest:
+    """
+    Parameters of a conversion, parsed from the query of a request
+    """
+
+    def __init__(self, query: Dict[str, list], engine: str = "python", root: Path = None):
+        """
+        :param root: resolved directory holding the files which can be converted by path, None to refuse paths
+        :raise ValueError: when a parameter is missing or invalid
+        """
+        def get(key: str, default: str = None) -> Optional[str]:
+            return query.get(key, [default])[-1]
+
+        self.direction = get("direction")
+        if self.direction not in DIRECTIONS:
+            raise ValueError(f"direction must be one of {', '.join(DIRECTIONS)}")
+        parse_type = get("parse_type", AUTO)
+        if parse_type != AUTO and parse_type not in {t.value for t in FileType}:
+            raise ValueError(f"{parse_type} does not exists")
+        self.parse_type = None if parse_type == AUTO else parse_type
+        self.brand_code = get("brand_code")
+        if self.direction == "old2new" and not self.brand_code:
+            raise ValueError("brand_code is required to convert from old to new version")
+        self.engine = get("engine", engine)
+        if self.engine not in ENGINES:
+            raise ValueError(f"Unknown engine {self.engine}")
+        path = get("path")
+        self.path = None
+        if path is not None:
+            if root is None:
+                raise ValueError("path is not accepted, the service has no root directory")
+            # resolved first, so that neither .. nor symbolic links lead out of root
+            resolved = (root / path).resolve()
+            if not resolved.is_relative_to(root) or not resolved.is_file():
+                raise ValueError(f"{path} does not exists under the root directory")
+            self.path = str(resolved)
+        self.name = get("name") or (Path(path).name if path else None)
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # a socket left by a server which did not stop cleanly would prevent binding
+        if os.path.exists(self.server_address) and not os.path.isfile(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "sols_auto"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self) -> "ConversionServer":
+        return self.server.service
+
+    def log_message(self, format: str, *args):
+        tools.logger.debug(f"{self.requestline!r} : {format % args}")
+
+    def _send(self, status: HTTPStatus, body: bytes, content_type: str = "application/json",
+              headers: Dict[str, str] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: HTTPStatus, message: str, headers: Dict[str, str] = None):
+        # the body of the request may not have been read, the connection can not be reused
+        self.close_connection = True
+        self._send(status, json.dumps({"error": message}).encode("utf-8"), headers=dict(headers or {},
+                                                                                          Connection="close"))
+        if self.command == "POST":
+            self._linger()
+
+    def _linger(self):
+        """
+        Discard what the client still sends before closing the connection, a client still sending a refused body
+        would otherwise get a reset connection instead of the response
+        """
+        try:
+            self.connection.shutdown(socket.SHUT_WR)
+            deadline = time.monotonic() + LINGER_SECONDS
+            while (timeout := deadline - time.monotonic()) > 0:
+                self.connection.settimeout(timeout)
+                if not self.connection.recv(COPY_SIZE):
+                    break
+        except OSError:
+            pass
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/health":
+            self._send(HTTPStatus.OK, json.dumps(self.service.health()).encode("utf-8"))
+        elif path == "/metrics":
+            self._send(HTTPStatus.OK, self.service.prometheus().encode("utf-8"), "text/plain; version=0.0.4")
+        else:
+            self._error(HTTPStatus.NOT_FOUND, f"No such endpoint {path}")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != "/convert":
+            self._error(HTTPStatus.NOT_FOUND, f"No such endpoint {url.path}")
+            return
+        try:
+            request = ConversionRequest(parse_qs(url.query), self.service.engine, self.service.root)
+        except ValueError as e:
+            self._error(HTTPStatus.BAD_REQUEST, str(e))
+            return
+        if request.path and self._has_body():
+            self._error(HTTPStatus.BAD_REQUEST, "path requests have no body")
+            return
+        if not self.service.acquire():
+            self.service.count("rejected")
+            self._error(HTTPStatus.SERVICE_UNAVAILABLE, "Too many conversions running", {"Retry-After": "1"})
+            return
+        start = time.perf_counter()
+        target_fd, target = tempfile.mkstemp(dir=self.service.tmp_dir)
+        os.close(target_fd)
+        try:
+            # the slot is released before answering, a client may send its next request as soon as it is answered
+            try:
+                lines, parse_type, bytes_read = self._convert(request, target)
+            except Exception as e:
+                self.service.count("failed")
+                tools.logger.error(f"Conversion of {request.name or 'request body'} failed : {e!r}")
+                # the message of the error may quote the converted lines, it is only logged
+                self._error(HTTPStatus.UNPROCESSABLE_ENTITY, f"Conversion failed : {type(e).__name__}")
+                return
+            finally:
+                self.service.release()
+            size = os.stat(target).st_size
+            self.service.count("converted", lines=lines, bytes_read=bytes_read, bytes_written=size,
+                               seconds=time.perf_counter() - start)
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(size))
+            self.send_header("X-Parse-Type", parse_type)
+            self.send_header("X-Lines", str(lines))
+            self.end_headers()
+            with open(target, "rb") as output:
+                shutil.copyfileobj(output, self.wfile, COPY_SIZE)
+        finally:
+            os.unlink(target)
+
+    def _has_body(self) -> bool:
+        return self.headers.get("Transfer-Encoding", "").lower() == "chunked" \
+            or int(self.headers.get("Content-Length", 0)) > 0
+
+    def _read_body(self, output: BinaryIO) -> int:
+        """
+        Copy the body of the request to output, with a Content-Length or chunked transfer encoding
+        """
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            size = 0
+            while True:
+                chunk_size = int(self.rfile.readline().split(b";")[0], 16)
+                if not chunk_size:
+                    # trailer
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    return size
+                while chunk_size:
+                    data = self.rfile.read(min(chunk_size, COPY_SIZE))
+                    if not data:
+                        raise ConnectionError("Request body ended before its last chunk")
+                    output.write(data)
+                    size, chunk_size = size + len(data), chunk_size - len(data)
+                self.rfile.readline()
+        remaining = int(self.headers.get("Content-Length", 0))
+        size = remaining
+        while remaining:
+            data = self.rfile.read(min(remaining, COPY_SIZE))
+            if not data:
+                raise ConnectionError("Request body ended before its Content-Length")
+            output.write(data)
+            remaining -= len(data)
+        return size
+
+    def _convert(self, request: ConversionRequest, target: str) -> Tuple[int, str, int]:
+        """
+        Convert the body of the request, or the file of its path, to target in a worker process
+
+        :return: the number of converted lines, the value of the FileType converted and the number of bytes read
+        """
+        def submit(source: str) -> Tuple[int, str]:
+            return self.service.executor.submit(convert_file, source, target, request.direction, request.parse_type,
+                                                request.brand_code, request.engine, request.name).result()
+
+        if request.path:
+            return (*submit(request.path), os.stat(request.path).st_size)
+        # compressed bodies are decompressed when their name is given
+        suffix = "".join(Path(request.name).suffixes) if request.name else ""
+        body_fd, body_file = tempfile.mkstemp(suffix=suffix, dir=self.service.tmp_dir)
+        try:
+            with os.fdopen(body_fd, "wb") as body:
+                bytes_read = self._read_body(body)
+            return (*submit(body_file), bytes_read)
+        finally:
+            os.unlink(body_file)
+
+
+class ConversionServer:
+    """
+    Conversion service listening on a Unix socket when address is a path, else on a (host, port) TCP address
+    """
+
+    def __init__(self, address: Union[Path, Tuple[str, int]], jobs: int = 1, max_requests: int = None,
+                 engine: str = "python", root: Path = None):
+        """
+        :param address: Path of the Unix socket or (host, port) to listen on, port 0 picks a free port
+        :param jobs: Number of worker processes converting files
+        :param max_requests: Maximum number of conversions accepted at a time, twice jobs by default
+        :param engine: Conversion engine of the requests which do not name one
+        :param root: Directory holding the files which can be converted by path, paths are refused when None
+        """
+        self.jobs, self.max_requests, self.engine = jobs, max_requests or 2 * jobs, engine
+        self.root = None if root is None else Path(root).resolve()
+        self.start = time.time()
+        self._lock = threading.Lock()
+        self.active = 0
+        self.counters: Dict[str, float] = dict.fromkeys(
+            ("converted", "failed", "rejected", "lines", "bytes_read", "bytes_written", "seconds"), 0)
+        self._tmp = tempfile.TemporaryDirectory(prefix="sols_auto_serve_")
+        self.tmp_dir = self._tmp.name
+        self.executor = ProcessPoolExecutor(max_workers=jobs, initializer=tools.init_worker,
+                                            initargs=(tools.logger.level, True))
+        if isinstance(address, tuple):
+            self.httpd = ThreadingHTTPServer(address, _Handler)
+        else:
+            self.httpd = _UnixHTTPServer(str(address), _Handler)
+        self.httpd.service = self
+
+    @property
+    def address(self) -> Union[str, Tuple[str, int]]:
+        return self.httpd.server_address
+
+    def acquire(self) -> bool:
+        """
+        Take a conversion slot, False when max_requests conversions are running
+        """
+        with self._lock:
+            if self.active >= self.max_requests:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+    def count(self, outcome: str, **counters: float):
+        with self._lock:
+            self.counters[outcome] += 1
+            for key, value in counters.items():
+                self.counters[key] += value
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "status": "ok",
+            "uptime_seconds": time.time() - self.start,
+            "jobs": self.jobs,
+            "max_requests": self.max_requests,
+            "active_requests": self.active,
+            **self.counters,
+        }
+
+    def prometheus(self) -> str:
+        """
+        Counters of the service in Prometheus text exposition format
+        """
+        health = self.health()
+        lines = []
+
+        def metric(name: str, kind: str, description: str, values: Dict[str, float]):
+            lines.extend([f"# HELP sols_auto_serve_{name} {description}", f"# TYPE sols_auto_serve_{name} {kind}"])
+            lines.extend(f"sols_auto_serve_{name}{labels} {value}" for labels, value in values.items())
+
+        metric("uptime_seconds", "gauge", "Seconds since the service started", {"": health["uptime_seconds"]})
+        metric("active_requests", "gauge", "Conversions running or waiting for a worker",
+               {"": health["active_requests"]})
+        metric("requests_total", "counter", "Conversion requests by outcome",
+               {f'{{outcome="{outcome}"}}': health[outcome] for outcome in ("converted", "failed", "rejected")})
+        metric("lines_total", "counter", "Lines converted", {"": health["lines"]})
+        metric("bytes_total", "counter", "Bytes read and written by conversions",
+               {'{direction="read"}': health["bytes_read"], '{direction="written"}': health["bytes_written"]})
+        metric("conversion_seconds_total", "counter", "Seconds spent answering conversions", {"": health["seconds"]})
+        return "\n".join(lines) + "\n"
+
+    def serve(self, stop: threading.Event):
+        """
+        Answer requests until stop is set, then let running conversions finish
+        """
+        thread = threading.Thread(target=self.httpd.serve_forever, name="sols_auto_serve", daemon=True)
+        thread.start()
+        tools.logger.info(f"Serving conversions on {self.address} with {self.jobs} jobs")
+        try:
+            stop.wait()
+        finally:
+            self.httpd.shutdown()
+            thread.join()
+            self.close()
+
+    def close(self):
+        self.httpd.server_close()
+        self.executor.shutdown(wait=True)
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+        self._tmp.cleanup()
+        tools.logger.info(f"Stopped serving, {self.counters['converted']:.0f} conversion(s), "
+                          f"{self.counters['failed']:.0f} failed, {self.counters['rejected']:.0f} rejected")
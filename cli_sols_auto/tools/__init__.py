@@ -1 +1,2 @@
 from .logger_config import logger
+from .workers import init_worker
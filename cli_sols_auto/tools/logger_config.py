@@ -1,12 +1,20 @@
 import logging
 import sys
 
-import colorlog
+FORMAT = "%(asctime)s [%(name)s:%(threadName)s] %(levelname)-8s %(message)s (%(filename)s:%(funcName)s:%(lineno)d)"
 
 logger: logging.Logger = logging.getLogger(__name__)
-formatter: logging.Formatter = colorlog.ColoredFormatter("%(asctime)s [%(bold)s%(name)s%(reset)s:%(threadName)s] "
-                                                         "%(log_color)s%(levelname)-8s%(reset)s %(message)s "
-                                                         "(%(bold)s%(filename)s%(reset)s:%(funcName)s:%(lineno)d)")
-console_handler: logging.Handler = colorlog.StreamHandler(sys.stdout)
+console_handler: logging.Handler = logging.StreamHandler(sys.stdout)
+formatter: logging.Formatter = logging.Formatter(FORMAT)
+# Colors are only useful on a terminal, colorlog is not even imported otherwise
+if sys.stdout.isatty():
+    try:
+        import colorlog
+    except ImportError:  # pragma: no cover
+        pass
+    else:
+        formatter = colorlog.ColoredFormatter("%(asctime)s [%(bold)s%(name)s%(reset)s:%(threadName)s] "
+                                              "%(log_color)s%(levelname)-8s%(reset)s %(message)s "
+                                              "(%(bold)s%(filename)s%(reset)s:%(funcName)s:%(lineno)d)")
 console_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
@@ -0,0 +1,16 @@
+import signal
+
+from .logger_config import logger
+
+
+def init_worker(level: int, ignore_signals: bool = False):
+    """
+    Initialize a worker process of a pool, logging at level like the main process
+
+    :param ignore_signals: ignore SIGTERM and SIGINT, for long-lived pools whose running conversions finish when the
+                           main process is stopped
+    """
+    logger.setLevel(level)
+    if ignore_signals:
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, signal.SIG_IGN)
@@ -0,0 +1,131 @@
+"""
+Control totals of converted files, collected while they are converted and written as a JSON summary next to them.
+
+Totals are read from the old .dat side of the conversion, the converted records of new2old and the source records of
+old2new, by slicing the few fields they need out of fixed-width records. Conversion does not change any value, so
+the totals of the output are the totals of the source and can be reconciled without reading any file again.
+"""
+import json
+from pathlib import Path
+from typing import Any, AnyStr, Dict, Iterable, Iterator, List, Optional
+
+from cli_sols_auto.parser_sols_auto.schema import Kind, SCHEMAS
+from cli_sols_auto.parser_sols_auto.tools import batched, FileType
+
+TOTALS_SUFFIX = ".totals.json"
+
+# quantity summed for every type, traffic files count visitors
+QUANTITIES = {FileType.TRF: "traffic_number", FileType.TRS: "quantity", FileType.VAL: "quantity",
+              FileType.VEN: "quantity"}
+
+
+def _iso_date(value: Optional[int]) -> Optional[str]:
+    return None if value is None else f"{value // 10000:04d}-{value // 100 % 100:02d}-{value % 100:02d}"
+
+
+class ControlTotals:
+    """
+    Row count, total quantity and, for sales, total revenue in cents of records, per store and in total, with the
+    range of their dates. Stores are the sender stores of transfers
+
+    >>> totals = ControlTotals(FileType.VEN)
+    >>> totals.add(["0007782022032336036522366280004132369000010000395001",
+    ...             "0007782022032436036522366280004132369-00010000395001",
+    ...             "0007792022032336036522366280004132370000020000000291"])
+    >>> summary = totals.as_dict()
+    >>> summary["rows"], summary["quantity"], summary["revenue_cents"], summary["first_date"], summary["last_date"]
+    (3, 2, 58, '2022-03-23', '2022-03-24')
+    >>> summary["stores"]["778"]
+    {'rows': 2, 'quantity': 0, 'revenue_cents': 0}
+    """
+
+    def __init__(self, file_type: FileType):
+        schema = SCHEMAS[file_type]
+        offsets = schema.offsets()
+        self.file_type = file_type
+        self._store = offsets[next(field.name for field in schema.fields if field.kind == Kind.STORE)]
+        self._date = offsets[next(field.name for field in schema.fields if field.kind == Kind.DATE)]
+        self._quantity = offsets[QUANTITIES[file_type]]
+        price = next((field.name for field in schema.fields if field.kind == Kind.CENTS), None)
+        self._price = offsets[price] if price else None
+        # rows, quantity and revenue of every store, keyed by the store field as it is in records
+        self._stores: Dict[AnyStr, List[int]] = {}
+        self.first_date: Optional[int] = None
+        self.last_date: Optional[int] = None
+
+    def add(self, records: List[AnyStr]):
+        """
+        Add old .dat records, text or bytes, to the totals
+
+        :raise ValueError: when a field of a record is not a number
+        """
+        if not records:
+            return
+        (store_start, store_end), (quantity_start, quantity_end) = self._store, self._quantity
+        stores = self._stores
+        for record in records:
+            quantity = int(record[quantity_start:quantity_end])
+            store = record[store_start:store_end]
+            totals = stores.get(store)
+            if totals is None:
+                totals = stores[store] = [0, 0, 0]
+            totals[0] += 1
+            totals[1] += quantity
+        if self._price is not None:
+            price_start, price_end = self._price
+            for record in records:
+                stores[record[store_start:store_end]][2] += \
+                    int(record[quantity_start:quantity_end]) * int(record[price_start:price_end])
+        date_start, date_end = self._date
+        # YYYYMMDD dates sort as text
+        dates = {record[date_start:date_end] for record in records}
+        first, last = int(min(dates)), int(max(dates))
+        self.first_date = first if self.first_date is None else min(self.first_date, first)
+        self.last_date = last if self.last_date is None else max(self.last_date, last)
+
+    def batches(self, batches: Iterable[List[AnyStr]]) -> Iterator[List[AnyStr]]:
+        """
+        Add batches of old records to the totals as they are converted
+        """
+        for batch in batches:
+            self.add(batch)
+            yield batch
+
+    def lines(self, lines: Iterable[AnyStr]) -> Iterator[AnyStr]:
+        """
+        Add old records to the totals as they are read, by batches
+        """
+        for batch in batched(lines):
+            self.add(batch)
+            yield from batch
+
+    def as_dict(self) -> Dict[str, Any]:
+        stores: Dict[int, List[int]] = {}
+        for store, (rows, quantity, revenue) in self._stores.items():
+            totals = stores.setdefault(int(store), [0, 0, 0])
+            totals[0], totals[1], totals[2] = totals[0] + rows, totals[1] + quantity, totals[2] + revenue
+
+        def summary(rows: int, quantity: int, revenue: int) -> Dict[str, int]:
+            values = {"rows": rows, "quantity": quantity}
+            if self._price is not None:
+                values["revenue_cents"] = revenue
+            return values
+
+        return {
+            "parse_type": self.file_type.value,
+            **summary(*(sum(values) for values in zip([0, 0, 0], *stores.values()))),
+            "first_date": _iso_date(self.first_date),
+            "last_date": _iso_date(self.last_date),
+            "stores": {str(store): summary(*stores[store]) for store in sorted(stores)},
+        }
+
+    def write(self, file: Path, output: Path) -> Path:
+        """
+        Write the totals of the conversion of file into output next to output
+
+        :return: the JSON summary, named after output with TOTALS_SUFFIX
+        """
+        path = output.with_name(f"{output.name}{TOTALS_SUFFIX}")
+        path.write_text(json.dumps({"file": str(file), "output": output.name, **self.as_dict()}, indent=1),
+                        encoding="utf-8")
+        return path
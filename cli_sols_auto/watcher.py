@@ -0,0 +1,157 @@
+"""
+Watch input directories and convert files as soon as they are complete, in a long-lived pool of worker processes.
+
+Directories are polled every interval seconds. A file is complete once its marker file exists when a marker suffix is
+given, or else once its size and modification time have not changed for settle seconds.
+"""
+import shutil
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import cli_sols_auto.tools as tools
+
+
+class Watcher:
+    """
+    Poll input directories and submit complete files to convert, with at most jobs conversions running at a time.
+
+    Converted files are moved to processed_dir when provided, otherwise they are remembered with their size and
+    modification time and only converted again if they change. Files which failed to convert are only retried once
+    they change as well.
+    """
+
+    def __init__(self, input_dirs: Iterable[Path], convert: Callable[[Path], None], jobs: int = 1,
+                 interval: float = 2.0, settle: float = 5.0, marker: str = None, pattern: str = "*",
+                 processed_dir: Path = None):
+        """
+        :param input_dirs: Directories to watch
+        :param convert: picklable function converting a file, called in worker processes
+        :param jobs: Maximum number of conversions running at a time
+        :param interval: Seconds between two scans of the input directories
+        :param settle: Seconds the size and modification time of a file must be stable for it to be complete
+        :param marker: Suffix of the marker files written once files are complete (e.g. '.ok' for Sales.csv.ok)
+        :param pattern: Glob pattern of the file names to convert
+        :param processed_dir: Directory where to move the files once converted
+        """
+        self.input_dirs = list(input_dirs)
+        self.convert, self.jobs, self.interval, self.settle = convert, jobs, interval, settle
+        self.marker, self.pattern, self.processed_dir = marker, pattern, processed_dir
+        self.converted = self.failed = 0
+        self._stable: Dict[Path, Tuple[int, int, float]] = {}
+        self._handled: Dict[Path, Tuple[int, int]] = {}
+        self._running: Dict[Future, Tuple[Path, Tuple[int, int]]] = {}
+
+    def _candidates(self) -> Iterable[Path]:
+        for input_dir in self.input_dirs:
+            for file in input_dir.glob(self.pattern):
+                if self.marker and file.name.endswith(self.marker):
+                    continue
+                yield file
+
+    def scan(self, now: float = None) -> List[Path]:
+        """
+        Files of the input directories which are complete and neither converted nor being converted
+
+        :param now: time of the scan, defaults to time.monotonic()
+        """
+        now = time.monotonic() if now is None else now
+        running = {file for file, _ in self._running.values()}
+        ready, present = [], set()
+        for file in self._candidates():
+            try:
+                stat = file.stat()
+            except OSError:
+                continue
+            if not file.is_file() or file in running:
+                continue
+            present.add(file)
+            state = (stat.st_size, stat.st_mtime_ns)
+            if self._handled.get(file) == state:
+                continue
+            if self.marker:
+                if file.with_name(file.name + self.marker).exists():
+                    ready.append(file)
+                continue
+            size, mtime, since = self._stable.get(file, (None, None, now))
+            if (size, mtime) != state:
+                self._stable[file] = (*state, now)
+            elif now - since >= self.settle:
+                ready.append(file)
+        # forget files which disappeared
+        for states in (self._stable, self._handled):
+            for file in set(states) - present - running:
+                del states[file]
+        return ready
+
+    def _finished(self, future: Future):
+        file, state = self._running.pop(future)
+        self._stable.pop(file, None)
+        try:
+            future.result()
+        except Exception as e:
+            self.failed += 1
+            self._handled[file] = state
+            tools.logger.error(f"Conversion of {file} failed : {e!r}")
+            return
+        self.converted += 1
+        if self.processed_dir is None:
+            self._handled[file] = state
+            return
+        try:
+            shutil.move(str(file), str(self.processed_dir / file.name))
+            marker = file.with_name(f"{file.name}{self.marker}")
+            if self.marker and marker.exists():
+                shutil.move(str(marker), str(self.processed_dir / marker.name))
+        except OSError as e:
+            # a file left in place is only converted again once it changes
+            self._handled[file] = state
+            tools.logger.error(f"{file} converted but it can not be moved to {self.processed_dir} : {e!r}")
+            return
+        tools.logger.debug(f"{file} moved to {self.processed_dir}")
+
+    def run(self, stop: threading.Event):
+        """
+        Convert files as they are complete until stop is set, then wait for the running conversions to finish
+        """
+        tools.logger.info(f"Watching {', '.join(map(str, self.input_dirs))} with {self.jobs} jobs")
+        # Stopping the watcher lets running conversions finish, workers are stopped with it
+        with ProcessPoolExecutor(max_workers=self.jobs, initializer=tools.init_worker,
+                                 initargs=(tools.logger.level, True)) as executor:
+            while not stop.is_set():
+                for file in self.scan()[:self.jobs - len(self._running)]:
+                    tools.logger.debug(f"{file} is complete, submitting it")
+                    try:
+                        stat = file.stat()
+                    except OSError as e:
+                        # the file was removed or made unreadable since the scan
+                        tools.logger.warning(f"{file} can not be read, skipping it : {e!r}")
+                        continue
+                    self._running[executor.submit(self.convert, file)] = (file, (stat.st_size, stat.st_mtime_ns))
+                if self._running:
+                    done, _ = wait(self._running, timeout=self.interval, return_when=FIRST_COMPLETED)
+                else:
+                    done = ()
+                    stop.wait(self.interval)
+                for future in done:
+                    self._finished(future)
+            if self._running:
+                tools.logger.info(f"Waiting for {len(self._running)} running conversion(s) to finish")
+            for future in wait(list(self._running)).done:
+                self._finished(future)
+        tools.logger.info(f"Stopped watching, {self.converted} file(s) converted, {self.failed} failed")
+
+
+def stop_on_signals(stop: threading.Event, signals: Tuple[int, ...] = (signal.SIGTERM, signal.SIGINT)):
+    """
+    Set stop when one of signals is received, must be called from the main thread
+    """
+    def handler(signum, frame):
+        tools.logger.info(f"Received {signal.Signals(signum).name}, stopping")
+        stop.set()
+
+    for signum in signals:
+        signal.signal(signum, handler)
@@ -1,7 +1,19 @@
+import functools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
 import pytest
 from click import BadParameter, ClickException
 
+from cli_sols_auto import app
 from cli_sols_auto.app import cli
+from cli_sols_auto.parser_sols_auto.tools import ENGINES, FileType
+from cli_sols_auto.watcher import Watcher
 
 
 def test_help(cli_runner):
@@ -117,3 +129,727 @@ def test_new2old_dir_empty(cli_runner, tmpdir_factory):
             ], catch_exceptions=False
         )
         assert result.exit_code == 2
+
+
+def test_new2old_jobs(cli_runner, tmp_new_dir, new_trf_file, new_trf_file_light, tmpdir_factory):
+    outdir = tmpdir_factory.mktemp('out')
+    result = cli_runner.invoke(
+        cli,
+        [
+            "new2old",
+            f'--output_dir={outdir}',
+            "--parse_type=TRF",
+            "--jobs=2",
+            f"{tmp_new_dir}/Traffic*.csv",
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert len(outdir.listdir()) == 2
+
+
+def test_new2old_jobs_failure(cli_runner, tmpdir_factory):
+    indir = tmpdir_factory.mktemp('in')
+    indir.join("Traffic_20220101.csv").write_text("JAC-778;2022-03-26;8", encoding="utf-8")
+    indir.join("Traffic_20220102.csv").write_text("JAC-778;2022-03-26", encoding="utf-8")
+    outdir = tmpdir_factory.mktemp('out')
+    result = cli_runner.invoke(
+        cli,
+        [
+            "new2old",
+            f'--output_dir={outdir}',
+            "--parse_type=TRF",
+            "--jobs=2",
+            str(indir),
+        ],
+    )
+
+    assert result.exit_code == 1
+    assert "1 out of 2 file(s) failed to convert" in result.output
+    assert len(outdir.listdir()) == 1
+
+
+def test_handle_name_collision(monkeypatch, new_trf_file, tmpdir_factory):
+    outdir = tmpdir_factory.mktemp('out')
+    names = iter(["Trf_20220101_1.dat", "Trf_20220101_1.dat", "Trf_20220101_2.dat"])
+    monkeypatch.setattr(app, "output_file_name_old", lambda file_name, parse_type: next(names))
+    app.handle(Path(outdir), Path(new_trf_file), FileType.TRF)
+    app.handle(Path(outdir), Path(new_trf_file), FileType.TRF)
+
+    assert sorted(file.basename for file in outdir.listdir()) == ["Trf_20220101_1.dat", "Trf_20220101_2.dat"]
+
+
+def test_watch_scan(tmpdir_factory):
+    indir = tmpdir_factory.mktemp('in')
+    indir.join("Traffic_20220101.csv").write_text("JAC-778;2022-03-26;8", encoding="utf-8")
+    watcher = Watcher([Path(indir)], print, settle=5)
+    assert watcher.scan(now=0) == []
+    assert watcher.scan(now=4) == []
+    assert watcher.scan(now=5) == [Path(indir) / "Traffic_20220101.csv"]
+    indir.join("Traffic_20220101.csv").write_text("JAC-778;2022-03-26;8\nJAC-778;2022-03-27;9", encoding="utf-8")
+    assert watcher.scan(now=6) == []
+    assert watcher.scan(now=11) == [Path(indir) / "Traffic_20220101.csv"]
+
+    watcher = Watcher([Path(indir)], print, marker=".ok")
+    assert watcher.scan() == []
+    indir.join("Traffic_20220101.csv.ok").write_text("", encoding="utf-8")
+    assert watcher.scan() == [Path(indir) / "Traffic_20220101.csv"]
+
+
+def test_watch_run(tmpdir_factory):
+    indir, outdir, done = (tmpdir_factory.mktemp(name) for name in ('in', 'out', 'done'))
+    convert = functools.partial(app.handle, Path(outdir), parse_type=FileType.TRF)
+    watcher = Watcher([Path(indir)], convert, jobs=2, interval=0.05, settle=0, processed_dir=Path(done))
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop,))
+    thread.start()
+    try:
+        indir.join("Traffic_20220101.csv").write_text("JAC-778;2022-03-26;8", encoding="utf-8")
+        indir.join("Traffic_20220102.csv").write_text("JAC-778;2022-03-26", encoding="utf-8")
+        deadline = time.monotonic() + 30
+        while watcher.converted + watcher.failed < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert (watcher.converted, watcher.failed) == (1, 1)
+    assert [file.basename for file in done.listdir()] == ["Traffic_20220101.csv"]
+    assert [file.basename for file in indir.listdir()] == ["Traffic_20220102.csv"]
+    assert [file.read_text(encoding="utf-8") for file in outdir.listdir()] == ["000778202203260008"]
+
+
+def test_watch_run_os_errors(tmpdir_factory, caplog):
+    indir, outdir, done = (tmpdir_factory.mktemp(name) for name in ('in', 'out', 'done'))
+    convert = functools.partial(app.handle, Path(outdir), parse_type=FileType.TRF)
+    watcher = Watcher([Path(indir)], convert, jobs=2, interval=0.05, settle=0, processed_dir=Path(done) / "missing")
+    scan = watcher.scan
+    # a file removed between the scan and its submission is skipped
+    watcher.scan = lambda: [Path(indir) / "Traffic_20220100.csv"] + scan()
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop,))
+    thread.start()
+    try:
+        indir.join("Traffic_20220101.csv").write_text("JAC-778;2022-03-26;8", encoding="utf-8")
+        deadline = time.monotonic() + 30
+        while watcher.converted < 1 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        # the watcher goes on once the output can not be moved, without converting the file again
+        time.sleep(0.2)
+        assert thread.is_alive()
+    finally:
+        stop.set()
+        thread.join()
+
+    assert (watcher.converted, watcher.failed) == (1, 0)
+    assert [file.basename for file in indir.listdir()] == ["Traffic_20220101.csv"]
+    assert "Traffic_20220100.csv can not be read, skipping it" in caplog.text
+    assert "converted but it can not be moved" in caplog.text
+
+
+def test_watch_brand_code_required(cli_runner, tmpdir_factory):
+    indir = tmpdir_factory.mktemp('in')
+    result = cli_runner.invoke(cli, ["watch", f"--output_dir={indir}", "--parse_type=TRF", "--direction=old2new",
+                                     str(indir)])
+
+    assert result.exit_code == 2
+    assert "--brand_code is required" in result.output
+
+
+def test_new2old_manifest(cli_runner, tmpdir_factory):
+    indir = tmpdir_factory.mktemp('in')
+    indir.join("Traffic_20220101.csv").write_text("JAC-778;2022-03-26;8", encoding="utf-8")
+    indir.join("Traffic_20220102.csv").write_text("JAC-778;2022-03-27;9", encoding="utf-8")
+    outdir = tmpdir_factory.mktemp('out')
+    arguments = ["new2old", f'--output_dir={outdir}', "--parse_type=TRF", "--manifest", str(indir)]
+
+    assert cli_runner.invoke(cli, arguments).exit_code == 0
+    assert len(outdir.listdir()) == 3
+    assert cli_runner.invoke(cli, arguments).exit_code == 0
+    assert len(outdir.listdir()) == 3
+
+    # touched but unchanged files are not converted again, modified ones are
+    indir.join("Traffic_20220101.csv").write_text("JAC-778;2022-03-26;8", encoding="utf-8")
+    indir.join("Traffic_20220102.csv").write_text("JAC-778;2022-03-27;10", encoding="utf-8")
+    assert cli_runner.invoke(cli, arguments).exit_code == 0
+    assert len(outdir.listdir()) == 4
+    assert cli_runner.invoke(cli, arguments + ["--jobs=2"]).exit_code == 0
+    assert len(outdir.listdir()) == 4
+
+
+def test_new2old_manifest_saved(cli_runner, tmpdir_factory, monkeypatch):
+    from cli_sols_auto.manifest import MANIFEST_NAME
+
+    indir = tmpdir_factory.mktemp('in')
+    for day in (1, 2):
+        indir.join(f"Traffic_2022010{day}.csv").write_text(f"JAC-778;2022-03-2{day};8", encoding="utf-8")
+    outdir = tmpdir_factory.mktemp('out')
+    handle = app._handle
+    saved = []
+
+    def modify(outdir, file, *args, **kwargs):
+        # manifest on disk when the next file starts, as a run killed then would leave it
+        manifest = outdir / MANIFEST_NAME
+        saved.append(len(json.loads(manifest.read_text(encoding="utf-8"))["files"]) if manifest.exists() else 0)
+        result = handle(outdir, file, *args, **kwargs)
+        # modified while it was converted
+        stat = file.stat()
+        file.write_text("JAC-778;2022-03-28;9", encoding="utf-8")
+        os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        return result
+
+    monkeypatch.setattr(app, "_handle", modify)
+    arguments = ["new2old", f'--output_dir={outdir}', "--parse_type=TRF", "--manifest", "--jobs=1", str(indir)]
+    assert cli_runner.invoke(cli, arguments).exit_code == 0
+    assert saved == [0, 1]
+    monkeypatch.setattr(app, "_handle", handle)
+    assert cli_runner.invoke(cli, arguments).exit_code == 0
+    assert len(outdir.listdir("Trf_*")) == 4
+
+
+@pytest.mark.parametrize("engine", ["python", "bytes"])
+def test_totals(cli_runner, tmpdir_factory, engine):
+    indir = tmpdir_factory.mktemp('in')
+    indir.join("Sales_20220101.csv").write_text("JAC-778;2022-03-23;;4132369;3603652236628;2;395.00;1\n"
+                                               "JAC-779;2022-03-21;;4132370;3603652236629;-1;0.29;1\n"
+                                               "JAC-778;2022-03-24;;4132371;3603652236630;1;1,50;2", encoding="utf-8")
+    outdir = tmpdir_factory.mktemp('out')
+    result = cli_runner.invoke(cli, ["new2old", f'--output_dir={outdir}', "--parse_type=VEN", "--totals",
+                                     f"--engine={engine}", str(indir)])
+    assert result.exit_code == 0
+    output, = [file for file in outdir.listdir() if not file.basename.endswith(".totals.json")]
+    summary = json.loads(outdir.join(f"{output.basename}.totals.json").read_text(encoding="utf-8"))
+    assert summary["output"] == output.basename
+    assert (summary["rows"], summary["quantity"], summary["revenue_cents"]) == (3, 2, 79121)
+    assert (summary["first_date"], summary["last_date"]) == ("2022-03-21", "2022-03-24")
+    assert summary["stores"] == {"778": {"rows": 2, "quantity": 3, "revenue_cents": 79150},
+                                 "779": {"rows": 1, "quantity": -1, "revenue_cents": -29}}
+
+    # the totals of the source of old2new are the same
+    converted = tmpdir_factory.mktemp('converted')
+    result = cli_runner.invoke(cli, ["old2new", f'--output_dir={converted}', "--parse_type=VEN", "--totals",
+                                     f"--engine={engine}", str(output), "JAC"])
+    assert result.exit_code == 0
+    totals, = converted.listdir("*.totals.json")
+    assert {**json.loads(totals.read_text(encoding="utf-8")), "file": None, "output": None} == \
+        {**summary, "file": None, "output": None}
+
+    result = cli_runner.invoke(cli, ["new2old", f'--output_dir={outdir}', "--parse_type=VEN", "--totals", "--archive",
+                                     str(indir)])
+    assert result.exit_code == 2
+    assert "--totals can not be used with --archive" in result.output
+
+
+def test_new2old_reject(cli_runner, tmpdir_factory, caplog):
+    indir = tmpdir_factory.mktemp('in')
+    indir.join("Traffic_20220101.csv").write_text("JAC-778;2022-03-26;8\nJAC-778;2022-03-27\nJAC-778;2022-03-28;9",
+                                                 encoding="utf-8")
+    outdir = tmpdir_factory.mktemp('out')
+    arguments = ["new2old", f'--output_dir={outdir}', "--parse_type=TRF", "--on_error=reject", str(indir)]
+
+    result = cli_runner.invoke(cli, arguments + ["--max_error_rate=0.5"])
+    assert result.exit_code == 0
+    rejects, = outdir.listdir("*.rejects")
+    output = outdir.join(rejects.basename[:-len(".rejects")])
+    assert output.read_binary() == b"000778202203260008\n000778202203280009"
+    number, reason, line = rejects.read_text(encoding="utf-8").rstrip("\n").split("\t")
+    assert (number, line) == ("2", "JAC-778;2022-03-27") and reason.startswith("ValueError: Incorrect input data")
+    assert "1 out of 3 lines rejected" in caplog.text
+
+    # too many rejected lines fail the file, nothing is left behind
+    failed = tmpdir_factory.mktemp('failed')
+    result = cli_runner.invoke(cli, ["new2old", f'--output_dir={failed}', "--parse_type=TRF", "--on_error=reject",
+                                     "--max_error_rate=0.1", str(indir)])
+    assert result.exit_code == 1
+    assert "more than the maximum error rate of 10.00%" in caplog.text
+    assert failed.listdir() == []
+
+    # a sales line without pos_id is rejected by every engine
+    sales = tmpdir_factory.mktemp('sales')
+    sales.join("Sales_20220101.csv").write_text("JAC-778;2022-03-23;;4132369;3603652236628;1;395.00;\n"
+                                                "JAC-778;2022-03-23;;4132369;3603652236628;1;395.00;1\n",
+                                                encoding="utf-8")
+    for engine in ENGINES:
+        outdir = tmpdir_factory.mktemp('out')
+        result = cli_runner.invoke(cli, ["new2old", f'--output_dir={outdir}', "--parse_type=VEN", "--on_error=reject",
+                                         "--max_error_rate=1", f"--engine={engine}", str(sales)])
+        assert result.exit_code == 0
+        rejects, = outdir.listdir("*.rejects")
+        assert rejects.read_text(encoding="utf-8").startswith("1\tValueError: Incorrect input data")
+        assert outdir.join(rejects.basename[:-len(".rejects")]).read_binary() == \
+            b"0007782022032336036522366280004132369000010000395001"
+
+
+@pytest.mark.parametrize("engine, reason", [
+    ("python", "UnicodeDecodeError"),
+    ("bytes", "ValueError: Line is not ASCII"),
+])
+def test_new2old_reject_encoding(cli_runner, tmpdir_factory, engine, reason):
+    indir = tmpdir_factory.mktemp('in')
+    indir.join("Traffic_20220101.csv").write_binary(b"JAC-778;2022-03-26;8\r\nJAC-77\xff;2022-03-27;4\r\n"
+                                                    b"JAC-778;2022-03-28;9\r\n")
+    outdir = tmpdir_factory.mktemp('out')
+    result = cli_runner.invoke(cli, ["new2old", f'--output_dir={outdir}', "--parse_type=TRF", "--on_error=reject",
+                                     "--max_error_rate=0.5", f"--engine={engine}", str(indir)])
+    assert result.exit_code == 0
+    rejects, = outdir.listdir("*.rejects")
+    assert outdir.join(rejects.basename[:-len(".rejects")]).read_binary() == b"000778202203260008\n000778202203280009"
+    number, error, line = rejects.read_binary().rstrip(b"\n").split(b"\t")
+    assert (number, line) == (b"2", b"JAC-77\xff;2022-03-27;4") and error.decode().startswith(reason)
+
+
+def test_old2new_reject_totals(cli_runner, tmpdir_factory):
+    indir = tmpdir_factory.mktemp('in')
+    indir.join("Trf_20220101.dat").write_text("000778202203260008\n00077820220327\n000778202203280009",
+                                              encoding="utf-8")
+    outdir = tmpdir_factory.mktemp('out')
+    result = cli_runner.invoke(cli, ["old2new", f'--output_dir={outdir}', "--parse_type=TRF", "--on_error=reject",
+                                     "--max_error_rate=0.5", "--totals", str(indir), "JAC"])
+    assert result.exit_code == 0
+    totals, = outdir.listdir("*.totals.json")
+    summary = json.loads(totals.read_text(encoding="utf-8"))
+    # rejected lines are left out of the totals
+    assert (summary["rows"], summary["quantity"]) == (2, 17)
+    assert outdir.listdir("*.rejects")[0].read_text(encoding="utf-8").startswith("2\t")
+
+
+@pytest.mark.parametrize("compress", [None, "gz"])
+def test_new2old_follow(cli_runner, tmpdir_factory, compress):
+    import gzip
+
+    indir = tmpdir_factory.mktemp('in')
+    source = indir.join("Traffic_20220101.csv")
+    source.write_text("JAC-778;2022-03-26;8\nJAC-778;2022-03-27;9\nJAC-778;2022-", encoding="utf-8")
+    outdir = tmpdir_factory.mktemp('out')
+    arguments = ["new2old", f'--output_dir={outdir}', "--parse_type=TRF", "--follow", str(source)]
+    if compress:
+        arguments.append(f"--compress={compress}")
+
+    def outputs():
+        return {output.basename: gzip.decompress(output.read_binary()) if compress else output.read_binary()
+                for output in outdir.listdir("Trf_*")}
+
+    # the last line is not terminated yet
+    assert cli_runner.invoke(cli, arguments).exit_code == 0
+    first = outputs()
+    assert list(first.values()) == [b"000778202203260008\n000778202203270009"]
+    assert cli_runner.invoke(cli, arguments).exit_code == 0
+    assert outputs() == first
+
+    # appended lines are converted and appended to the same output
+    with open(source, "a", encoding="utf-8") as stream:
+        stream.write("03-28;10\nJAC-778;2022-03-29;11\n")
+    assert cli_runner.invoke(cli, arguments).exit_code == 0
+    assert outputs() == {name: b"000778202203260008\n000778202203270009\n000778202203280010\n000778202203290011"
+                         for name in first}
+
+    # a rewritten file is converted again into a new output
+    source.write_text("JAC-779;2022-03-26;1\n", encoding="utf-8")
+    assert cli_runner.invoke(cli, arguments).exit_code == 0
+    rewritten = outputs()
+    assert len(rewritten) == 2
+    assert [rewritten[name] for name in rewritten if name not in first] == [b"000779202203260001"]
+
+    result = cli_runner.invoke(cli, arguments + ["--manifest"])
+    assert result.exit_code == 2
+    assert "--manifest can not be used with --follow" in result.output
+
+
+def test_new2old_follow_saved(cli_runner, tmpdir_factory, monkeypatch):
+    from cli_sols_auto.follow import FOLLOW_NAME
+
+    indir = tmpdir_factory.mktemp('in')
+    for day in (1, 2):
+        indir.join(f"Traffic_2022010{day}.csv").write_text(f"JAC-778;2022-03-2{day};8\n", encoding="utf-8")
+    outdir = tmpdir_factory.mktemp('out')
+    handle = app._handle
+    saved = []
+
+    def record_state(outdir, file, *args, **kwargs):
+        # state on disk when the next file starts, as a run killed then would leave it
+        state = outdir / FOLLOW_NAME
+        saved.append(len(json.loads(state.read_text(encoding="utf-8"))["files"]) if state.exists() else 0)
+        return handle(outdir, file, *args, **kwargs)
+
+    monkeypatch.setattr(app, "_handle", record_state)
+    result = cli_runner.invoke(cli, ["new2old", f'--output_dir={outdir}', "--parse_type=TRF", "--follow", "--jobs=1",
+                                     str(indir)])
+    assert result.exit_code == 0
+    assert saved == [0, 1]
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_new2old_metrics(cli_runner, tmp_new_dir, new_trf_file, new_trf_file_light, tmpdir_factory, jobs):
+    outdir = tmpdir_factory.mktemp('out')
+    metrics = outdir.join("metrics.jsonl")
+    result = cli_runner.invoke(cli, ["new2old", f'--output_dir={outdir}', "--parse_type=TRF", f"--jobs={jobs}",
+                                     f"--metrics={metrics}", f"{tmp_new_dir}/Traffic*.csv"])
+
+    assert result.exit_code == 0
+    *files, run = [json.loads(line) for line in metrics.read_text(encoding="utf-8").splitlines()]
+    assert [file["lines"] for file in files] == [4, 4]
+    assert all(file["bytes_written"] == 4 * 18 + 3 for file in files)
+    assert run["type"] == "run" and run["files"] == 2 and run["lines"] == 8 and run["failures"] == 0
+
+
+def test_old2new_metrics_prometheus(cli_runner, old_trf_file, tmpdir_factory):
+    outdir = tmpdir_factory.mktemp('out')
+    metrics = outdir.join("sols_auto.prom")
+    result = cli_runner.invoke(cli, ["old2new", f'--output_dir={outdir}', "--parse_type=TRF", f"--metrics={metrics}",
+                                     str(old_trf_file), "JAC"])
+
+    assert result.exit_code == 0
+    text = metrics.read_text(encoding="utf-8")
+    assert "sols_auto_last_run_lines 4\n" in text
+    assert 'sols_auto_last_run_stage_seconds{stage="parse"}' in text
+
+
+def test_new2old_profile(cli_runner, new_ven_file, tmpdir_factory):
+    outdir = tmpdir_factory.mktemp('out')
+    stats = outdir.join("run.pstats")
+    result = cli_runner.invoke(cli, [f"--profile={stats}", "--trace_memory", "new2old", f'--output_dir={outdir}',
+                                     "--parse_type=VEN", str(new_ven_file)])
+
+    assert result.exit_code == 0
+    assert stats.size() > 0
+    assert "function calls" in result.output
+    assert f"Peak traced memory converting {new_ven_file}" in result.output
+    assert "Top allocation sites" in result.output
+
+
+def test_new2old_profile_workers(cli_runner, new_ven_file, tmpdir_factory, caplog):
+    outdir = tmpdir_factory.mktemp('out')
+    stats = outdir.join("run.pstats")
+    result = cli_runner.invoke(cli, [f"--profile={stats}", "new2old", f'--output_dir={outdir}', "--parse_type=VEN",
+                                     "--jobs=2", "--chunk_size=64", str(new_ven_file)])
+
+    assert result.exit_code == 0
+    assert "Conversions in worker processes are not profiled, use --jobs=1" in caplog.text
+
+
+def test_lazy_imports(new_trf_file, tmpdir_factory):
+    outdir = tmpdir_factory.mktemp('out')
+    script = f"""
+import sys
+from cli_sols_auto.app import cli
+imported = set(sys.modules)
+cli(["new2old", "--output_dir={outdir}", "--parse_type=TRF", "--jobs=1", "{new_trf_file}"], standalone_mode=False)
+print(" ".join(sorted(imported)))
+print(" ".join(sorted(sys.modules)))
+"""
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                            cwd=Path(__file__).parents[1])
+    startup, converted = (set(line.split()) for line in result.stdout.splitlines()[-2:])
+
+    for module in ("cli_sols_auto.parser_sols_auto.new", "cli_sols_auto.parser_sols_auto.old", "colorlog",
+                   "concurrent.futures.process", "cli_sols_auto.watcher", "cli_sols_auto.manifest", "cProfile"):
+        assert module not in startup
+    assert "cli_sols_auto.parser_sols_auto.new" in converted
+    assert "cli_sols_auto.parser_sols_auto.old" not in converted
+
+
+@pytest.mark.parametrize("compress", ["gz", "bz2", "xz"])
+def test_new2old_compressed(cli_runner, tmpdir_factory, compress):
+    module = {"gz": "gzip", "bz2": "bz2", "xz": "lzma"}[compress]
+    open_compressed = __import__(module).open
+    indir = tmpdir_factory.mktemp('in')
+    with open_compressed(str(indir.join(f"Traffic_20220101.csv.{compress}")), "wt", encoding="utf-8") as file:
+        file.write("JAC-778;2022-03-26;8\nJAC-778;2022-03-27;82")
+    outdir = tmpdir_factory.mktemp('out')
+    result = cli_runner.invoke(cli, ["new2old", f'--output_dir={outdir}', "--parse_type=TRF", f"--compress={compress}",
+                                     f"{indir}/Traffic_*.csv"])
+
+    assert result.exit_code == 0
+    output, = outdir.listdir()
+    assert output.basename.startswith("Trf_20220101_") and output.basename.endswith(f".dat.{compress}")
+    with open_compressed(str(output), "rt", encoding="utf-8") as file:
+        assert file.read() == "000778202203260008\n000778202203270082"
+
+
+@pytest.mark.parametrize("suffix", [".zip", ".tar.gz"])
+def test_new2old_archive(cli_runner, tmpdir_factory, suffix):
+    import io
+    import tarfile
+    import zipfile
+
+    members = {"store1/Traffic_20220101_1.csv": b"JAC-778;2022-03-26;8\nJAC-778;2022-03-27;82",
+               "store2/Traffic_20220101_2.csv": b"JAC-779;2022-03-26;9"}
+    indir = tmpdir_factory.mktemp('in')
+    archive = Path(indir) / f"stores_20220101{suffix}"
+    if suffix == ".zip":
+        with zipfile.ZipFile(archive, "w") as target:
+            for name, content in members.items():
+                target.writestr(name, content)
+    else:
+        with tarfile.open(archive, "w:gz") as target:
+            for name, content in members.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                target.addfile(info, io.BytesIO(content))
+    outdir = tmpdir_factory.mktemp('out')
+    result = cli_runner.invoke(cli, ["new2old", f'--output_dir={outdir}', "--parse_type=TRF", "--jobs=1", "--archive",
+                                     str(archive)])
+
+    assert result.exit_code == 0
+    output, = outdir.listdir()
+    assert output.basename.startswith("stores_20220101_") and output.basename.endswith(suffix)
+    if suffix == ".zip":
+        with zipfile.ZipFile(str(output)) as source:
+            converted = {name: source.read(name) for name in source.namelist()}
+    else:
+        with tarfile.open(str(output)) as source:
+            converted = {info.name: source.extractfile(info).read() for info in source}
+    first, second = sorted(converted)
+    assert first.startswith("store1/Trf_20220101_1_") and second.startswith("store2/Trf_20220101_2_")
+    assert converted[first] == b"000778202203260008\n000778202203270082"
+    assert converted[second] == b"000779202203260009"
+
+
+def test_new2old_archive_failure(cli_runner, tmpdir_factory):
+    import zipfile
+
+    indir = tmpdir_factory.mktemp('in')
+    with zipfile.ZipFile(Path(indir) / "stores.zip", "w") as target:
+        target.writestr("Traffic_20220101_1.csv", "JAC-778;2022-03-26;8")
+        target.writestr("Traffic_20220101_2.csv", "JAC-778;2022-03-26")
+    outdir = tmpdir_factory.mktemp('out')
+    result = cli_runner.invoke(cli, ["new2old", f'--output_dir={outdir}', "--parse_type=TRF", "--archive",
+                                     f"{indir}/stores.zip"])
+
+    assert result.exit_code != 0
+    assert "1 out of 1 file(s) failed to convert" in result.output
+    assert not outdir.listdir()
+
+
+def test_new2old_archive_reject(cli_runner, tmpdir_factory, caplog):
+    import zipfile
+
+    indir = tmpdir_factory.mktemp('in')
+    with zipfile.ZipFile(Path(indir) / "stores.zip", "w") as target:
+        target.writestr("Traffic_20220101_1.csv", "JAC-778;2022-03-26;8\nJAC-778;2022-03-26")
+        target.writestr("Traffic_20220101_2.csv", "JAC-779;2022-03-26;9")
+    outdir = tmpdir_factory.mktemp('out')
+    result = cli_runner.invoke(cli, ["new2old", f'--output_dir={outdir}', "--parse_type=TRF", "--archive",
+                                     "--on_error=reject", "--max_error_rate=0.5", f"{indir}/stores.zip"])
+
+    assert result.exit_code == 0
+    output, = outdir.listdir()
+    with zipfile.ZipFile(str(output)) as source:
+        converted = {name: source.read(name) for name in source.namelist()}
+    first, first_rejects, second = sorted(converted)
+    assert first_rejects == f"{first}.rejects" and first.startswith("Trf_20220101_1_")
+    assert converted[first] == b"000778202203260008"
+    assert converted[first_rejects].startswith(b"2\t")
+    assert converted[first_rejects].endswith(b"\tJAC-778;2022-03-26\n")
+    assert converted[second] == b"000779202203260009"
+    assert f"1 out of 2 lines rejected to {first_rejects} of {output}" in caplog.text
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_new2old_in_place(cli_runner, tmpdir_factory, jobs):
+    indir = tmpdir_factory.mktemp('in')
+    # outputs written while the directory is still read must not be converted in turn
+    for index in range(1000):
+        indir.join(f"Traffic_{index:04d}.csv").write_text("JAC-778;2022-03-26;8", encoding="utf-8")
+    result = cli_runner.invoke(cli, ["new2old", "--parse_type=TRF", f"--jobs={jobs}", str(indir)])
+
+    assert result.exit_code == 0
+    outputs = [file for file in indir.listdir() if file.ext == ".dat"]
+    assert len(outputs) == 1000
+    assert {file.read_text(encoding="utf-8") for file in outputs} == {"000778202203260008"}
+
+
+def test_new2old_auto(cli_runner, tmpdir_factory):
+    indir = tmpdir_factory.mktemp('in')
+    indir.join("Traffic_20220101.csv").write_text("JAC-778;2022-03-26;8", encoding="utf-8")
+    indir.join("Sales_20220101.csv").write_text("JAC-778;2022-03-23;14-14-25;4132371;3603652296639;1;395.00;3",
+                                                encoding="utf-8")
+    indir.join("export_20220101.csv").write_text("JAC-779;2022-03-27;82", encoding="utf-8")
+    # transfers, validations with a reception time and traffic with receipts all have 6 fields
+    indir.join("export_20220102.csv").write_text("2021-11-01;;OKA-1210;OKA-1889;3604277211410;5", encoding="utf-8")
+    indir.join("export_20220103.csv").write_text("JAC-778;00000999993057074313;3603652347409;1;2021-04-19;10-12-00",
+                                                 encoding="utf-8")
+    indir.join("export_20220104.csv").write_text("JAC-779;2022-03-27;82;12;1;14", encoding="utf-8")
+    outdir = tmpdir_factory.mktemp('out')
+    result = cli_runner.invoke(cli, ["new2old", f'--output_dir={outdir}', "--parse_type=auto", "--jobs=2", str(indir)])
+
+    assert result.exit_code == 0
+    outputs = {output.basename.rsplit("_", 1)[0]: output.read_text(encoding="utf-8") for output in outdir.listdir()}
+    assert outputs == {"Trf_20220101": "000778202203260008",
+                       "Ven_20220101": "0007782022032336036522966390004132371000010000395003",
+                       "Trf_export_20220101": "000779202203270082",
+                       "Trs_export_20220102": "2021110100121000188936042772114100005",
+                       "Val_export_20220103": "0007780000099999305707431336036523474090000120210419",
+                       "Trf_export_20220104": "000779202203270082"}
+
+
+def test_old2new_auto(cli_runner, tmpdir_factory):
+    indir = tmpdir_factory.mktemp('in')
+    # validation and sales records are both 52 characters wide
+    indir.join("export_1.dat").write_text("0007780000099999305707431336036523474090000120210419", encoding="utf-8")
+    indir.join("export_2.dat").write_text("0007782022032336036522966390004132371000010000395003", encoding="utf-8")
+    outdir = tmpdir_factory.mktemp('out')
+    result = cli_runner.invoke(cli, ["old2new", f'--output_dir={outdir}', "--parse_type=auto", str(indir), "JAC"])
+
+    assert result.exit_code == 0
+    outputs = {output.basename.rsplit("_", 1)[0]: output.read_text(encoding="utf-8") for output in outdir.listdir()}
+    assert outputs == {"Validation_export_1": "JAC-778;00000999993057074313;3603652347409;1;2021-04-19",
+                       "Sales_export_2": "JAC-778;2022-03-23;;4132371;3603652296639;1;395.00;3"}
+
+
+def test_old2new_auto_undetected(cli_runner, tmpdir_factory):
+    indir = tmpdir_factory.mktemp('in')
+    indir.join("export.dat").write_text("00077820220323360365229663900041323710000100003950", encoding="utf-8")
+    outdir = tmpdir_factory.mktemp('out')
+    result = cli_runner.invoke(cli, ["old2new", f'--output_dir={outdir}', "--parse_type=auto", str(indir), "JAC"])
+
+    assert result.exit_code != 0
+    assert not outdir.listdir()
+
+
+@pytest.fixture
+def conversion_server(tmpdir_factory, tmp_old_dir):
+    from cli_sols_auto.server import ConversionServer
+
+    server = ConversionServer(Path(tmpdir_factory.mktemp('serve')) / "sols_auto.sock", jobs=1, max_requests=1,
+                              root=Path(tmp_old_dir))
+    stop = threading.Event()
+    thread = threading.Thread(target=server.serve, args=(stop,))
+    thread.start()
+    yield server
+    stop.set()
+    thread.join()
+
+
+def _request(server, method, url, body=None, headers=None):
+    import http.client
+    import socket
+
+    class UnixConnection(http.client.HTTPConnection):
+        def connect(self):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(server.address)
+
+    connection = UnixConnection("localhost")
+    try:
+        connection.request(method, url, body=body, headers=headers or {},
+                           encode_chunked="Transfer-Encoding" in (headers or {}))
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+def test_serve(conversion_server, old_trf_file):
+    status, headers, body = _request(conversion_server, "POST", "/convert?direction=new2old&parse_type=TRF",
+                                     b"JAC-778;2022-03-26;8\nJAC-778;2022-03-27;82")
+    assert status == 200 and headers["X-Lines"] == "2"
+    assert body == b"000778202203260008\n000778202203270082"
+
+    # streamed body, with the type detected from its name
+    status, headers, body = _request(conversion_server, "POST", "/convert?direction=new2old&name=Traffic_1.csv",
+                                     iter([b"JAC-778;2022-03-26;8\n", b"JAC-778;2022-03-27;82"]),
+                                     {"Transfer-Encoding": "chunked"})
+    assert status == 200 and headers["X-Parse-Type"] == "TRF"
+    assert body == b"000778202203260008\n000778202203270082"
+
+    status, _, body = _request(conversion_server, "POST",
+                               f"/convert?direction=old2new&brand_code=JAC&path={old_trf_file}")
+    assert status == 200 and body.startswith(b"JAC-")
+
+    status, _, body = _request(conversion_server, "POST",
+                               f"/convert?direction=old2new&brand_code=JAC&path={old_trf_file}", b"000778")
+    assert status == 400 and b"path requests have no body" in body
+
+    status, _, body = _request(conversion_server, "POST", "/convert?direction=old2new&parse_type=TRF")
+    assert status == 400 and b"brand_code is required" in body
+
+    status, _, body = _request(conversion_server, "POST", "/convert?direction=new2old&parse_type=TRF", b"JAC-778")
+    assert status == 422 and b"JAC-778" not in body
+
+    status, _, body = _request(conversion_server, "GET", "/health")
+    health = json.loads(body)
+    assert status == 200 and health["converted"] == 3 and health["failed"] == 1 and health["lines"] >= 4
+
+    status, _, body = _request(conversion_server, "GET", "/metrics")
+    assert status == 200 and b'sols_auto_serve_requests_total{outcome="converted"} 3' in body
+
+
+def test_serve_path_root(tmpdir):
+    from cli_sols_auto.server import ConversionRequest
+
+    root = Path(tmpdir.mkdir("root")).resolve()
+    (root / "Trf_20220101.dat").write_text("000778202203260008", encoding="utf-8")
+    outside = Path(tmpdir.join("Trf_20220102.dat"))
+    outside.write_text("000778202203260008", encoding="utf-8")
+    (root / "escape.dat").symlink_to(outside)
+    query = {"direction": ["old2new"], "brand_code": ["JAC"]}
+    assert ConversionRequest(dict(query, path=["Trf_20220101.dat"]), root=root).path == str(root / "Trf_20220101.dat")
+    for path in (str(outside), "../Trf_20220102.dat", "escape.dat"):
+        with pytest.raises(ValueError, match="under the root directory"):
+            ConversionRequest(dict(query, path=[path]), root=root)
+    with pytest.raises(ValueError, match="no root directory"):
+        ConversionRequest(dict(query, path=[str(root / "Trf_20220101.dat")]))
+
+
+def test_serve_concurrency_limit(conversion_server):
+    assert conversion_server.acquire()
+    try:
+        status, headers, _ = _request(conversion_server, "POST", "/convert?direction=new2old&parse_type=TRF",
+                                      b"JAC-778;2022-03-26;8")
+    finally:
+        conversion_server.release()
+    assert status == 503 and headers["Retry-After"] == "1"
+    assert conversion_server.health()["rejected"] == 1
+
+
+def test_serve_http():
+    import http.client
+    from cli_sols_auto.server import ConversionServer
+
+    server = ConversionServer(("127.0.0.1", 0), jobs=1)
+    stop = threading.Event()
+    thread = threading.Thread(target=server.serve, args=(stop,))
+    thread.start()
+    try:
+        connection = http.client.HTTPConnection(*server.address)
+        connection.request("POST", "/convert?direction=new2old&parse_type=TRF", body=b"JAC-778;2022-03-26;8")
+        response = connection.getresponse()
+        assert response.status == 200 and response.read() == b"000778202203260008"
+        connection.close()
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_new2old_stdio(cli_runner):
+    result = cli_runner.invoke(cli, ["new2old", "--parse_type=auto", "-"],
+                               input=b"JAC-778;2022-03-26;8\nJAC-778;2022-03-27;82\n")
+    assert result.exit_code == 0
+    assert result.stdout_bytes == b"000778202203260008\n000778202203270082"
+
+
+@pytest.mark.parametrize("args, data, expect", [
+    (["new2old", "--parse_type=TRF", "-v", "-"], b"JAC-778;2022-03-26;8\n", b"000778202203260008"),
+    (["old2new", "--parse_type=TRF", "-v", "-", "JAC"], b"000778202203260008\n", b"JAC-778;2022-03-26;8"),
+])
+def test_stdio_verbose(args, data, expect):
+    result = subprocess.run([sys.executable, "-m", "cli_sols_auto", *args], input=data, capture_output=True,
+                            check=True, cwd=Path(__file__).parents[1])
+    assert result.stdout == expect
+    assert b"DEBUG MODE [ON]" in result.stderr and b"input_files = -" in result.stderr
+
+
+def test_old2new_stdio_compressed(cli_runner):
+    import gzip
+
+    result = cli_runner.invoke(cli, ["old2new", "--parse_type=TRF", "--compress=gz", "-", "JAC"],
+                               input=b"000778202203260008\n")
+    assert result.exit_code == 0
+    assert gzip.decompress(result.stdout_bytes) == b"JAC-778;2022-03-26;8"
+
+
+def test_stdio_unsupported_option(cli_runner):
+    result = cli_runner.invoke(cli, ["new2old", "--parse_type=TRF", "--manifest", "-"], input=b"")
+    assert result.exit_code == 2
+    assert "--manifest can not be used with -" in result.output
@@ -1,4 +1,8 @@
-from cli_sols_auto.app import get_file_list
+import io
+from pathlib import Path
+
+from cli_sols_auto.app import get_file_list, iter_files
+from cli_sols_auto.parser_sols_auto.tools import read_lines, split_file
 
 
 def test_new2old_file(new_trs_file):
@@ -15,3 +19,43 @@ def test_new_dir_files(tmp_new_dir, new_trf_file, new_val_file, new_trf_file_lig
     tmp_file = f"{tmp_new_dir}/Traffic*.csv"
     expect = get_file_list(str(tmp_file))
     assert len(expect) == 2
+
+
+def test_recursive_pattern(tmpdir_factory):
+    indir = tmpdir_factory.mktemp('in')
+    for name in ("Sales_1.csv", "Sales_2.csv.gz", "store/Sales_3.csv", "store/day/Sales_4.csv", "done/Sales_5.csv",
+                 "store/Traffic_1.csv"):
+        indir.join(name).write_text("", encoding="utf-8", ensure=True)
+
+    def names(*args, **kwargs):
+        return sorted(str(Path(file).relative_to(indir)) for file in get_file_list(*args, **kwargs))
+
+    assert names(f"{indir}/**/Sales_*.csv", exclude=["done"]) == [
+        "Sales_1.csv", "Sales_2.csv.gz", "store/Sales_3.csv", "store/day/Sales_4.csv"]
+    assert names(f"{indir}/*/Sales_*.csv") == ["done/Sales_5.csv", "store/Sales_3.csv"]
+    assert names(f"{indir}/**", include=["Traffic_*", "*.gz"]) == ["Sales_2.csv.gz", "store/Traffic_1.csv"]
+    assert names(str(indir), exclude=["*.gz"]) == ["Sales_1.csv"]
+
+
+def test_iter_files_lazy(tmp_new_dir, new_trs_file):
+    files = iter_files(f"{tmp_new_dir}/**")
+    assert next(files).parent == Path(tmp_new_dir)
+
+
+def test_split_file(old_trs_file):
+    file = Path(old_trs_file)
+    ranges = split_file(file, 100)
+    data = file.read_bytes()
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+    assert all(data[end - 1:end] == b"\n" for _, end in ranges[:-1])
+    assert [line for byte_range in ranges for line in read_lines(file, byte_range)] == list(read_lines(file))
+
+
+def test_read_text_lines_newlines(tmpdir):
+    # more than a block of 1 MiB, blocks ending inside lines are completed up to the next newline
+    data = "JAC-778;2022-03-29;8\r\nJAC-778;2022-03-30;é\rJAC-778;2022-03-31;5\n\n".encode("utf-8") * 30_000 + b"last"
+    expect = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8").read().split("\n")
+    file = Path(tmpdir.join("Traffic.csv"))
+    file.write_bytes(data)
+    assert list(read_lines(file)) == expect
@@ -1,4 +1,15 @@
+import io
+import random
+from decimal import Decimal, InvalidOperation
+from itertools import chain
+from pathlib import Path
+
+import pytest
+
 from cli_sols_auto.parser_sols_auto.new import (
+    get_batch_parser,
+    iter_parse,
+    parse_batches,
     parse,
     parse_sales,
     parse_interstore_transfer,
@@ -8,7 +19,8 @@ from cli_sols_auto.parser_sols_auto.new import (
 
 
 # Test parsing a line
-from cli_sols_auto.parser_sols_auto.tools import FileType
+from cli_sols_auto.parser_sols_auto.chunked import convert_chunked
+from cli_sols_auto.parser_sols_auto.tools import FileType, read_lines, write_batches
 
 
 def test_line_new2old_ven():
@@ -54,3 +66,260 @@ def test_new2old_trf(new_trf_file, old_trf_file):
 def test_new2old_trs(new_trs_file, old_trs_file):
     expect = old_trs_file.read_text(encoding="utf-8")
     assert parse(new_trs_file, FileType('TRS')) == expect
+
+
+# Test streaming a file batch by batch
+def test_new2old_ven_batches(new_ven_file, old_ven_file):
+    expect = old_ven_file.read_text(encoding="utf-8")
+    output = io.BytesIO()
+    assert write_batches(parse_batches(read_lines(Path(new_ven_file)), FileType('VEN'), batch_size=3), output) == 4
+    assert output.getvalue().decode("utf-8") == expect
+
+
+# Test converting a file split in chunks
+def test_new2old_ven_chunked(new_ven_file, old_ven_file, tmpdir):
+    expect = old_ven_file.read_text(encoding="utf-8")
+    with Path(tmpdir.join("Ven.dat")).open("wb") as output:
+        assert convert_chunked(Path(new_ven_file), output, FileType('VEN'), jobs=2, chunk_size=100) == 4
+    assert tmpdir.join("Ven.dat").read_text(encoding="utf-8") == expect
+    assert len(tmpdir.listdir()) == 1
+
+
+# Test the numpy engine
+@pytest.mark.parametrize("file_type, new_file, old_file", [
+    ('VEN', 'new_ven_file', 'old_ven_file'),
+    ('VAL', 'new_val_file', 'old_val_file'),
+    ('TRF', 'new_trf_file', 'old_trf_file'),
+    ('TRS', 'new_trs_file', 'old_trs_file'),
+])
+def test_new2old_numpy(request, file_type, new_file, old_file):
+    pytest.importorskip("numpy")
+    expect = request.getfixturevalue(old_file).read_text(encoding="utf-8")
+    new_path = Path(request.getfixturevalue(new_file))
+    assert "\n".join(chain.from_iterable(iter_parse(new_path, FileType(file_type), "numpy"))) == expect
+
+
+@pytest.mark.parametrize("quantity, price", [
+    ("1", "0.29"), ("-1", "0,5"), ("-0", "395."), ("12", "0"), ("0003", "1234567.89"), ("-1234", "12,3"),
+    ("0", "395.00"), ("+1", "395.00"), ("-00001", "395.00"), ("1", "395.999"), ("1", "1e2"), ("123456", "1"),
+])
+def test_new2old_numpy_sales(quantity, price):
+    pytest.importorskip("numpy")
+    lines = [f"JAC-778;2022-03-23;;4132369;3603652236628;{quantity};{price};1",
+             "JAC-1;2022-03-23;14-14-25;41;36;1;3;12;JAC-1"]
+    assert list(get_batch_parser("numpy")(lines, FileType('VEN'))) == [[parse_sales(line) for line in lines]]
+
+
+def test_new2old_numpy_errors():
+    pytest.importorskip("numpy")
+    with pytest.raises(ValueError):
+        list(get_batch_parser("numpy")(["2021-11-01;;OKA-1210;OKA-1889;3604277211410;-5"], FileType('TRS')))
+    with pytest.raises(ValueError):
+        list(get_batch_parser("numpy")(["JAC-778;2022-03-23;;4132369;3603652236628;1;3.9.5;1"], FileType('VEN')))
+
+
+def test_new2old_numpy_missing(monkeypatch):
+    new_numpy = pytest.importorskip("cli_sols_auto.parser_sols_auto.new_numpy")
+    monkeypatch.setattr(new_numpy, "numpy", None)
+    assert get_batch_parser("numpy") is parse_batches
+
+
+# Test the bytes engine
+@pytest.mark.parametrize("file_type, new_file, old_file", [
+    ('VEN', 'new_ven_file', 'old_ven_file'),
+    ('VAL', 'new_val_file', 'old_val_file'),
+    ('TRF', 'new_trf_file', 'old_trf_file'),
+    ('TRS', 'new_trs_file', 'old_trs_file'),
+])
+def test_new2old_bytes(request, file_type, new_file, old_file):
+    expect = request.getfixturevalue(old_file).read_binary()
+    new_path = Path(request.getfixturevalue(new_file))
+    assert b"\n".join(chain.from_iterable(iter_parse(new_path, FileType(file_type), "bytes"))) == expect
+
+
+def test_new2old_bytes_not_ascii(tmpdir):
+    file = Path(tmpdir.join("Traffic.csv"))
+    file.write_text("JAC-778;2022-03-29;8\nJAC-é;2022-03-29;8\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="offset 25"):
+        list(iter_parse(file, FileType('TRF'), "bytes"))
+
+
+@pytest.mark.parametrize("engine", ["python", "numpy", "bytes"])
+def test_convert_file_object(new_ven_file, engine):
+    from cli_sols_auto.parser_sols_auto import convert
+
+    with open(new_ven_file, "rb") as source:
+        converted = list(convert(source, "new2old", "VEN", engine=engine))
+        assert not source.closed
+    expected = parse(Path(new_ven_file), FileType.VEN).split("\n")
+    assert [line.decode("ascii") if isinstance(line, bytes) else line for line in converted] == expected
+
+
+def test_convert_lazy():
+    from cli_sols_auto.parser_sols_auto import convert
+
+    def lines():
+        yield "JAC-778;2022-03-29;8"
+        raise AssertionError("Read past the first batch")
+
+    converted = convert(lines(), "new2old", "TRF")
+    with pytest.raises(AssertionError):
+        next(converted)
+    with pytest.raises(ValueError, match="Incorrect input data"):
+        list(convert(["JAC-778;2022-03-29"], "new2old", "TRF"))
+
+
+@pytest.mark.parametrize("file_type, new_file", [
+    ('VEN', 'new_ven_file'),
+    ('VAL', 'new_val_file'),
+    ('TRF', 'new_trf_file'),
+    ('TRS', 'new_trs_file'),
+])
+def test_parse_record_batches(request, file_type, new_file):
+    from cli_sols_auto.parser_sols_auto.new import parse_record_batches
+
+    new_path = Path(request.getfixturevalue(new_file))
+    lines = new_path.read_text(encoding="utf-8").splitlines()
+    batches = list(parse_record_batches(lines, FileType(file_type), batch_size=2))
+    assert sum(len(batch) for batch in batches) == len(lines)
+    expect = parse(new_path, FileType(file_type)).split("\n")
+    assert list(chain.from_iterable(batch.to_old() for batch in batches)) == expect
+
+
+def test_record_batch_columns():
+    numpy = pytest.importorskip("numpy")
+    from cli_sols_auto.parser_sols_auto import RecordBatch
+
+    batch = RecordBatch.from_new([b"JAC-778;2022-03-23;;4132369;3603652236628;-1;395.99;1",
+                                  b"JAC-779;2022-03-24;;4132370;3603652236629;2;0,29;2"], FileType.VEN)
+    assert batch.column("quantity").tolist() == [-1, 2]
+    assert batch.column("price").tolist() == [39599, 29]
+    assert batch.row(-1) == (779, 20220324, b"3603652236629", b"0004132370", 2, 29, b"2")
+    columns = batch.to_numpy()
+    assert columns["barcode"].tolist() == [b"3603652236628", b"3603652236629"]
+    # arrays share the memory of the batch
+    assert numpy.shares_memory(columns["price"], numpy.asarray(batch.column("price")))
+    assert batch.nbytes == 2 * (4 + 4 + 13 + 10 + 4 + 4 + 1)
+    with pytest.raises(KeyError):
+        batch.column("sales_time")
+    with pytest.raises(ValueError, match="Incorrect input data"):
+        RecordBatch.from_new(["JAC-778;2022-03-29"], FileType.TRF)
+
+
+@pytest.mark.parametrize("file_type, lines", [
+    ('VEN', ["JAC-778;2022-03-23;;A132371;3603652236628;1;395.00;1", "JAC-778;2022-03-23;;4132369;3603652236628;0;1;2",
+             "JAC-778;2022-03-23;;4132369;3603652236628;-12;0,5;3"]),
+    ('TRF', ["JAC-778;2022-03-29;8a", "JAC-778;2022-03-30; 12"]),
+    ('VAL', ["JAC-778;00000999993057074313;3603652347409;1 ;2021-04-19", "JAC-778;A1;3603652347409;12;2021-04-19"]),
+    ('TRS', ["2021-11-01;;OKA-1210;OKA-1889;3604277211410;5"]),
+])
+def test_record_batch_conversions(file_type, lines):
+    from cli_sols_auto.parser_sols_auto import RecordBatch
+    from cli_sols_auto.parser_sols_auto.schema import compile_new2old, compile_old2new
+
+    new2old, old2new = compile_new2old(FileType(file_type)), compile_old2new(FileType(file_type))
+    expect = [new2old(line) for line in lines]
+    assert RecordBatch.from_new(lines, FileType(file_type)).to_old() == expect
+    for record in expect:
+        try:
+            new_line = old2new(record, "JAC")
+        except ValueError:
+            # conversions may write records which can not be converted back
+            with pytest.raises(ValueError):
+                RecordBatch.from_old([record], FileType(file_type)).to_new("JAC")
+        else:
+            assert RecordBatch.from_old([record], FileType(file_type)).to_new("JAC") == [new_line]
+
+
+def test_record_batch_empty():
+    from cli_sols_auto.parser_sols_auto import RecordBatch
+
+    batch = RecordBatch.from_old([], FileType.VAL)
+    assert len(batch) == 0 and batch.column("barcode").tobytes() == b"" and batch.column("store_code").tolist() == []
+    assert batch.to_old() == [] and batch.to_new("JAC") == []
+
+
+def test_schema_date_format(monkeypatch):
+    from cli_sols_auto.parser_sols_auto import schema
+
+    trf = schema.SCHEMAS[FileType.TRF]
+    fields = tuple(field._replace(date_format="%d/%m/%Y") if field.kind == schema.Kind.DATE else field
+                   for field in trf.fields)
+    monkeypatch.setitem(schema.SCHEMAS, FileType.TRF, trf._replace(fields=fields))
+    # compiled converters are cached, the uncached compilers read the schema again
+    new2old, old2new = schema.compile_new2old.__wrapped__, schema.compile_old2new.__wrapped__
+    assert new2old(FileType.TRF)("JAC-778;29/03/2022;8") == "000778202203290008"
+    assert new2old(FileType.TRF, True)(b"JAC-778;29/03/2022;8") == b"000778202203290008"
+    assert old2new(FileType.TRF)("000778202203290008", "JAC") == "JAC-778;29/03/2022;8"
+    with pytest.raises(ValueError):
+        new2old(FileType.TRF)("JAC-778;2022-03-29;8")
+    # the vectorized engines only handle the default format
+    assert not schema.has_default_dates(FileType.TRF) and schema.has_default_dates(FileType.VEN)
+
+
+# Per line parsers as they were before records were described by schemas, compiled converters must match them
+def _reference_new2old_sales(line):
+    data = line.split(";")
+    if len(data) < 8 or len(data) > 9:
+        raise ValueError(f"Incorrect input data {line}")
+    store_code, sales_date, _, receipt_number, barcode, quantity, price, pos_id = data[:8]
+    quantity = f'{quantity:0>5}' if int(quantity) > 0 else f'-{abs(int(quantity)):0>4}'
+    try:
+        price = int(Decimal(price.replace(',', '.')) * 100)
+    except InvalidOperation:
+        raise ValueError(f"Incorrect input data {line}")
+    return f"{store_code[4:]:0>6}{sales_date.replace('-', '')}{barcode:0>13}{receipt_number:0>10}{quantity}" \
+           f"{price:0>9}{pos_id[0]}"
+
+
+def _reference_new2old_traffic(line):
+    data = line.split(";")
+    if len(data) < 3 or len(data) > 6:
+        raise ValueError(f"Incorrect input data {line}")
+    store_code, traffic_date, traffic_number = data[:3]
+    return f"{store_code[4:]:0>6}{traffic_date.replace('-', '')}{traffic_number:0>4}"
+
+
+def _reference_new2old_transfer(line):
+    data = line.split(";")
+    if len(data) != 6:
+        raise ValueError(f"Incorrect input data {line}")
+    transfer_date, _, sender_code, receiver_code, barcode, quantity = data
+    if not quantity.isdigit() or int(quantity) < 0:
+        raise ValueError(f"Incorrect input data {line}")
+    return f"{transfer_date.replace('-', '')}{sender_code[4:]:0>6}{receiver_code[4:]:0>6}{barcode:0>13}" \
+           f"{quantity:0>4}"
+
+
+def _reference_new2old_validation(line):
+    data = line.split(";")
+    if len(data) < 5 or len(data) > 7:
+        raise ValueError(f"Incorrect input data {line}")
+    store_code, parcel_number, barcode, quantity, reception_date = data[:5]
+    return f"{store_code[4:]:0>6}{parcel_number:0>20}{barcode:0>13}{quantity:0>5}{reception_date.replace('-', '')}"
+
+
+def _new2old_or_error(parser, line):
+    try:
+        return parser(line)
+    except (ValueError, IndexError):
+        # an empty pos_id raised IndexError
+        return ValueError
+
+
+@pytest.mark.parametrize("file_type, reference", [
+    ('VEN', _reference_new2old_sales),
+    ('TRF', _reference_new2old_traffic),
+    ('TRS', _reference_new2old_transfer),
+    ('VAL', _reference_new2old_validation),
+])
+def test_new2old_schema_random_lines(file_type, reference):
+    from cli_sols_auto.parser_sols_auto.schema import compile_new2old, SCHEMAS
+
+    rng = random.Random(6)
+    schema, converter = SCHEMAS[FileType(file_type)], compile_new2old(FileType(file_type))
+    characters = "0123456789" * 4 + "-.,; a"
+    for _ in range(3000):
+        count = rng.randint(len(schema.columns) - 1, len(schema.columns) + len(schema.optional) + 1)
+        line = ";".join("".join(rng.choice(characters) for _ in range(rng.randint(0, 12))) for _ in range(count))
+        assert _new2old_or_error(converter, line) == _new2old_or_error(reference, line), line
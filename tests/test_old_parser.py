@@ -1,5 +1,16 @@
+import io
+import random
+from datetime import datetime
+from itertools import chain
+from pathlib import Path
+
+import pytest
+
 import cli_sols_auto.tools
 from cli_sols_auto.parser_sols_auto.old import (
+    get_batch_parser,
+    iter_parse,
+    parse_batches,
     parse,
     parse_sales,
     parse_interstore_transfer,
@@ -8,7 +19,9 @@ from cli_sols_auto.parser_sols_auto.old import (
 )
 
 
-from cli_sols_auto.parser_sols_auto.tools import FileType
+from cli_sols_auto.parser_sols_auto.chunked import convert_chunked
+from cli_sols_auto.parser_sols_auto.records import DatRecords
+from cli_sols_auto.parser_sols_auto.tools import FileType, read_lines, write_batches
 
 
 # Test parsing a line
@@ -36,6 +49,19 @@ def test_line_old2new_val():
     assert parse_delivery_validation(old, 'JAC') == expect
 
 
+@pytest.mark.parametrize("old", [
+    "000778202203233603652236628000413236900001000039500",
+    "00077820220323360365223662800041323690000100003950011",
+])
+def test_line_old2new_width(old):
+    with pytest.raises(ValueError, match="Incorrect input data"):
+        parse_sales(old, 'JAC')
+    with pytest.raises(ValueError, match="Incorrect input data"):
+        list(parse_batches([old.encode()], FileType('VEN'), 'JAC'))
+    with pytest.raises(ValueError, match="Incorrect input data"):
+        list(get_batch_parser("numpy")([old], FileType('VEN'), 'JAC'))
+
+
 # Test parsing a file
 def test_new2old_ven(new_ven_file_light, old_ven_file):
     expect = new_ven_file_light.read_text(encoding="utf-8")
@@ -55,3 +81,198 @@ def test_new2old_trf(new_trf_file_light, old_trf_file):
 def test_new2old_trs(new_trs_file_light, old_trs_file):
     expect = new_trs_file_light.read_text(encoding="utf-8")
     assert parse(old_trs_file, FileType('TRS'), 'OKA') == expect
+
+
+# Test streaming a file batch by batch
+def test_old2new_val_batches(new_val_file_light, old_val_file):
+    expect = new_val_file_light.read_text(encoding="utf-8")
+    output = io.BytesIO()
+    assert write_batches(parse_batches(read_lines(Path(old_val_file)), FileType('VAL'), 'JAC', batch_size=3), output) == 10
+    assert output.getvalue().decode("utf-8") == expect
+
+
+# Test converting a file split in chunks
+def test_old2new_trs_chunked(new_trs_file_light, old_trs_file, tmpdir):
+    expect = new_trs_file_light.read_text(encoding="utf-8")
+    with Path(tmpdir.join("Transfers.csv")).open("wb") as output:
+        assert convert_chunked(Path(old_trs_file), output, FileType('TRS'), 'OKA', jobs=3, chunk_size=100) == 16
+    assert tmpdir.join("Transfers.csv").read_text(encoding="utf-8") == expect
+
+
+# Test the numpy engine
+@pytest.mark.parametrize("file_type, old_file, new_file, brand", [
+    ('VEN', 'old_ven_file', 'new_ven_file_light', 'JAC'),
+    ('VAL', 'old_val_file', 'new_val_file_light', 'JAC'),
+    ('TRF', 'old_trf_file', 'new_trf_file_light', 'JAC'),
+    ('TRS', 'old_trs_file', 'new_trs_file_light', 'OKA'),
+])
+def test_old2new_numpy(request, file_type, old_file, new_file, brand):
+    pytest.importorskip("numpy")
+    expect = request.getfixturevalue(new_file).read_text(encoding="utf-8")
+    old_path = Path(request.getfixturevalue(old_file))
+    assert "\n".join(chain.from_iterable(iter_parse(old_path, FileType(file_type), brand, "numpy"))) == expect
+
+
+def test_old2new_numpy_edge_cases():
+    pytest.importorskip("numpy")
+    lines = [
+        "0000002022032336036522366280000000000000000000000001",
+        "9999992022123136036522366289999999999-99999999999999",
+        "0007782022022936036522366280004132369000010000395001",
+    ]
+    expect = [parse_sales(line, 'J{}') for line in lines[:2]]
+    assert list(parse_batches(lines[:2], FileType('VEN'), 'J{}')) == [expect]
+    assert list(get_batch_parser("numpy")(lines[:2], FileType('VEN'), 'J{}')) == [expect]
+    with pytest.raises(ValueError):
+        list(get_batch_parser("numpy")(lines, FileType('VEN'), 'JAC'))
+
+
+def test_old2new_numpy_cents_not_digits():
+    pytest.importorskip("numpy")
+    line = "00077820220323360365229663900041323710000100003951x3"
+    with pytest.raises(ValueError, match="invalid literal"):
+        list(get_batch_parser("numpy")([line], FileType('VEN'), 'JAC'))
+
+
+# Test the bytes engine
+def test_old2new_bytes(old_ven_file, new_ven_file_light, tmpdir):
+    expect = new_ven_file_light.read_binary()
+    assert b"\n".join(chain.from_iterable(iter_parse(Path(old_ven_file), FileType('VEN'), 'JAC', "bytes"))) == expect
+    with Path(tmpdir.join("Ventes.csv")).open("wb") as output:
+        assert convert_chunked(Path(old_ven_file), output, FileType('VEN'), 'JAC', jobs=2, chunk_size=100,
+                               engine="bytes") == 4
+    assert tmpdir.join("Ventes.csv").read_binary() == expect
+
+
+# Test random access to records
+def test_old2new_records(old_val_file, new_val_file_light):
+    expect = new_val_file_light.read_text(encoding="utf-8").split("\n")
+    with DatRecords(Path(old_val_file), FileType('VAL'), 'JAC') as records:
+        assert len(records) == len(expect)
+        assert records[3] == expect[3]
+        assert records[-1] == expect[-1]
+        assert records[1:8:3] == expect[1:8:3]
+        assert list(records) == expect
+        with pytest.raises(IndexError):
+            records[len(expect)]
+
+
+@pytest.mark.parametrize("data, length", [(b"", 0), (b"000778202203290008\r\n000778202203300012\r\n", 2)])
+def test_old2new_records_terminators(tmpdir, data, length):
+    file = Path(tmpdir.join("Traffic.dat"))
+    file.write_bytes(data)
+    with DatRecords(file, FileType('TRF'), 'JAC') as records:
+        assert list(records) == ['JAC-778;2022-03-29;8', 'JAC-778;2022-03-30;12'][:length]
+
+
+def test_old2new_records_width(tmpdir, monkeypatch):
+    import mmap
+
+    maps = []
+
+    class TrackedMap(mmap.mmap):
+        def __init__(self, *args, **kwargs):
+            maps.append(self)
+
+    monkeypatch.setattr(mmap, "mmap", TrackedMap)
+    file = Path(tmpdir.join("Traffic.dat"))
+    file.write_bytes(b"0007782022032900\n")
+    with pytest.raises(ValueError):
+        DatRecords(file, FileType('TRF'), 'JAC')
+    mapped, = maps
+    assert mapped.closed
+    file.write_bytes(b"00077820220329008\n0007782022033000123\n")
+    with DatRecords(file, FileType('TRF'), 'JAC') as records:
+        with pytest.raises(ValueError):
+            records[0]
+
+
+# Test compressed files
+def test_old2new_bytes_gzip(old_ven_file, new_ven_file_light, tmpdir):
+    import gzip
+    file = Path(tmpdir.join("Ven_20220101.dat.gz"))
+    file.write_bytes(gzip.compress(old_ven_file.read_binary()))
+    expect = new_ven_file_light.read_text(encoding="utf-8")
+    assert "\n".join(chain.from_iterable(iter_parse(file, FileType('VEN'), 'JAC'))) == expect
+    assert b"\n".join(chain.from_iterable(iter_parse(file, FileType('VEN'), 'JAC', "bytes"))) == expect.encode()
+
+
+def test_convert_chunks_to_sink(old_trf_file):
+    from cli_sols_auto.parser_sols_auto import convert
+
+    data = Path(old_trf_file).read_bytes()
+    sink = io.StringIO()
+    count = convert((data[i:i + 7] for i in range(0, len(data), 7)), "old2new", None, "JAC", sink=sink)
+    assert sink.getvalue() == parse(Path(old_trf_file), FileType.TRF, "JAC")
+    assert count == len(sink.getvalue().split("\n"))
+    with pytest.raises(ValueError, match="brand_code is required"):
+        convert([data], "old2new", "TRF")
+
+
+@pytest.mark.parametrize("file_type, old_file", [
+    ('VEN', 'old_ven_file'),
+    ('VAL', 'old_val_file'),
+    ('TRF', 'old_trf_file'),
+    ('TRS', 'old_trs_file'),
+])
+def test_parse_record_batches(request, file_type, old_file):
+    from cli_sols_auto.parser_sols_auto.old import parse_record_batches
+
+    old_path = Path(request.getfixturevalue(old_file))
+    lines = old_path.read_text(encoding="utf-8").splitlines()
+    batches = list(parse_record_batches(lines, FileType(file_type), batch_size=3))
+    assert list(chain.from_iterable(batch.to_old() for batch in batches)) == lines
+    expect = parse(old_path, FileType(file_type), "JAC").split("\n")
+    assert list(chain.from_iterable(batch.to_new("JAC") for batch in batches)) == expect
+    with pytest.raises(ValueError, match="Incorrect input data"):
+        list(parse_record_batches([lines[0][:-1]], FileType(file_type)))
+
+
+# Per line parsers as they were before records were described by schemas, compiled converters must match them
+def _reference_old2new_sales(line, brand):
+    sales_date = datetime.strptime(line[6:14], '%Y%m%d').strftime('%Y-%m-%d')
+    quantity = int(line[38:42]) * -1 if line[37] == '-' else int(line[37:42])
+    return f"{brand}-{int(line[:6])};{sales_date};;{int(line[27:37])};{line[14:27]};{quantity};" \
+           f"{float(int(line[42:51]) / 100):.2f};{line[-1]}"
+
+
+def _reference_old2new_traffic(line, brand):
+    traffic_date = datetime.strptime(line[6:14], '%Y%m%d').strftime('%Y-%m-%d')
+    return f"{brand}-{int(line[:6])};{traffic_date};{int(line[14:18])}"
+
+
+def _reference_old2new_transfer(line, brand):
+    transfer_date = datetime.strptime(line[:8], '%Y%m%d').strftime('%Y-%m-%d')
+    return f"{transfer_date};;{brand}-{int(line[8:14])};{brand}-{int(line[14:20])};{line[20:33]};{int(line[-4:])}"
+
+
+def _reference_old2new_validation(line, brand):
+    reception_date = datetime.strptime(line[-8:], '%Y%m%d').strftime('%Y-%m-%d')
+    return f"{brand}-{int(line[:6])};{line[6:26]};{line[26:39]};{int(line[39:44])};{reception_date}"
+
+
+def _old2new_or_error(parser, line):
+    try:
+        return parser(line, "JAC")
+    except ValueError:
+        return ValueError
+
+
+@pytest.mark.parametrize("file_type, reference", [
+    ('VEN', _reference_old2new_sales),
+    ('TRF', _reference_old2new_traffic),
+    ('TRS', _reference_old2new_transfer),
+    ('VAL', _reference_old2new_validation),
+])
+def test_old2new_schema_random_lines(file_type, reference):
+    from cli_sols_auto.parser_sols_auto.schema import compile_old2new, Kind, SCHEMAS
+
+    rng = random.Random(6)
+    schema, converter = SCHEMAS[FileType(file_type)], compile_old2new(FileType(file_type))
+    characters = "0123456789" * 6 + "- +_a"
+    for _ in range(3000):
+        # records have the width of the type, the first parsers converted shifted fields of other widths
+        line = "".join(f"{rng.randint(1, 9999):04d}{rng.randint(1, 12):02d}{rng.randint(1, 31):02d}"
+                       if field.kind == Kind.DATE and rng.random() < 0.8
+                       else "".join(rng.choice(characters) for _ in range(field.width)) for field in schema.fields)
+        assert _old2new_or_error(converter, line) == _old2new_or_error(reference, line), line